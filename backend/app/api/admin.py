@@ -0,0 +1,59 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from ..dependencies import require_admin
+from ..schemas import ProfilerSettings
+from ..services.profiler import profiler
+from ..services.analyzer import audio_index, features_path
+from ..services.transcoder import transcoder
+from ..services.blob_store import blob_store
+from ..services.youtube_quota import youtube_quota
+from ..database import get_db
+from ..models.user import BlobAlias
+from sqlalchemy.orm import Session
+
+router = APIRouter(tags=["admin"], dependencies=[Depends(require_admin)])
+
+@router.get("/profiler")
+def profiler_status():
+    """Текущие настройки сэмплирования и последние снятые профили"""
+    return profiler.status()
+
+@router.post("/profiler")
+def configure_profiler(settings: ProfilerSettings):
+    """
+    Профилировать долю трафика sample_rate в течение duration_seconds.
+    Отдельный запрос можно профилировать заголовками X-Admin-Token и X-Profile: 1 —
+    его профиль будет доступен по X-Request-ID из ответа.
+    """
+    profiler.configure(settings.sample_rate, settings.duration_seconds)
+    return profiler.status()
+
+@router.get("/profiles/{request_id}", response_class=PlainTextResponse)
+def get_profile(request_id: str):
+    """Профиль запроса в формате collapsed stacks (flamegraph.pl, speedscope, inferno)"""
+    session = profiler.get(request_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return PlainTextResponse(
+        session.collapsed(),
+        headers={"Content-Disposition": f'attachment; filename="profile-{request_id}.folded"'}
+    )
+
+@router.post("/analyzer/backfill")
+def analyzer_backfill(db: Session = Depends(get_db)):
+    """Ставит в очередь анализ всех скачанных треков, у которых ещё нет признаков"""
+    if not transcoder.available():
+        raise HTTPException(status_code=503, detail="Нет ffmpeg")
+    scheduled = 0
+    for alias in db.query(BlobAlias).filter(BlobAlias.name.like("youtube:%")):
+        video_id = alias.name.split(":", 1)[1]
+        if blob_store.exists(alias.sha256) and not os.path.exists(features_path(video_id)):
+            audio_index.schedule(blob_store.path(alias.sha256), video_id)
+            scheduled += 1
+    return {"scheduled": scheduled, "indexed": audio_index.size()}
+
+@router.get("/youtube-quota")
+def youtube_quota_status():
+    """Расход квоты YouTube Data API за текущие сутки и стадия деградации поиска"""
+    return youtube_quota.status()
@@ -0,0 +1,28 @@
+import re
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from ..services.blob_store import blob_store
+
+router = APIRouter(tags=["blobs"])
+
+# Содержимое по хешу не меняется никогда — кешировать можно без перепроверки
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@router.get("/{sha256}")
+def get_blob(sha256: str, request: Request):
+    """
+    Файл из content-addressed хранилища (аудио, сгенерированные биты, загрузки)
+    """
+    if not re.fullmatch(r"[0-9a-f]{64}", sha256):
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    blob = blob_store.get(sha256)
+    if blob is None or not blob_store.exists(sha256):
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": f'"{sha256}"'}
+    if request.headers.get("if-none-match") in (f'"{sha256}"', f'W/"{sha256}"', "*"):
+        return Response(status_code=304, headers=headers)
+    filename = f"{sha256[:12]}.{blob.ext}" if blob.ext else sha256[:12]
+    return FileResponse(
+        blob_store.path(sha256), media_type=blob.content_type, headers=headers,
+        filename=filename, content_disposition_type="inline"
+    )
@@ -1,17 +1,28 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status
-from fastapi.responses import JSONResponse
-from typing import Dict, Any, List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Dict, Any, List, Optional, Set
 import json
 from ..services.openai_service import OpenAIService
-from ..config import MAX_FILE_SIZE, ALLOWED_EXTENSIONS
-from ..dependencies import get_current_user
+from ..services.matcher import matcher
+from ..services.mood_index import mood_index
+from ..services.llm_scheduler import llm_scheduler, QueueFullError
+from ..services.beat_jobs import beat_jobs, job_status
+from ..services.tracing import span
+from ..services.shared_cache import shared_cache
+from ..services import list_versions
+from ..services.search import search_index
+from ..services.retention import chat_purger, hidden_up_to, request_history_deletion
+from ..config import MAX_FILE_SIZE, ALLOWED_EXTENSIONS, IMAGE_BATCH_MAX_FILES, RECOMMEND_LATENCY_BUDGET, BEAT_WEBHOOK_SECRET, SEARCH_MAX_LIMIT
+from ..dependencies import get_current_user, get_optional_user
 from sqlalchemy.orm import Session
 from ..database import get_db
 from ..models.user import SavedSong, User, ChatMessage
 from ..schemas import ChatMessageCreate, ChatMessageOut, GenerateBeatRequest, GenerateBeatResponse, GenerateBeatStatusRequest
 import asyncio
+import math
 import os
-import requests
+import secrets
+import uuid
 
 router = APIRouter(tags=["chat"])
 
@@ -21,13 +32,41 @@ openai_service = OpenAIService()
 AUDIO_CACHE_DIR = "audio_cache"
 os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
 
+# Ответы LLM, которые не уложились в бюджет задержки, лежат в shared_cache под
+# pending_recommendations:<user_id>:<token> — повторный опрос может прийти в любой воркер
+PENDING_RECOMMENDATIONS_PREFIX = "pending_recommendations:"
+PENDING_RECOMMENDATIONS_TTL = 300
+# Сильные ссылки на незавершённые запросы к LLM, пока они не допишут результат
+_pending_futures: Set[asyncio.Future] = set()
+
+def _too_many_requests(e: QueueFullError) -> HTTPException:
+    """Планировщик LLM отказал сразу — отвечаем 429 с Retry-After"""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
+def _client_key(request: Request, user: Optional[User] = None) -> str:
+    """
+    Ключ для лимитов на пользователя: id вошедшего пользователя или IP клиента.
+    Параметру user_id из запроса не доверяем — его может подставить кто угодно
+    """
+    if user is not None:
+        return f"user:{user.id}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
 @router.post("/analyze-media")
 async def analyze_media(
+    request: Request,
     file: UploadFile = File(...),
-    user_id: str = None
+    user_id: str = None,
+    fast: bool = False,
+    current_user: Optional[User] = Depends(get_optional_user)
 ):
     """
-    Анализирует загруженный медиафайл и возвращает анализ настроения
+    Анализирует загруженный медиафайл и возвращает анализ настроения.
+    fast=true — для картинок мгновенный ответ по локальному анализу цвета, без LLM
     """
     try:
         print(f"🔍 Получен файл: {file.filename}, размер: {file.size}, тип: {file.content_type}")
@@ -51,7 +90,7 @@ async def analyze_media(
         print("🚀 Начинаем анализ медиафайла...")
         
         # Анализируем медиафайл
-        analysis = await openai_service.analyze_media_mood(file)
+        analysis = await openai_service.analyze_media_mood(file, user_key=_client_key(request, current_user), fast=fast)
         
         print(f"📊 Результат анализа: {analysis}")
         
@@ -60,10 +99,72 @@ async def analyze_media(
         
         return JSONResponse(content=analysis)
         
+    except QueueFullError as e:
+        raise _too_many_requests(e)
     except Exception as e:
         print(f"❌ Ошибка в analyze_media: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка анализа файла: {str(e)}")
 
+@router.post("/analyze-media/batch")
+async def analyze_media_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    user_id: str = None,
+    fast: bool = False,
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Анализ нескольких фото для одного поста: картинки уменьшаются параллельно и
+    уходят в Vision по несколько штук в одном запросе. Возвращает анализ каждой
+    картинки (в порядке загрузки) и общее настроение набора
+    """
+    if len(files) > IMAGE_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Не больше {IMAGE_BATCH_MAX_FILES} файлов за раз")
+    images = []
+    for file in files:
+        if file.size and file.size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=400, detail=f"Файл {file.filename} слишком большой (максимум 10MB)")
+        if openai_service._get_file_type(file.filename) != "image":
+            raise HTTPException(status_code=400, detail=f"{file.filename}: в пакете поддерживаются только изображения")
+        images.append((file.filename, await file.read()))
+    print(f"🔍 Пакет из {len(images)} изображений")
+    try:
+        return await openai_service.analyze_image_batch(images, user_key=_client_key(request, current_user), fast=fast)
+    except QueueFullError as e:
+        raise _too_many_requests(e)
+    except Exception as e:
+        print(f"❌ Ошибка в analyze_media_batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ошибка анализа файлов: {str(e)}")
+
+def _build_preferences(db: Session, current_user: User):
+    """
+    Предпочтения для промпта: глобальные, персональные (по saved_songs) и
+    коллаборативные подсказки локального item-item рекомендателя.
+    Запросы к БД и перестроение матриц синхронные — вызывается через asyncio.to_thread
+    """
+    global_prefs = {
+        "top_genres": ["pop", "electronic", "indie"],
+        "top_artists": ["The Weeknd", "Dua Lipa", "Post Malone"],
+        "top_tracks": ["Blinding Lights", "Levitating", "Circles"]
+    }
+    saved_songs = db.query(SavedSong).filter(SavedSong.user_id == current_user.id).all()
+    personal_prefs = {
+        "top_genres": [],
+        "top_artists": list({s.artist for s in saved_songs if s.artist}),
+        "top_tracks": list({s.title for s in saved_songs if s.title})
+    } if saved_songs else global_prefs
+    # Локальный item-item рекомендатель: "те, кто сохранил X, сохранили и Y"
+    matcher.refresh(db)
+    collaborative = matcher.recommend_for_user(current_user.id, n=5)
+    if collaborative:
+        personal_prefs = {
+            **personal_prefs,
+            "similar_tracks": [
+                f"{t['artist']} - {t['title']}" if t["artist"] else t["title"] for t in collaborative
+            ]
+        }
+    return global_prefs, personal_prefs, collaborative
+
 @router.post("/get-recommendations")
 async def get_music_recommendations(
     mood_analysis: Dict[str, Any],
@@ -74,47 +175,154 @@ async def get_music_recommendations(
     Получает две подборки: 5 персональных (по saved_songs) и 5 глобальных (по mood_analysis)
     """
     try:
-        global_prefs = {
-            "top_genres": ["pop", "electronic", "indie"],
-            "top_artists": ["The Weeknd", "Dua Lipa", "Post Malone"],
-            "top_tracks": ["Blinding Lights", "Levitating", "Circles"]
-        }
-        saved_songs = db.query(SavedSong).filter(SavedSong.user_id == current_user.id).all()
-        personal_prefs = {
-            "top_genres": [],
-            "top_artists": list({s.artist for s in saved_songs if s.artist}),
-            "top_tracks": list({s.title for s in saved_songs if s.title})
-        } if saved_songs else global_prefs
+        with span("recommend.preferences"):
+            global_prefs, personal_prefs, collaborative = await asyncio.to_thread(_build_preferences, db, current_user)
         print(f"[RECOMMEND] mood_analysis: {mood_analysis}")
         print(f"[RECOMMEND] personal_prefs: {personal_prefs}")
+        with span("mood_index.refresh"):
+            await asyncio.to_thread(mood_index.refresh_saved_songs, db)
         try:
             print("[RECOMMEND] Запрашиваем рекомендации у OpenAI...")
-            global_task = openai_service.get_music_recommendations(mood_analysis, global_prefs, n_tracks=5)
-            personal_task = openai_service.get_music_recommendations(mood_analysis, personal_prefs, n_tracks=5)
+            user_key = f"user:{current_user.id}"
+            global_task = openai_service.get_music_recommendations(mood_analysis, global_prefs, n_tracks=5, user_key=user_key)
+            personal_task = openai_service.get_music_recommendations(mood_analysis, personal_prefs, n_tracks=5, user_key=user_key)
+            llm_future = asyncio.gather(global_task, personal_task)
+            # Хеджирование: ждём модель не дольше бюджета, иначе отвечаем из локального индекса
+            done, _ = await asyncio.wait({llm_future}, timeout=RECOMMEND_LATENCY_BUDGET)
+            if llm_future not in done:
+                indexed = mood_index.recommendations(mood_analysis, 5)
+                if indexed:
+                    print(f"[RECOMMEND] OpenAI не уложился в {RECOMMEND_LATENCY_BUDGET} c, отдаём локальный индекс")
+                    token = await _register_pending(llm_future, current_user.id)
+                    personal_indexed = {
+                        **indexed,
+                        "recommended_tracks": [
+                            {"name": t["title"], "artist": t["artist"], "reason": "Сохраняют пользователи с похожим вкусом"}
+                            for t in collaborative
+                        ]
+                    } if collaborative else indexed
+                    return JSONResponse(content={
+                        "global": indexed,
+                        "personal": personal_indexed,
+                        "collaborative": collaborative,
+                        "source": "mood_index",
+                        "pending_token": token,
+                        "ask_feedback": True
+                    })
             global_rec, personal_rec = await asyncio.wait_for(
-                asyncio.gather(global_task, personal_task), timeout=60.0
+                llm_future, timeout=max(60.0 - RECOMMEND_LATENCY_BUDGET, 1.0)
             )
             print(f"[RECOMMEND] Ответ OpenAI: global={global_rec}, personal={personal_rec}")
             return JSONResponse(content={
                 "global": global_rec["recommendations"],
                 "personal": personal_rec["recommendations"],
+                "collaborative": collaborative,
                 "ask_feedback": True
             })
+        except QueueFullError as e:
+            raise _too_many_requests(e)
         except asyncio.TimeoutError:
             print("[RECOMMEND] Timeout от OpenAI! Возвращаем ошибку.")
             raise HTTPException(status_code=500, detail="OpenAI API не отвечает. Попробуйте позже.")
         except Exception as e:
             print(f"[RECOMMEND] Ошибка OpenAI: {e}")
             raise HTTPException(status_code=500, detail=f"Ошибка получения рекомендаций от OpenAI: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[RECOMMEND] Ошибка получения рекомендаций: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка получения рекомендаций: {str(e)}")
 
+def _pending_key(user_id: int, token: str) -> str:
+    return f"{PENDING_RECOMMENDATIONS_PREFIX}{user_id}:{token}"
+
+async def _register_pending(future: asyncio.Future, user_id: int) -> str:
+    """
+    Запоминает незавершённый запрос к LLM, чтобы клиент мог подменить быстрый ответ.
+    Когда модель ответит, результат запишется в shared_cache под ключом владельца
+    """
+    token = uuid.uuid4().hex
+    key = _pending_key(user_id, token)
+    await shared_cache.aset(key, {"ready": False}, ttl=PENDING_RECOMMENDATIONS_TTL)
+    loop = asyncio.get_running_loop()
+
+    def store(done: asyncio.Future) -> None:
+        _pending_futures.discard(done)
+        if done.cancelled() or done.exception() is not None:
+            result = {"ready": True, "success": False}
+        else:
+            global_rec, personal_rec = done.result()
+            result = {
+                "ready": True,
+                "success": True,
+                "global": global_rec["recommendations"],
+                "personal": personal_rec["recommendations"]
+            }
+        # Колбэк выполняется на event loop — запись в бэкенд уводим в пул потоков
+        loop.run_in_executor(None, shared_cache.set, key, result, PENDING_RECOMMENDATIONS_TTL)
+
+    _pending_futures.add(future)
+    future.add_done_callback(store)
+    return token
+
+@router.get("/get-recommendations/pending/{token}")
+async def get_pending_recommendations(token: str, current_user: User = Depends(get_current_user)):
+    """
+    Возвращает ответ LLM, который пришёл после быстрого ответа из локального индекса.
+    Токен виден только пользователю, который его получил
+    """
+    key = _pending_key(current_user.id, token)
+    pending = await shared_cache.aget(key)
+    if not pending:
+        raise HTTPException(status_code=404, detail="Запрос не найден или устарел")
+    if pending["ready"]:
+        await shared_cache.adelete(key)
+    return JSONResponse(content=pending)
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/get-recommendations/stream")
+async def stream_music_recommendations(
+    mood_analysis: Dict[str, Any],
+    kind: str = "personal",
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Рекомендации через Server-Sent Events: каждый трек отправляется событием
+    "track", как только модель его дописала; в конце — событие "done".
+    kind: "personal" (по saved_songs) или "global"
+    """
+    global_prefs, personal_prefs, _ = await asyncio.to_thread(_build_preferences, db, current_user)
+    prefs = global_prefs if kind == "global" else personal_prefs
+    user_key = f"user:{current_user.id}"
+
+    async def events():
+        try:
+            async for event, data in openai_service.stream_music_recommendations(
+                mood_analysis, prefs, n_tracks=5, user_key=user_key
+            ):
+                yield _sse(event, data)
+        except QueueFullError as e:
+            yield _sse("error", {"status": 429, "detail": str(e), "retry_after": math.ceil(e.retry_after)})
+        except Exception as e:
+            print(f"[RECOMMEND] Ошибка стрима: {e}")
+            yield _sse("error", {"status": 500, "detail": f"Ошибка получения рекомендаций: {str(e)}"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/chat")
 async def chat_with_ai(
+    request: Request,
     message: str,
     mood_analysis: Dict[str, Any] = None,
-    user_id: str = None
+    user_id: str = None,
+    current_user: Optional[User] = Depends(get_optional_user)
 ):
     """
     Общий чат с ИИ для обсуждения музыки и настроения
@@ -139,19 +347,14 @@ async def chat_with_ai(
         Можешь предложить жанры, исполнителей или обсудить музыкальные предпочтения.
         """
         
-        # Выбираем модель в зависимости от провайдера
-        if openai_service.use_azure:
-            model = openai_service.deployment_name
-        else:
-            model = "gpt-4"
-        
-        # Получаем ответ от ИИ
-        response = openai_service.client.chat.completions.create(
-            model=model,
-            messages=[
+        # Получаем ответ от ИИ (провайдер выбирает роутер OpenAIService)
+        response = await openai_service.complete(
+            "text",
+            [
                 {"role": "system", "content": "Ты дружелюбный музыкальный эксперт, который помогает людям находить музыку по настроению."},
                 {"role": "user", "content": context}
             ],
+            user_key=_client_key(request, current_user),
             max_tokens=300
         )
         
@@ -163,9 +366,21 @@ async def chat_with_ai(
             "message": message
         })
         
+    except QueueFullError as e:
+        raise _too_many_requests(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка чата: {str(e)}")
 
+@router.get("/providers")
+async def get_providers_health():
+    """
+    Состояние LLM-провайдеров (предохранители, задержки, ошибки) и очереди планировщика
+    """
+    return JSONResponse(content={
+        "providers": openai_service.provider_stats(),
+        "scheduler": llm_scheduler.stats()
+    })
+
 @router.get("/supported-formats")
 async def get_supported_formats():
     """
@@ -177,150 +392,109 @@ async def get_supported_formats():
     })
 
 @router.get('/history', response_model=List[ChatMessageOut])
-def get_chat_history(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return db.query(ChatMessage).filter(ChatMessage.user_id == current_user.id).order_by(ChatMessage.timestamp).all()
+def get_chat_history(request: Request, response: Response, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Версию читаем до списка: если между ними придёт запись, клиент просто перезапросит список
+    tag = list_versions.etag(current_user.id, list_versions.HISTORY, list_versions.current(db, current_user.id, list_versions.HISTORY))
+    headers = {"ETag": tag, "Cache-Control": list_versions.LIST_CACHE_CONTROL}
+    if list_versions.not_modified(request, tag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    # Сообщения из запрошенного удаления ещё могут лежать в таблице — скрываем их
+    return db.query(ChatMessage).filter(
+        ChatMessage.user_id == current_user.id, ChatMessage.id > hidden_up_to(db, current_user.id)
+    ).order_by(ChatMessage.timestamp).all()
 
 @router.post('/history', response_model=ChatMessageOut)
 def add_chat_message(msg: ChatMessageCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     db_msg = ChatMessage(user_id=current_user.id, **msg.dict())
     db.add(db_msg)
+    list_versions.bump(db, current_user.id, list_versions.HISTORY)
     db.commit()
     db.refresh(db_msg)
     return db_msg
 
-@router.delete('/history', status_code=status.HTTP_204_NO_CONTENT)
+@router.delete('/history', status_code=status.HTTP_202_ACCEPTED)
 def delete_chat_history(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    db.query(ChatMessage).filter(ChatMessage.user_id == current_user.id).delete()
+    """
+    История сразу пропадает из выдачи, а строки удаляются в фоне порциями —
+    один большой DELETE надолго блокировал таблицу у активных пользователей
+    """
+    up_to_id = request_history_deletion(db, current_user.id)
     db.commit()
-    return None
+    chat_purger.wake()
+    return {"status": "scheduled", "up_to_id": up_to_id}
+
+@router.get('/search')
+def search(
+    q: str,
+    type: str = "all",
+    limit: int = 20,
+    offset: int = 0,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Полнотекстовый поиск по своей истории чата и сохранённым песням.
+    type: all, messages или songs; результаты отсортированы по релевантности.
+    """
+    if type not in ("all", "messages", "songs"):
+        raise HTTPException(status_code=400, detail="type должен быть all, messages или songs")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Пустой поисковый запрос")
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    offset = max(0, offset)
+    result: Dict[str, Any] = {"query": q, "mode": search_index.mode, "limit": limit, "offset": offset}
+    with span("search", mode=search_index.mode, type=type):
+        if type in ("all", "messages"):
+            result["messages"] = search_index.search_messages(
+                db, current_user.id, q, limit, offset, after_id=hidden_up_to(db, current_user.id)
+            )
+        if type in ("all", "songs"):
+            result["songs"] = search_index.search_songs(db, current_user.id, q, limit, offset)
+    return result
 
 @router.post("/generate-beat", response_model=GenerateBeatResponse)
-async def generate_beat(request: GenerateBeatRequest):
+async def generate_beat(request: GenerateBeatRequest, db: Session = Depends(get_db)):
     """
     Генерирует музыку через Riffusion API по текстовому промпту.
+    Задача сохраняется в beat_jobs и доводится до конца на сервере.
     """
     try:
-        prompt = request.prompt
-        # --- Riffusion API параметры ---
-        RIFFUSION_API_KEY = os.getenv("RIFFUSION_API_KEY")
-        if not RIFFUSION_API_KEY:
-            return GenerateBeatResponse(success=False, error="RIFFUSION_API_KEY не задан в переменных окружения")
-        
-        # Основной Riffusion API
-        url = "https://riffusionapi.com/api/generate-music"
-        headers = {
-            "accept": "application/json",
-            "x-api-key": RIFFUSION_API_KEY,
-            "Content-Type": "application/json"
-        }
-        data = {
-            "prompt": prompt
-        }
-        
-        # Отправляем запрос на генерацию
-        resp = requests.post(url, headers=headers, json=data, timeout=120)
-        if resp.status_code != 200:
-            return GenerateBeatResponse(success=False, error=f"Riffusion API error: {resp.text}")
-        
-        result = resp.json()
-        print("Riffusion API response:", result)
-        
-        # Проверяем статус
-        status = result.get("status")
-        if status == "pending":
-            # Асинхронная генерация - возвращаем информацию о процессе
-            request_id = result.get("request_id")
-            return GenerateBeatResponse(
-                success=True, 
-                status="pending",
-                request_id=request_id,
-                message="Генерация началась. Результат будет готов через 30-60 секунд."
-            )
-        elif status == "complete":
-            # Готовый результат
-            data = result.get("data", {})
-            if data and "data" in data and len(data["data"]) > 0:
-                audio_url = data["data"][0].get("stream_audio_url")
-                if audio_url:
-                    # Скачиваем mp3
-                    audio_resp = requests.get(audio_url, timeout=120)
-                    if audio_resp.status_code == 200:
-                        # Сохраняем файл
-                        import uuid
-                        filename = f"riffusion_{uuid.uuid4().hex}.mp3"
-                        file_path = os.path.join(AUDIO_CACHE_DIR, filename)
-                        with open(file_path, "wb") as f:
-                            f.write(audio_resp.content)
-                        
-                        return GenerateBeatResponse(success=True, audio_url=f"/audio_cache/{filename}")
-                    else:
-                        return GenerateBeatResponse(success=False, error="Не удалось скачать аудио")
-                else:
-                    return GenerateBeatResponse(success=False, error="Riffusion API не вернул ссылку на аудио")
-            else:
-                return GenerateBeatResponse(success=False, error="Неожиданная структура ответа от Riffusion API")
-        elif status == "failed":
-            details = result.get("details", {})
-            error_msg = details.get("detail", "Неизвестная ошибка")
-            return GenerateBeatResponse(success=False, error=f"Ошибка генерации: {error_msg}")
-        else:
-            return GenerateBeatResponse(success=False, error=f"Неизвестный статус от Riffusion API: {status}")
-            
+        job = await beat_jobs.submit(db, request.prompt, fresh=request.fresh)
     except Exception as e:
         return GenerateBeatResponse(success=False, error=str(e))
 
+    if job.status == "complete":
+        return GenerateBeatResponse(success=True, status="complete", request_id=job.request_id, audio_url=job.audio_url)
+    if job.status == "failed":
+        return GenerateBeatResponse(success=False, status="failed", request_id=job.request_id, error=job.error)
+    return GenerateBeatResponse(
+        success=True,
+        status="pending",
+        request_id=job.request_id,
+        message="Генерация началась. Результат будет готов через 30-60 секунд."
+    )
+
 @router.post("/generate-beat/status")
-async def check_generation_status(request: GenerateBeatStatusRequest):
+async def check_generation_status(request: GenerateBeatStatusRequest, db: Session = Depends(get_db)):
     """
-    Проверяет статус генерации музыки
+    Проверяет статус генерации музыки — только по локальной таблице, без запросов к Riffusion
     """
-    try:
-        request_id = request.request_id
-        RIFFUSION_API_KEY = os.getenv("RIFFUSION_API_KEY")
-        if not RIFFUSION_API_KEY:
-            return JSONResponse(content={"success": False, "error": "RIFFUSION_API_KEY не задан"})
-        
-        # Правильный URL для проверки статуса Riffusion согласно документации
-        url = "https://riffusionapi.com/api/generate-music"
-        headers = {
-            "accept": "application/json",
-            "x-api-key": RIFFUSION_API_KEY,
-            "Content-Type": "application/json"
-        }
-        data = {
-            "request_id": request_id
-        }
-        
-        resp = requests.post(url, headers=headers, json=data, timeout=30)
-        if resp.status_code != 200:
-            return JSONResponse(content={"success": False, "error": f"Ошибка проверки статуса: {resp.text}"})
-        
-        result = resp.json()
-        print(f"Status check for {request_id}: {result}")
-        
-        # Если статус complete и есть audio_url, скачиваем файл
-        if result.get("status") == "complete":
-            data = result.get("data", {})
-            if data and "data" in data and len(data["data"]) > 0:
-                audio_url = data["data"][0].get("stream_audio_url")
-                if audio_url:
-                    try:
-                        audio_resp = requests.get(audio_url, timeout=120)
-                        if audio_resp.status_code == 200:
-                            # Сохраняем файл
-                            import uuid
-                            filename = f"riffusion_{uuid.uuid4().hex}.mp3"
-                            file_path = os.path.join(AUDIO_CACHE_DIR, filename)
-                            with open(file_path, "wb") as f:
-                                f.write(audio_resp.content)
-                            
-                            # Обновляем результат с локальным путем
-                            result["local_audio_url"] = f"/audio_cache/{filename}"
-                            
-                    except Exception as e:
-                        print(f"Ошибка скачивания аудио: {e}")
-        
-        return JSONResponse(content={"success": True, "status": result})
-        
-    except Exception as e:
-        return JSONResponse(content={"success": False, "error": str(e)}) 
\ No newline at end of file
+    job = await asyncio.to_thread(beat_jobs.find_job, db, request.request_id)
+    if not job:
+        return JSONResponse(content={"success": False, "error": "Задача генерации не найдена"})
+    return JSONResponse(content={"success": True, "status": job_status(job)})
+
+@router.post("/generate-beat/webhook")
+async def generation_webhook(payload: Dict[str, Any], token: str, db: Session = Depends(get_db)):
+    """
+    Webhook от Riffusion о завершении генерации
+    """
+    if not BEAT_WEBHOOK_SECRET or not secrets.compare_digest(token.encode(), BEAT_WEBHOOK_SECRET.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Неверный токен webhook")
+    request_id = payload.get("request_id")
+    job = await asyncio.to_thread(beat_jobs.find_job, db, request_id) if request_id else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача генерации не найдена")
+    await beat_jobs.apply_result(db, job, payload)
+    return {"success": True, "status": job.status}
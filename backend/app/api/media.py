@@ -1,10 +1,12 @@
 # backend/app/api/media.py
 
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, status
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models.user import SavedSong as DBSavedSong, User
 from app.schemas import SavedSong as SavedSongSchema, SavedSongCreate
+from app.services import list_versions
+from app.services.track_index import track_index
 from typing import List
 from datetime import datetime
 
@@ -24,7 +26,13 @@ router = APIRouter()
 # Здесь будут только эндпоинты, связанные с загрузкой/анализом медиафайлов пользователя, без Spotify/Deezer/Last.fm
 
 @router.get("/saved-songs", response_model=List[SavedSongSchema])
-def get_saved_songs(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def get_saved_songs(request: Request, response: Response, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Не изменился список с прошлого раза — 304 без запроса самих песен
+    tag = list_versions.etag(current_user.id, list_versions.SAVED_SONGS, list_versions.current(db, current_user.id, list_versions.SAVED_SONGS))
+    headers = {"ETag": tag, "Cache-Control": list_versions.LIST_CACHE_CONTROL}
+    if list_versions.not_modified(request, tag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
     return db.query(DBSavedSong).filter(DBSavedSong.user_id == current_user.id).order_by(DBSavedSong.date_saved.desc()).all()
 
 @router.post("/saved-songs", response_model=SavedSongSchema, status_code=status.HTTP_201_CREATED)
@@ -37,8 +45,10 @@ def add_saved_song(song: SavedSongCreate, db: Session = Depends(get_db), current
         date_saved=datetime.utcnow()
     )
     db.add(db_song)
+    list_versions.bump(db, current_user.id, list_versions.SAVED_SONGS)
     db.commit()
     db.refresh(db_song)
+    track_index.add_saved_song(db_song.youtube_video_id, db_song.title, db_song.artist)
     return db_song
 
 @router.delete("/saved-songs/{youtube_video_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -47,5 +57,6 @@ def delete_saved_song(youtube_video_id: str, db: Session = Depends(get_db), curr
     if not db_song:
         raise HTTPException(status_code=404, detail="Song not found")
     db.delete(db_song)
+    list_versions.bump(db, current_user.id, list_versions.SAVED_SONGS)
     db.commit()
     return None
@@ -1,20 +1,44 @@
-from fastapi import APIRouter, Query, Response
-from typing import List
-import requests
+from fastapi import APIRouter, Query, Request, Response, Depends
+from fastapi.responses import FileResponse, JSONResponse
+from sqlalchemy.orm import Session
+from typing import Any, Dict, List, Optional
+import asyncio
 import os
-import threading
+import re
 import yt_dlp
 import shutil
 import subprocess
 import sys
+from ..database import get_db
+from ..dependencies import get_http_client
+from ..services.http_client import UpstreamClient
+from ..services.metrics import UPSTREAM_DURATION, cache_hit, cache_miss
+from ..services.tracing import span
+import time
+from ..services.matcher import matcher
+from ..services.shared_cache import shared_cache, LockTimeout
+from ..services.blob_store import blob_store
+from ..services.track_index import track_index
+from ..services.youtube_quota import youtube_quota, seconds_until_reset, STALE, SHRINK, LOCAL, STAGE_NAMES, YOUTUBE_DEGRADED_TOTAL
+from ..services import audio_processing
+from ..services.analyzer import audio_index, mood_target, FEATURE_NAMES
+from ..models.user import SavedSong
+from ..schemas import AudioMatchRequest
+from ..services.transcoder import transcoder, CODECS, QUALITIES, codec_for_user_agent, variant_path
+from ..config import YOUTUBE_API_BASE_URL, YOUTUBE_SEARCH_CACHE_TTL, YOUTUBE_SEARCH_STALE_TTL, YOUTUBE_SEARCH_PAGE_SIZE, YOUTUBE_QUOTA_SHRINK_PAGE, TRANSCODE_WAIT, TRANSCODE_AHEAD, WAVEFORM_PEAKS
 
 router = APIRouter()
 
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 
-# Простой in-memory кеш для YouTube search
-youtube_search_cache = {}
-youtube_search_cache_lock = threading.Lock()
+# Кеш YouTube search — общий для всех воркеров (app/services/shared_cache.py).
+# v4: ключ youtube_search:v4:{page_size}:{запрос} → {"results": [...], "fetched_at": ...,
+# "partial": True для урезанной страницы} — результаты с длительностью, статистикой
+# и признаком трансляции; запись хранится дольше срока свежести, чтобы при нехватке
+# квоты отдавать её устаревшей
+YOUTUBE_SEARCH_CACHE_PREFIX = "youtube_search:v4:"
+
+ISO_DURATION = re.compile(r"^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
 
 AUDIO_CACHE_DIR = "audio_cache"
 os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
@@ -46,70 +70,284 @@ else:
 
 # Здесь будут рекомендации через YouTube и аналитику лайков
 
-@router.get("/youtube-search")
-def youtube_search(q: str = Query(..., description="Поисковый запрос (название трека, артист и т.д.)"), max_results: int = 5):
-    key = f"{q.lower().strip()}_{max_results}"
-    with youtube_search_cache_lock:
-        if key in youtube_search_cache:
-            return {"results": youtube_search_cache[key]}
-    if not YOUTUBE_API_KEY:
-        return {"error": "YOUTUBE_API_KEY not set"}
-    url = "https://www.googleapis.com/youtube/v3/search"
+def parse_iso_duration(value: Optional[str]) -> Optional[int]:
+    """ISO 8601 из contentDetails.duration (PT1H2M3S) в секунды; None, если формат не распознан"""
+    match = ISO_DURATION.match(value or "")
+    if not match:
+        return None
+    days, hours, minutes, seconds = (int(part or 0) for part in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+def _count(value: Optional[str]) -> Optional[int]:
+    return int(value) if value is not None else None
+
+async def _fetch_video_details(http: UpstreamClient, video_ids: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Длительность и статистика для всей страницы поиска одним videos.list
+    (до 50 id за вызов, 1 единица квоты). None — если API ответил ошибкой.
+    """
+    if not video_ids:
+        return {}
+    params = {
+        "part": "contentDetails,statistics",
+        "id": ",".join(video_ids[:50]),
+        "maxResults": 50,
+        "key": YOUTUBE_API_KEY
+    }
+    resp = await http.get(f"{YOUTUBE_API_BASE_URL}/videos", params=params)
+    await asyncio.to_thread(youtube_quota.spend, "videos.list")
+    if resp.status_code != 200:
+        print(f"[YOUTUBE] videos.list вернул {resp.status_code}: {resp.text[:200]}")
+        return None
+    details = {}
+    for item in resp.json().get("items", []):
+        statistics = item.get("statistics", {})
+        details[item["id"]] = {
+            "duration_seconds": parse_iso_duration(item.get("contentDetails", {}).get("duration")),
+            "view_count": _count(statistics.get("viewCount")),
+            "like_count": _count(statistics.get("likeCount")),
+        }
+    return details
+
+def _passes_filters(item: Dict[str, Any], min_duration: Optional[int], max_duration: Optional[int], exclude_live: bool) -> bool:
+    if exclude_live and item.get("live"):
+        return False
+    duration = item.get("duration_seconds")
+    # Трансляции отдают нулевую длительность, а неизвестную не отбрасываем
+    if duration:
+        if max_duration is not None and duration > max_duration:
+            return False
+        if min_duration is not None and duration < min_duration:
+            return False
+    return True
+
+def _search_cache_key(q: str, page_size: int) -> str:
+    """Размер страницы — часть ключа: страница на 25 не должна отвечать запросу на 40"""
+    return f"{YOUTUBE_SEARCH_CACHE_PREFIX}{page_size}:{q.lower().strip()}"
+
+def _quota_exceeded(resp) -> bool:
+    """403 с причиной quotaExceeded / dailyLimitExceeded"""
+    if resp.status_code != 403:
+        return False
+    try:
+        errors = resp.json().get("error", {}).get("errors", [])
+    except ValueError:
+        return False
+    return any(error.get("reason") in ("quotaExceeded", "dailyLimitExceeded") for error in errors)
+
+async def _search_api(http: UpstreamClient, q: str, page_size: int):
+    """
+    search.list + videos.list. Возвращает (результаты, None) или (None, ошибка);
+    ошибка "quota" — YouTube сообщил, что квота исчерпана.
+    """
+    url = f"{YOUTUBE_API_BASE_URL}/search"
     params = {
         "part": "snippet",
         "q": q,
         "type": "video",
-        "maxResults": max_results,
+        "maxResults": page_size,
         "key": YOUTUBE_API_KEY
     }
-    resp = requests.get(url, params=params)
+    resp = await http.get(url, params=params)
+    await asyncio.to_thread(youtube_quota.spend, "search.list")
+    if _quota_exceeded(resp):
+        await asyncio.to_thread(youtube_quota.exhaust)
+        return None, "quota"
     if resp.status_code != 200:
-        return {"error": f"YouTube API error: {resp.text}"}
+        return None, f"YouTube API error: {resp.text}"
     data = resp.json()
     results = []
     for item in data.get("items", []):
+        live = item["snippet"].get("liveBroadcastContent", "none")
         results.append({
             "video_id": item["id"]["videoId"],
             "title": item["snippet"]["title"],
             "channel": item["snippet"]["channelTitle"],
-            "thumbnail": item["snippet"]["thumbnails"]["medium"]["url"]
+            "thumbnail": item["snippet"]["thumbnails"]["medium"]["url"],
+            "live": live if live in ("live", "upcoming") else None,
+            "duration_seconds": None,
+            "view_count": None,
+            "like_count": None
         })
-    with youtube_search_cache_lock:
-        youtube_search_cache[key] = results
-    return {"results": results}
+    details = await _fetch_video_details(http, [result["video_id"] for result in results])
+    for result in results:
+        result.update((details or {}).get(result["video_id"], {}))
+    return results, (None if details is not None else "details")
 
-@router.get("/youtube-audio")
-def youtube_audio(video_id: str):
-    # Сохраняем оригинальный аудиофайл (без конвертации в mp3)
-    filename = None
-    ext = None
-    # Сначала ищем уже скачанный файл с любым расширением
+@router.get("/youtube-search")
+async def youtube_search(
+    q: str = Query(..., description="Поисковый запрос (название трека, артист и т.д.)"),
+    max_results: int = Query(5, ge=1, le=50, description="Сколько результатов вернуть"),
+    max_duration: Optional[int] = Query(None, description="Отбросить видео длиннее, секунд (например, 10-часовые циклы)"),
+    min_duration: Optional[int] = Query(None, description="Отбросить видео короче, секунд"),
+    exclude_live: bool = Query(True, description="Отбросить идущие и запланированные трансляции"),
+    local: bool = Query(True, description="Разрешить ответ из локального индекса треков без YouTube API"),
+    http: UpstreamClient = Depends(get_http_client),
+    db: Session = Depends(get_db)
+):
+    """
+    Поиск с учётом дневной квоты YouTube. По мере её расхода: сначала отдаём
+    устаревшие записи кеша, потом уменьшаем страницу поиска, а когда квоты почти
+    нет — отвечаем только из локального индекса треков.
+    """
+    page_size = max(YOUTUBE_SEARCH_PAGE_SIZE, min(max_results, 50))
+    key = _search_cache_key(q, page_size)
+    # Кеш и счётчики квоты читаем один раз за запрос и не на event loop
+    entry = await shared_cache.aget(key)
+    stage = youtube_quota.stage(await asyncio.to_thread(youtube_quota.counters))
+    results = None
+    source = "cache"
+    indexed = None
+    # Урезанная страница (стадия SHRINK) годится как свежая, только пока квоты мало
+    fresh = entry is not None and time.time() - entry["fetched_at"] < YOUTUBE_SEARCH_CACHE_TTL \
+        and (stage >= SHRINK or not entry.get("partial"))
+    if fresh:
+        cache_hit("youtube_search")
+        results = entry["results"]
+    else:
+        cache_miss("youtube_search")
+        if entry is not None and stage >= STALE:
+            results, source = entry["results"], "stale"
+    # Запрос, похожий на уже заданный, или узнаваемый трек — отвечаем без API
+    if results is None and (local or stage >= LOCAL):
+        await asyncio.to_thread(track_index.refresh_saved_songs, db)
+        indexed = track_index.lookup(q, page_size, relaxed=stage >= LOCAL, min_results=min(max_results, page_size))
+        if indexed is not None:
+            cache_hit("track_index")
+            results, source = indexed["results"], "local"
+        else:
+            cache_miss("track_index")
+    if results is None and stage < LOCAL:
+        if not YOUTUBE_API_KEY:
+            return {"error": "YOUTUBE_API_KEY not set"}
+        fetch_size = page_size
+        if stage >= SHRINK:
+            fetch_size = min(page_size, max(YOUTUBE_QUOTA_SHRINK_PAGE, min(max_results, 50)))
+        results, error = await _search_api(http, q, fetch_size)
+        if error == "quota":
+            # Квота кончилась раньше, чем мы насчитали: дальше как на последней стадии
+            stage = LOCAL
+            if entry is not None:
+                results, source = entry["results"], "stale"
+            else:
+                indexed = track_index.lookup(q, page_size, relaxed=True)
+                if indexed is not None:
+                    results, source = indexed["results"], "local"
+        elif results is None:
+            return {"error": error}
+        else:
+            source = "api"
+            # Без длительностей страницу не кешируем — иначе фильтры сутки не будут работать
+            if error is None:
+                if fetch_size < page_size:
+                    # Урезанная страница живёт только до сброса квоты — потом снова полная
+                    await shared_cache.aset(key, {"results": results, "fetched_at": time.time(), "partial": True},
+                                            ttl=seconds_until_reset())
+                else:
+                    await shared_cache.aset(key, {"results": results, "fetched_at": time.time()}, ttl=YOUTUBE_SEARCH_STALE_TTL)
+                await asyncio.to_thread(track_index.record, q, results)
+    if results is None:
+        YOUTUBE_DEGRADED_TOTAL.inc(source="none")
+        retry_after = seconds_until_reset()
+        return JSONResponse(
+            status_code=503,
+            content={
+                "error": "Квота YouTube API на сегодня исчерпана, а в локальном индексе ничего похожего нет",
+                "quota_stage": STAGE_NAMES[stage],
+                "retry_after": retry_after,
+            },
+            headers={"Retry-After": str(retry_after)},
+        )
+    if stage >= STALE and source in ("stale", "local"):
+        YOUTUBE_DEGRADED_TOTAL.inc(source=source)
+    filtered = [item for item in results if _passes_filters(item, min_duration, max_duration, exclude_live)]
+    response = {
+        "results": filtered[:max_results],
+        "filtered_out": len(results) - len(filtered),
+        "source": source,
+        "quota_stage": STAGE_NAMES[stage],
+    }
+    if indexed is not None:
+        response["match"] = {name: value for name, value in indexed.items() if name != "results"}
+    return response
+
+def _download_audio(video_id: str):
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': f'{AUDIO_CACHE_DIR}/{video_id}.%(ext)s',
+        'quiet': True,
+    }
+    started = time.perf_counter()
+    try:
+        print(f"[yt-dlp] Скачиваем https://www.youtube.com/watch?v={video_id}")
+        with span("yt_dlp.download", video_id=video_id), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            result = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
+            ext = result.get('ext', 'm4a')
+    except Exception:
+        UPSTREAM_DURATION.observe(time.perf_counter() - started, upstream="yt_dlp", outcome="error")
+        raise
+    UPSTREAM_DURATION.observe(time.perf_counter() - started, upstream="yt_dlp", outcome="ok")
+    # Скачанный файл переезжает в content-addressed хранилище под именем youtube:<video_id>
+    blob = blob_store.put_file(f"{AUDIO_CACHE_DIR}/{video_id}.{ext}", ext, "youtube", alias=f"youtube:{video_id}")
+    return blob_store.path(blob.sha256), ext
+
+def _find_cached_audio(video_id: str):
+    """Уже скачанный файл: (путь, расширение) или (None, None)"""
+    blob = blob_store.resolve(f"youtube:{video_id}")
+    if blob is not None:
+        return blob_store.path(blob.sha256), blob.ext
+    # Файлы, скачанные до появления хранилища, переносим в него при первом обращении
     for possible_ext in ["m4a", "webm", "opus", "mp3"]:
         test_path = f"{AUDIO_CACHE_DIR}/{video_id}.{possible_ext}"
         if os.path.exists(test_path):
-            filename = test_path
-            ext = possible_ext
-            break
-    if not filename:
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': f'{AUDIO_CACHE_DIR}/{video_id}.%(ext)s',
-            'quiet': True,
-        }
+            blob = blob_store.put_file(test_path, possible_ext, "youtube", alias=f"youtube:{video_id}")
+            return blob_store.path(blob.sha256), possible_ext
+    return None, None
+
+def _ensure_audio(video_id: str):
+    """Скачанный оригинал: (путь, расширение, None) или (None, None, ответ с ошибкой)"""
+    # Сохраняем оригинальный аудиофайл (без конвертации в mp3)
+    filename, ext = _find_cached_audio(video_id)
+    if filename:
+        cache_hit("audio")
+    else:
+        cache_miss("audio")
         try:
-            print(f"[yt-dlp] Скачиваем https://www.youtube.com/watch?v={video_id}")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                result = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
-                ext = result.get('ext', 'm4a')
-                filename = f"{AUDIO_CACHE_DIR}/{video_id}.{ext}"
+            # Одно скачивание на video_id среди всех воркеров; остальные ждут готовый файл
+            with shared_cache.lock(f"audio_download:{video_id}", ttl=600, timeout=300):
+                filename, ext = _find_cached_audio(video_id)
+                if not filename:
+                    filename, ext = _download_audio(video_id)
+                    if TRANSCODE_AHEAD and transcoder.available():
+                        transcoder.prewarm(filename, video_id)
+                        audio_processing.schedule(filename, video_id)
+                        audio_index.schedule(filename, video_id)
+        except LockTimeout:
+            return None, None, Response(content='{"error": "Аудио ещё скачивается, попробуйте позже"}', media_type="application/json", status_code=503)
         except Exception as e:
             print(f"yt-dlp error for video_id={video_id}: {e}")
             import traceback
             print(traceback.format_exc())
-            return Response(content=f'{{"error": "yt-dlp error: {str(e)}"}}', media_type="application/json", status_code=400)
+            return None, None, Response(content=f'{{"error": "yt-dlp error: {str(e)}"}}', media_type="application/json", status_code=400)
     if not filename or not os.path.exists(filename):
         print(f"File not found after yt-dlp for video_id={video_id}")
-        return Response(content='{"error": "Не удалось скачать аудио с YouTube. Возможно, видео недоступно."}', media_type="application/json", status_code=400)
+        return None, None, Response(content='{"error": "Не удалось скачать аудио с YouTube. Возможно, видео недоступно."}', media_type="application/json", status_code=400)
+    return filename, ext, None
+
+@router.get("/youtube-audio")
+def youtube_audio(
+    request: Request,
+    video_id: str,
+    quality: str = Query("original", description="original, low (48 кбит/с) или medium (96 кбит/с)"),
+    format: str = Query("auto", description="auto, opus или aac; auto — AAC для Safari, иначе Opus"),
+):
+    if quality not in QUALITIES:
+        return Response(content=f'{{"error": "quality: одно из {", ".join(QUALITIES)}"}}', media_type="application/json", status_code=400)
+    if format != "auto" and format not in CODECS:
+        return Response(content='{"error": "format: auto, opus или aac"}', media_type="application/json", status_code=400)
+    filename, ext, error = _ensure_audio(video_id)
+    if error:
+        return error
     # Определяем mime-type по расширению
     mime_map = {
         "m4a": "audio/mp4",
@@ -118,6 +356,111 @@ def youtube_audio(video_id: str):
         "mp3": "audio/mpeg",
     }
     mime_type = mime_map.get(ext, "application/octet-stream")
-    with open(filename, "rb") as f:
-        audio_data = f.read()
-    return Response(content=audio_data, media_type=mime_type)
+    variant = "original"
+    if quality != "original":
+        codec = format if format != "auto" else codec_for_user_agent(request.headers.get("user-agent"))
+        if os.path.exists(variant_path(video_id, quality, codec)):
+            cache_hit("audio_variant")
+        else:
+            cache_miss("audio_variant")
+        # Не успели перекодировать или нет ffmpeg — отдаём оригинал, вариант будет готов к следующему запросу
+        with span("audio.transcode", video_id=video_id, quality=quality, codec=codec):
+            path = transcoder.get_variant(filename, video_id, quality, codec, wait=TRANSCODE_WAIT)
+        if path:
+            filename, mime_type, variant = path, CODECS[codec]["mime"], f"{quality}-{codec}"
+    headers = {"X-Audio-Variant": variant, "Vary": "User-Agent"}
+    if variant == "original":
+        # Неизменяемая ссылка на тот же файл в хранилище — её можно кешировать навсегда
+        headers["Content-Location"] = blob_store.url(os.path.basename(filename))
+    # FileResponse отдаёт файл потоком и поддерживает Range — плеер начинает играть до конца загрузки
+    return FileResponse(filename, media_type=mime_type, headers=headers)
+
+def _processing_pending() -> Response:
+    if not transcoder.available():
+        return Response(content='{"error": "Обработка аудио недоступна (нет ffmpeg)"}', media_type="application/json", status_code=503)
+    return Response(content='{"status": "processing"}', media_type="application/json", status_code=202, headers={"Retry-After": "5"})
+
+@router.get("/youtube-audio/preview")
+def youtube_audio_preview(video_id: str):
+    """
+    Короткий фрагмент трека (самый громкий участок, обычно припев) для карточки рекомендации
+    """
+    filename, _, error = _ensure_audio(video_id)
+    if error:
+        return error
+    with span("audio.preview", video_id=video_id):
+        meta = audio_processing.ensure_processed(filename, video_id, wait=TRANSCODE_WAIT)
+    if meta is None:
+        return _processing_pending()
+    return FileResponse(
+        audio_processing.preview_path(video_id), media_type="audio/mp4",
+        headers={"X-Preview-Start": str(meta["preview_start"]), "Cache-Control": "public, max-age=86400"},
+    )
+
+@router.get("/youtube-audio/peaks")
+def youtube_audio_peaks(video_id: str, bins: int = Query(WAVEFORM_PEAKS, ge=16, le=WAVEFORM_PEAKS)):
+    """
+    Пики амплитуды для отрисовки волны без загрузки самого трека
+    """
+    filename, _, error = _ensure_audio(video_id)
+    if error:
+        return error
+    with span("audio.peaks", video_id=video_id):
+        meta = audio_processing.ensure_processed(filename, video_id, wait=TRANSCODE_WAIT)
+    if meta is None:
+        return _processing_pending()
+    meta["peaks"] = audio_processing.downsample_peaks(meta["peaks"], bins)
+    return meta
+
+@router.get("/similar")
+def similar_tracks(video_id: str, n: int = 10, db: Session = Depends(get_db)):
+    """
+    "Пользователи, сохранившие этот трек, также сохранили" — локально, без LLM
+    """
+    matcher.refresh(db)
+    return {"video_id": video_id, "results": matcher.similar(video_id, max(1, min(n, 50)))}
+
+def _with_titles(db: Session, results: List[dict]) -> List[dict]:
+    """Названия треков из сохранённых песен (у скачанных, но не сохранённых их нет)"""
+    ids = [r["video_id"] for r in results]
+    if not ids:
+        return results
+    rows = db.query(SavedSong.youtube_video_id, SavedSong.title, SavedSong.artist).filter(SavedSong.youtube_video_id.in_(ids)).all()
+    titles = {video_id: (title, artist) for video_id, title, artist in rows}
+    for r in results:
+        r["title"], r["artist"] = titles.get(r["video_id"], (None, None))
+    return results
+
+@router.get("/audio-features")
+def audio_features(video_id: str):
+    """
+    Признаки трека по самому аудио: темп, громкость, яркость, тональность и лад
+    """
+    filename, _, error = _ensure_audio(video_id)
+    if error:
+        return error
+    with span("analyzer.analyze", video_id=video_id):
+        features = audio_index.analyze(filename, video_id, wait=TRANSCODE_WAIT)
+    if features is None:
+        return _processing_pending()
+    return {**features, "feature_names": FEATURE_NAMES}
+
+@router.post("/audio-match")
+def audio_match(body: AudioMatchRequest, db: Session = Depends(get_db)):
+    """
+    Скачанные треки, звучание которых ближе всего к профилю настроения — без LLM
+    """
+    target = {**mood_target(body.mood_analysis), **{k: v for k, v in body.target.items() if k in FEATURE_NAMES}}
+    audio_index.refresh()
+    with span("analyzer.nearest", indexed=audio_index.size()):
+        results = audio_index.nearest(target, max(1, min(body.n, 50)))
+    return {"target": target, "results": _with_titles(db, results)}
+
+@router.get("/similar-audio")
+def similar_audio(video_id: str, n: int = 10, db: Session = Depends(get_db)):
+    """
+    Треки, похожие на video_id по звучанию (в отличие от /similar — по совместным сохранениям)
+    """
+    audio_index.refresh()
+    return {"video_id": video_id, "results": _with_titles(db, audio_index.similar(video_id, max(1, min(n, 50))))}
+
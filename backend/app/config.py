@@ -14,6 +14,26 @@ AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
 
 # Fallback to regular OpenAI if Azure is not configured
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Другой адрес OpenAI-совместимого API (например, локальная заглушка из backend/loadtest)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# gpt-4o нужен для structured outputs (response_format=json_schema)
+OPENAI_TEXT_MODEL = os.getenv("OPENAI_TEXT_MODEL", "gpt-4o")
+# Structured outputs для рекомендаций: ответ модели всегда валиден по JSON Schema
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1") == "1"
+
+# Роутер LLM-провайдеров: пул соединений и circuit breaker
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Априорная задержка провайдера без замеров, секунды — чтобы новый провайдер не шёл первым
+LLM_LATENCY_PRIOR = float(os.getenv("LLM_LATENCY_PRIOR", "3"))
+
+# Планировщик запросов к LLM: общий бюджет, лимит на пользователя, очередь
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "90000"))
+LLM_USER_TOKENS_PER_MINUTE = float(os.getenv("LLM_USER_TOKENS_PER_MINUTE", "20000"))
+LLM_USER_MAX_WAIT = float(os.getenv("LLM_USER_MAX_WAIT", "10"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "100"))
 
 # Frontend URL
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
@@ -31,6 +51,130 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 часа вместо 30 минут
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.mp4', '.mov', '.avi'}
 
+# Item-item рекомендатель (services/matcher.py)
+MATCHER_REFRESH_SECONDS = float(os.getenv("MATCHER_REFRESH_SECONDS", "300"))
+MATCHER_FULL_REBUILD_SECONDS = float(os.getenv("MATCHER_FULL_REBUILD_SECONDS", "3600"))
+MATCHER_MIN_COOCCURRENCE = int(os.getenv("MATCHER_MIN_COOCCURRENCE", "1"))
+
+# Локальный индекс настроение → треки и бюджет ожидания LLM для рекомендаций
+MOOD_INDEX_PATH = os.getenv("MOOD_INDEX_PATH", "data/mood_index.json")
+RECOMMEND_LATENCY_BUDGET = float(os.getenv("RECOMMEND_LATENCY_BUDGET", "8"))
+
+# Общий HTTP-клиент для внешних API (YouTube, Riffusion, скачивание аудио)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+
+# YouTube Data API (адрес переопределяется для нагрузочных тестов)
+YOUTUBE_API_BASE_URL = os.getenv("YOUTUBE_API_BASE_URL", "https://www.googleapis.com/youtube/v3")
+# Сколько видео запрашивать у search.list на один запрос: страница кешируется целиком,
+# max_results и фильтры (длительность, трансляции) применяются к ней уже локально
+YOUTUBE_SEARCH_PAGE_SIZE = int(os.getenv("YOUTUBE_SEARCH_PAGE_SIZE", "25"))
+
+# Локальный индекс найденных треков: запрос отвечается без YouTube API, если похож
+# на уже заданный (сходство триграмм, и все его слова есть в том запросе) или все
+# его слова есть в названиях хотя бы max_results известных треков
+TRACK_INDEX_PATH = os.getenv("TRACK_INDEX_PATH", "data/track_index.json")
+TRACK_INDEX_QUERY_SIMILARITY = float(os.getenv("TRACK_INDEX_QUERY_SIMILARITY", "0.8"))
+TRACK_INDEX_MIN_SCORE = float(os.getenv("TRACK_INDEX_MIN_SCORE", "0.9"))
+TRACK_INDEX_MAX_QUERIES = int(os.getenv("TRACK_INDEX_MAX_QUERIES", "50000"))
+TRACK_INDEX_MAX_TRACKS = int(os.getenv("TRACK_INDEX_MAX_TRACKS", "200000"))
+# Пороги, когда квота YouTube исчерпана и лучше ответить хоть чем-то похожим
+TRACK_INDEX_RELAXED_SIMILARITY = float(os.getenv("TRACK_INDEX_RELAXED_SIMILARITY", "0.45"))
+TRACK_INDEX_RELAXED_SCORE = float(os.getenv("TRACK_INDEX_RELAXED_SCORE", "0.6"))
+
+# Дневная квота YouTube Data API (сброс в полночь по Тихоокеанскому времени) и
+# стадии деградации по доле остатка: устаревший кеш, уменьшенная страница поиска,
+# только локальный индекс. Записи поиска хранятся YOUTUBE_SEARCH_STALE_TTL —
+# после YOUTUBE_SEARCH_CACHE_TTL они устаревшие и отдаются только при нехватке квоты
+YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))
+YOUTUBE_QUOTA_STALE_AT = float(os.getenv("YOUTUBE_QUOTA_STALE_AT", "0.5"))
+YOUTUBE_QUOTA_SHRINK_AT = float(os.getenv("YOUTUBE_QUOTA_SHRINK_AT", "0.25"))
+YOUTUBE_QUOTA_LOCAL_AT = float(os.getenv("YOUTUBE_QUOTA_LOCAL_AT", "0.1"))
+YOUTUBE_QUOTA_SHRINK_PAGE = int(os.getenv("YOUTUBE_QUOTA_SHRINK_PAGE", "10"))
+YOUTUBE_SEARCH_STALE_TTL = float(os.getenv("YOUTUBE_SEARCH_STALE_TTL", str(7 * 24 * 3600)))
+
+# Генерация битов через Riffusion: фоновый опрос задач и webhook
+RIFFUSION_API_URL = os.getenv("RIFFUSION_API_URL", "https://riffusionapi.com/api/generate-music")
+BEAT_POLL_INITIAL_DELAY = float(os.getenv("BEAT_POLL_INITIAL_DELAY", "5"))
+BEAT_POLL_MAX_DELAY = float(os.getenv("BEAT_POLL_MAX_DELAY", "60"))
+BEAT_JOB_TIMEOUT = float(os.getenv("BEAT_JOB_TIMEOUT", "600"))
+# Публичный адрес бэкенда (например, ngrok) и общий для всех воркеров секрет webhook:
+# Riffusion получает callback_url, только если заданы оба, иначе задачи доводит опрос
+BEAT_WEBHOOK_BASE_URL = os.getenv("BEAT_WEBHOOK_BASE_URL")
+BEAT_WEBHOOK_SECRET = os.getenv("BEAT_WEBHOOK_SECRET")
+# Сколько секунд опрос задачи принадлежит воркеру, который её забрал
+BEAT_POLL_LEASE = float(os.getenv("BEAT_POLL_LEASE", "60"))
+# Повторный промпт отдаётся из уже сгенерированных битов
+BEAT_PROMPT_CACHE = os.getenv("BEAT_PROMPT_CACHE", "1") == "1"
+
+# Трассировка запросов: all — логировать все, slow — только медленнее TRACE_SLOW_SECONDS, off
+TRACE_LOG = os.getenv("TRACE_LOG", "slow")
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "2"))
+# Админские эндпоинты (профилировщик); без токена они отключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.005"))
+PROFILER_MAX_PROFILES = int(os.getenv("PROFILER_MAX_PROFILES", "50"))
+
+# Общий для воркеров кеш и блокировки: memory (один процесс), sqlite (одна машина), redis
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "data/shared_cache.db")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+YOUTUBE_SEARCH_CACHE_TTL = float(os.getenv("YOUTUBE_SEARCH_CACHE_TTL", str(24 * 3600)))
+MEDIA_ANALYSIS_CACHE_TTL = float(os.getenv("MEDIA_ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Перекодирование аудио в варианты с меньшим битрейтом (ffmpeg в пуле процессов).
+# TRANSCODE_WAIT — сколько запрос ждёт готовый вариант, потом отдаётся оригинал;
+# TRANSCODE_AHEAD=1 — готовить все варианты сразу после скачивания оригинала
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+TRANSCODE_TIMEOUT = float(os.getenv("TRANSCODE_TIMEOUT", "300"))
+TRANSCODE_WAIT = float(os.getenv("TRANSCODE_WAIT", "15"))
+TRANSCODE_AHEAD = os.getenv("TRANSCODE_AHEAD", "1") == "1"
+
+# Превью (самый громкий фрагмент трека) и пики для отрисовки волны
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", "30"))
+PREVIEW_BITRATE = os.getenv("PREVIEW_BITRATE", "96k")
+WAVEFORM_PEAKS = int(os.getenv("WAVEFORM_PEAKS", "800"))
+
+# Локальный анализ аудио: сколько секунд из середины трека анализировать
+# и как часто воркер досканирует audio_cache в поисках новых признаков
+ANALYZER_MAX_SECONDS = float(os.getenv("ANALYZER_MAX_SECONDS", "120"))
+ANALYZER_REFRESH_SECONDS = float(os.getenv("ANALYZER_REFRESH_SECONDS", "60"))
+
+# Локальный анализ картинок: число цветов в палитре (k-means)
+IMAGE_PALETTE_SIZE = int(os.getenv("IMAGE_PALETTE_SIZE", "5"))
+
+# Пакетный анализ картинок: максимум файлов в запросе, картинок в одном запросе
+# к Vision, параллельных запросов, размер уменьшенной копии и detail (low/high/auto)
+IMAGE_BATCH_MAX_FILES = int(os.getenv("IMAGE_BATCH_MAX_FILES", "10"))
+IMAGE_BATCH_CHUNK = int(os.getenv("IMAGE_BATCH_CHUNK", "5"))
+IMAGE_BATCH_CONCURRENCY = int(os.getenv("IMAGE_BATCH_CONCURRENCY", "2"))
+IMAGE_BATCH_MAX_SIDE = int(os.getenv("IMAGE_BATCH_MAX_SIDE", "768"))
+IMAGE_BATCH_DETAIL = os.getenv("IMAGE_BATCH_DETAIL", "low")
+
+# Content-addressed хранилище файлов (аудио YouTube и Riffusion, загрузки): audio_cache/blobs/ab/cd/<sha256>
+BLOB_DIR = os.getenv("BLOB_DIR", "audio_cache/blobs")
+# Загрузки для анализа (kind="upload"), на которые не ссылается ни одно сообщение
+# чата, удаляются фоновой очисткой через UPLOAD_BLOB_RETENTION_HOURS
+UPLOAD_BLOB_RETENTION_HOURS = float(os.getenv("UPLOAD_BLOB_RETENTION_HOURS", "24"))
+
+# Полнотекстовый поиск по истории чата и сохранённым песням: конфигурация
+# текстового поиска PostgreSQL (в SQLite используется FTS5 с токенизатором unicode61)
+SEARCH_PG_CONFIG = os.getenv("SEARCH_PG_CONFIG", "russian")
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "50"))
+
+# Хранение истории чата: сообщения старше CHAT_RETENTION_DAYS удаляются в фоне
+# (0 — хранить бессрочно) порциями по CHAT_PURGE_BATCH строк с паузой между ними.
+# CHAT_PARTITIONING=1 на PostgreSQL создаёт chat_messages с помесячными разделами
+# (только для новой таблицы), и старые месяцы удаляются целиком через DROP
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", "0"))
+CHAT_PURGE_BATCH = int(os.getenv("CHAT_PURGE_BATCH", "500"))
+CHAT_PURGE_PAUSE = float(os.getenv("CHAT_PURGE_PAUSE", "0.05"))
+CHAT_PURGE_INTERVAL = float(os.getenv("CHAT_PURGE_INTERVAL", "600"))
+CHAT_PARTITIONING = os.getenv("CHAT_PARTITIONING", "0") == "1"
+CHAT_PARTITIONS_AHEAD = int(os.getenv("CHAT_PARTITIONS_AHEAD", "2"))
+
 # Check Azure OpenAI configuration
 if AZURE_OPENAI_API_KEY and AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_DEPLOYMENT_NAME:
     print("✅ Azure OpenAI настроен")
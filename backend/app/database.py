@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 import os
+import time
 from dotenv import load_dotenv
+from .services.metrics import DB_QUERIES_TOTAL, DB_QUERY_DURATION
+from .services.tracing import record_span
 
 load_dotenv()
 
@@ -22,6 +25,27 @@ else:
     os.makedirs('data', exist_ok=True)
     engine = create_engine("sqlite:///./data/vibematch.db", connect_args={"check_same_thread": False})
 
+# Метрики и спаны трассировки: количество и длительность SQL-запросов по типу (SELECT, INSERT, ...)
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+    duration = time.perf_counter() - started
+    DB_QUERIES_TOTAL.inc(operation=operation)
+    DB_QUERY_DURATION.observe(duration, operation=operation)
+    record_span("db.query", started, duration, operation=operation)
+
+@event.listens_for(engine, "handle_error")
+def _handle_error(exception_context):
+    # Упавший запрос не вызывает after_cursor_execute — снимаем его отметку времени здесь
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None and conn.info.get("query_started"):
+        conn.info["query_started"].pop()
+
 # Создаем сессию
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -1,12 +1,17 @@
-from fastapi import Depends, HTTPException, status
+import secrets
+from typing import Optional
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from .database import get_db
 from .models.user import User
 from .services.auth_service import AuthService
+from .services.http_client import UpstreamClient
+from .config import ADMIN_TOKEN
 
 auth_service = AuthService()
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
@@ -26,4 +31,31 @@ def get_current_user(
             detail="Пользователь не найден",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return user 
\ No newline at end of file
+    return user
+
+def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Session = Depends(get_db)
+) -> Optional[User]:
+    """Пользователь по токену, если он передан и действителен; иначе None (анонимный доступ)"""
+    if credentials is None:
+        return None
+    username = auth_service.verify_token(credentials.credentials)
+    if username is None:
+        return None
+    return auth_service.get_user_by_username(db, username)
+
+def get_http_client(request: Request) -> UpstreamClient:
+    """Общий HTTP-клиент приложения (создаётся в lifespan в main.py)"""
+    return request.app.state.http_client
+
+def is_admin_request(request: Request) -> bool:
+    token = request.headers.get("X-Admin-Token")
+    return bool(ADMIN_TOKEN and token and secrets.compare_digest(token, ADMIN_TOKEN))
+
+def require_admin(request: Request) -> None:
+    """Админские эндпоинты: заголовок X-Admin-Token должен совпадать с ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not is_admin_request(request):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Недостаточно прав")
@@ -1,19 +1,55 @@
 # VibeMatch/backend/app/main.py
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import time
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
-from app.api import auth, media, recommend, chat, users
+from starlette.routing import Mount
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.api import auth, media, recommend, chat, users, admin, blobs
 from app.config import HOST, PORT
 from app.models.user import Base
 from app.database import engine
+from app.services.beat_jobs import beat_jobs
+from app.services.mood_index import mood_index
+from app.services.track_index import track_index
+from app.services.transcoder import transcoder
+from app.services.search import search_index
+from app.services.retention import chat_purger
+from app.services.http_client import UpstreamClient
+from app.services.metrics import registry, HTTP_REQUEST_DURATION, HTTP_REQUESTS_TOTAL, HTTP_IN_FLIGHT
+from app.services.tracing import start_trace, log_trace
+from app.services.profiler import profiler
+from app.dependencies import is_admin_request
 
-app = FastAPI(title="VibeMatch API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Один пул соединений на всё приложение для внешних HTTP API
+    app.state.http_client = UpstreamClient()
+    # Фоновые задачи: доведение задач генерации битов до конца
+    beat_jobs.start(app.state.http_client)
+    # Удаление истории по запросу и по сроку хранения — порциями в фоне
+    chat_purger.start()
+    yield
+    await chat_purger.stop()
+    await beat_jobs.stop()
+    await app.state.http_client.aclose()
+    transcoder.shutdown()
+    mood_index.save(force=True)
+    track_index.save(force=True)
+
+
+app = FastAPI(title="VibeMatch API", lifespan=lifespan)
 app.mount("/audio_cache", StaticFiles(directory="audio_cache"), name="audio_cache")
 
-# Создаем таблицы при запуске
+# Создаем таблицы при запуске (chat_messages на PostgreSQL — при необходимости с разделами)
+chat_purger.setup_partitioning(engine)
 Base.metadata.create_all(bind=engine)
+chat_purger.setup(engine)
+# Полнотекстовые индексы и триггеры их синхронизации
+search_index.setup(engine)
 
 # CORS (разрешаем доступ с фронта)
 app.add_middleware(
@@ -22,18 +58,89 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "ETag"],
 )
 
+def _route_template(request: Request) -> str:
+    """
+    Шаблон маршрута (/media/saved-songs/{youtube_video_id}) вместо реального пути,
+    чтобы не плодить метки по id. Несовпавшие пути собираются в "unmatched".
+    Шаблон берётся из самого маршрута; его route.path может быть без префикса
+    include_router — статический префикс дописываем из начала реального пути.
+    """
+    route = request.scope.get("route")
+    if route is None:
+        return "unmatched"
+    if isinstance(route, Mount):
+        return f"{route.path}/{{path}}"
+    segments = [segment for segment in request.url.path.split("/") if segment]
+    template = [segment for segment in route.path.split("/") if segment]
+    prefix = segments[:max(len(segments) - len(template), 0)]
+    return "/" + "/".join(prefix + template)
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    HTTP_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        route = _route_template(request)
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, method=request.method, route=route)
+        HTTP_REQUESTS_TOTAL.inc(method=request.method, route=route, status=str(status_code))
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """
+    Request ID (из X-Request-ID клиента или новый), спаны запроса в структурированный лог
+    и, по запросу админа или для доли трафика, сэмплирующий профилировщик
+    """
+    with start_trace(f"{request.method} {request.url.path}", request.headers.get("X-Request-ID")) as trace:
+        session = None
+        if request.headers.get("X-Profile") == "1" and is_admin_request(request):
+            session = profiler.start(trace.request_id, trace.name, "admin")
+        elif profiler.should_sample():
+            session = profiler.start(trace.request_id, trace.name, "sampled")
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            if session is not None:
+                profiler.stop(session)
+            trace.name = f"{request.method} {_route_template(request)}"
+            log_trace(trace, status_code)
+    response.headers["X-Request-ID"] = trace.request_id
+    if session is not None:
+        response.headers["X-Profile-URL"] = f"/admin/profiles/{trace.request_id}"
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/health")
 async def health_check():
     return JSONResponse(content={"status": "ok", "message": "VibeMatch API is running"})
 
+@app.get("/health/http")
+async def http_client_health():
+    """Переиспользование соединений и задержки общего HTTP-клиента по хостам"""
+    return JSONResponse(content=app.state.http_client.stats())
+
 # Подключаем роуты
 app.include_router(auth.router, prefix="/auth")
 app.include_router(media.router, prefix="/media")
 app.include_router(recommend.router, prefix="/recommend")
 app.include_router(chat.router, prefix="/chat")
 app.include_router(users.router, prefix="/users")
+app.include_router(admin.router, prefix="/admin")
+app.include_router(blobs.router, prefix="/blobs")
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,3 +1,3 @@
-from .user import User, Base, ChatMessage
+from .user import User, Base, ChatMessage, SavedSong, BeatJob, Blob, BlobAlias, UserListVersion, ChatHistoryDeletion
 
-__all__ = ['User', 'Base', 'ChatMessage'] 
\ No newline at end of file
+__all__ = ['User', 'Base', 'ChatMessage', 'SavedSong', 'BeatJob', 'Blob', 'BlobAlias', 'UserListVersion', 'ChatHistoryDeletion'] 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -35,4 +35,57 @@ class ChatMessage(Base):
     content = Column(Text, nullable=True)
     media_url = Column(String, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
-    user = relationship("User", backref="chat_messages") 
\ No newline at end of file
+    user = relationship("User", backref="chat_messages") 
+    # Чтение истории и удаление порциями идут по (user_id, id), очистка по сроку хранения — по timestamp
+    __table_args__ = (
+        Index("ix_chat_messages_user_id_id", "user_id", "id"),
+        Index("ix_chat_messages_timestamp", "timestamp"),
+    )
+
+class ChatHistoryDeletion(Base):
+    """Запрошенное удаление истории: сообщения с id <= up_to_id скрыты и удаляются в фоне порциями"""
+    __tablename__ = "chat_history_deletions"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    up_to_id = Column(BigInteger, nullable=False)
+    requested_at = Column(DateTime, default=datetime.utcnow)
+
+class BeatJob(Base):
+    __tablename__ = "beat_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    request_id = Column(String, unique=True, index=True, nullable=False)  # id задачи в Riffusion
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    prompt = Column(Text, nullable=False)
+    prompt_key = Column(String, index=True, nullable=True)  # sha256 нормализованного промпта
+    status = Column(String, nullable=False, default="pending", index=True)  # 'pending', 'complete' или 'failed'
+    remote_audio_url = Column(String, nullable=True)
+    audio_url = Column(String, nullable=True)  # локальный /blobs/<sha256> (у старых задач /audio_cache/...)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    next_poll_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Blob(Base):
+    """Файл в content-addressed хранилище: один экземпляр на одинаковое содержимое"""
+    __tablename__ = "blobs"
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    content_type = Column(String, nullable=False)
+    ext = Column(String, nullable=True)  # исходное расширение: m4a, webm, mp3, jpg...
+    kind = Column(String, nullable=False, index=True)  # 'youtube', 'riffusion' или 'upload'
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class BlobAlias(Base):
+    """Имя -> blob: youtube:<video_id>, riffusion:<request_id>"""
+    __tablename__ = "blob_aliases"
+    name = Column(String, primary_key=True)
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UserListVersion(Base):
+    """Версия списка пользователя (history, saved_songs): растёт при каждом добавлении/удалении"""
+    __tablename__ = "user_list_versions"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    list_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
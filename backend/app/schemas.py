@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -61,6 +61,7 @@ class ChatMessageOut(ChatMessageBase):
 
 class GenerateBeatRequest(BaseModel):
     prompt: str
+    fresh: bool = False  # True — не брать готовый бит из кеша промптов
 
 class GenerateBeatStatusRequest(BaseModel):
     request_id: str
@@ -71,5 +72,24 @@ class GenerateBeatResponse(BaseModel):
     error: Optional[str] = None
     status: Optional[str] = None
     request_id: Optional[str] = None
-    callback_url: Optional[str] = None
-    message: Optional[str] = None 
\ No newline at end of file
+    message: Optional[str] = None 
+
+class RecommendedTrack(BaseModel):
+    name: str
+    artist: Optional[str] = None
+    reason: Optional[str] = None
+
+class MusicRecommendations(BaseModel):
+    recommended_tracks: List[RecommendedTrack] = []
+    explanation: str = ""
+    alternative_genres: List[str] = []
+
+class ProfilerSettings(BaseModel):
+    sample_rate: float = 0.0  # доля профилируемых запросов, 0..1
+    duration_seconds: float = 60
+
+class AudioMatchRequest(BaseModel):
+    # Ответ analyze_media_mood и/или явные значения признаков 0..1 (energy, tempo, brightness, ...)
+    mood_analysis: Dict[str, Any] = {}
+    target: Dict[str, float] = {}
+    n: int = 10
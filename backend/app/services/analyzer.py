@@ -0,0 +1,292 @@
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from ..config import ANALYZER_MAX_SECONDS, ANALYZER_REFRESH_SECONDS
+from .audio_processing import decode_pcm
+from .transcoder import AUDIO_CACHE_DIR, transcoder
+
+SAMPLE_RATE = 22050
+N_FFT = 2048
+HOP = 512
+
+# Компоненты вектора признаков, все приведены к 0..1
+FEATURE_NAMES = ["energy", "tempo", "brightness", "pulse", "density", "dynamics", "mode", "noisiness"]
+
+KEY_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+# Профили тональностей Крумхансла — Кесслер
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+# Основы слов из анализа настроения -> ожидаемые значения признаков
+MOOD_LEXICON: List[Tuple[Tuple[str, ...], Dict[str, float]]] = [
+    (("спокой", "calm", "relax", "умиротвор", "chill", "lo-fi", "ambient"), {"energy": 0.3, "tempo": 0.25, "brightness": 0.35, "pulse": 0.3}),
+    (("грус", "sad", "меланхол", "ностальг", "тоск", "melanchol"), {"energy": 0.35, "brightness": 0.3, "mode": 0.0}),
+    (("весел", "радост", "happy", "joy", "счаст", "позитив"), {"brightness": 0.65, "tempo": 0.55, "mode": 1.0}),
+    (("энерг", "energetic", "драйв", "агресс", "angry", "злост", "rock", "рок", "metal"), {"energy": 0.85, "tempo": 0.7, "pulse": 0.7, "noisiness": 0.6}),
+    (("романт", "romantic", "нежн", "love", "любов"), {"energy": 0.4, "mode": 1.0, "brightness": 0.45}),
+    (("танц", "dance", "party", "вечерин", "edm", "house"), {"energy": 0.75, "tempo": 0.5, "pulse": 0.85, "density": 0.7}),
+    (("мрачн", "dark", "тревож", "anxious"), {"mode": 0.0, "brightness": 0.25}),
+    (("мечта", "dream", "задумч", "воздуш"), {"energy": 0.35, "brightness": 0.5, "dynamics": 0.6}),
+]
+ENERGY_LEVELS = {"low": 0.3, "medium": 0.55, "high": 0.85}
+
+
+def features_path(video_id: str) -> str:
+    return os.path.join(AUDIO_CACHE_DIR, f"{video_id}.features.json")
+
+
+def _estimate_tempo(flux: np.ndarray, frame_rate: float) -> Tuple[float, float]:
+    """Темп по автокорреляции огибающей атак; второе значение — выраженность пульса 0..1"""
+    envelope = flux - flux.mean()
+    size = 1 << int(np.ceil(np.log2(2 * envelope.size)))
+    spectrum = np.fft.rfft(envelope, size)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum))[:envelope.size]
+    if acf[0] <= 0:
+        return 0.0, 0.0
+    acf = acf / acf[0]
+    lags = np.arange(int(frame_rate * 60 / 200), min(int(frame_rate * 60 / 50), acf.size - 1) + 1)
+    if lags.size == 0:
+        return 0.0, 0.0
+    bpm = 60 * frame_rate / lags
+    # Логнормальный вес вокруг 120 BPM гасит ошибки на октаву (60 vs 120 vs 240)
+    weighted = acf[lags] * np.exp(-0.5 * (np.log2(bpm / 120.0) / 1.0) ** 2)
+    best = int(np.argmax(weighted))
+    return float(bpm[best]), float(np.clip(acf[lags[best]], 0.0, 1.0))
+
+
+def _estimate_key(magnitude: np.ndarray, freqs: np.ndarray) -> Tuple[int, str, float]:
+    """Тональность по хромаграмме и профилям Крумхансла: (номер ноты, major/minor, уверенность)"""
+    band = (freqs >= 55) & (freqs <= 5000)
+    pitch_class = np.round(12 * np.log2(freqs[band] / 440.0) + 69).astype(int) % 12
+    chroma = np.bincount(pitch_class, weights=(magnitude[:, band] ** 2).sum(axis=0), minlength=12)
+    if chroma.sum() == 0:
+        return 0, "major", 0.0
+    # Все 24 тональности: циклические сдвиги профилей, корреляция с хромой
+    shifts = np.arange(12)[:, None]
+    index = (np.arange(12)[None, :] - shifts) % 12
+    candidates = np.vstack([MAJOR_PROFILE[index], MINOR_PROFILE[index]])
+    candidates = candidates - candidates.mean(axis=1, keepdims=True)
+    centered = chroma - chroma.mean()
+    scores = candidates @ centered / (np.linalg.norm(candidates, axis=1) * np.linalg.norm(centered) + 1e-12)
+    best = int(np.argmax(scores))
+    return best % 12, "major" if best < 12 else "minor", float(scores[best])
+
+
+def extract_features(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> Dict[str, Any]:
+    """
+    Признаки трека из моно PCM: громкость, темп, спектральный центроид (яркость),
+    тональность и лад, плотность атак, динамика. Всё считается векторно по кадрам STFT.
+    """
+    if samples.size < N_FFT * 4:
+        raise ValueError("Слишком короткий фрагмент для анализа")
+    frames = np.lib.stride_tricks.sliding_window_view(samples, N_FFT)[::HOP]
+    magnitude = np.abs(np.fft.rfft(frames * np.hanning(N_FFT).astype(np.float32), axis=1))
+    freqs = np.fft.rfftfreq(N_FFT, 1.0 / sample_rate)
+    frame_rate = sample_rate / HOP
+
+    rms = np.sqrt((frames.astype(np.float64) ** 2).mean(axis=1))
+    rms_db = 20 * np.log10(rms + 1e-9)
+    loudness_db = float(20 * np.log10(rms.mean() + 1e-9))
+
+    spectral_sum = magnitude.sum(axis=1) + 1e-12
+    centroid_per_frame = (magnitude * freqs).sum(axis=1) / spectral_sum
+    # Тихие кадры (паузы) не должны тянуть яркость вниз — взвешиваем по громкости
+    centroid = float(np.average(centroid_per_frame, weights=rms + 1e-12))
+    cumulative = np.cumsum(magnitude, axis=1)
+    rolloff = float(np.median(freqs[np.argmax(cumulative >= 0.85 * cumulative[:, -1:], axis=1)]))
+    zero_crossings = float(np.mean(np.abs(np.diff(np.signbit(frames), axis=1)).mean(axis=1)))
+
+    flux = np.maximum(np.diff(np.log1p(magnitude), axis=0), 0).sum(axis=1)
+    tempo, pulse = _estimate_tempo(flux, frame_rate)
+    onsets = np.count_nonzero(flux > flux.mean() + flux.std()) / (flux.size / frame_rate)
+    key, mode, key_confidence = _estimate_key(magnitude, freqs)
+
+    vector = {
+        "energy": np.clip((loudness_db + 40) / 34, 0, 1),
+        "tempo": np.clip((tempo - 60) / 140, 0, 1),
+        "brightness": np.clip(centroid / 4000, 0, 1),
+        "pulse": pulse,
+        "density": np.clip(onsets / 8, 0, 1),
+        "dynamics": np.clip((np.percentile(rms_db, 95) - np.percentile(rms_db, 10)) / 30, 0, 1),
+        "mode": 1.0 if mode == "major" else 0.0,
+        "noisiness": np.clip(zero_crossings / 0.15, 0, 1),
+    }
+    return {
+        "tempo": round(tempo, 1),
+        "loudness_db": round(loudness_db, 1),
+        "spectral_centroid": round(centroid, 1),
+        "spectral_rolloff": round(rolloff, 1),
+        "key": KEY_NAMES[key],
+        "mode": mode,
+        "key_confidence": round(key_confidence, 3),
+        "vector": [round(float(vector[name]), 4) for name in FEATURE_NAMES],
+    }
+
+
+def analyze_track(source: str, video_id: str) -> Dict[str, Any]:
+    """Выполняется в пуле процессов: берёт середину трека (до ANALYZER_MAX_SECONDS) и сохраняет признаки"""
+    samples = decode_pcm(source, SAMPLE_RATE)
+    limit = int(ANALYZER_MAX_SECONDS * SAMPLE_RATE)
+    if samples.size > limit:
+        start = (samples.size - limit) // 2
+        samples = samples[start:start + limit]
+    features = {"video_id": video_id, **extract_features(samples)}
+    target = features_path(video_id)
+    tmp_path = f"{target}.part-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(features, f)
+    os.replace(tmp_path, target)
+    return features
+
+
+def mood_target(mood_analysis: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Профиль настроения (ответ analyze_media_mood) -> ожидаемые значения признаков.
+    Учитываются только признаки, о которых настроение что-то говорит.
+    """
+    values: Dict[str, List[float]] = {}
+    words = []
+    for key in ("mood", "music_genre", "music_style", "description"):
+        if isinstance(mood_analysis.get(key), str):
+            words.append(mood_analysis[key].lower())
+    emotions = mood_analysis.get("emotions") or []
+    words.extend(e.lower() for e in ([emotions] if isinstance(emotions, str) else emotions) if isinstance(e, str))
+    text = " ".join(words)
+    for stems, expected in MOOD_LEXICON:
+        if any(stem in text for stem in stems):
+            for name, value in expected.items():
+                values.setdefault(name, []).append(value)
+    energy_level = str(mood_analysis.get("energy_level") or "").lower()
+    if energy_level in ENERGY_LEVELS:
+        values["energy"] = [ENERGY_LEVELS[energy_level]]
+    return {name: float(np.mean(items)) for name, items in values.items()}
+
+
+class AudioFeatureIndex:
+    """
+    Индекс векторов признаков скачанных треков для поиска ближайших соседей.
+
+    Признаки каждого трека лежат рядом с аудио (audio_cache/{id}.features.json),
+    поэтому индекс у каждого воркера свой и периодически досканирует каталог.
+    Поиск — взвешенное евклидово расстояние по матрице N×8, полным перебором.
+    """
+
+    def __init__(self, refresh_interval: float = ANALYZER_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._features: Dict[str, Dict[str, Any]] = {}
+        self._ids: List[str] = []
+        self._vectors = np.zeros((0, len(FEATURE_NAMES)), dtype=np.float32)
+        self._last_scan: Optional[float] = None
+
+    def _rebuild(self) -> None:
+        self._ids = list(self._features)
+        self._vectors = np.array(
+            [self._features[video_id]["vector"] for video_id in self._ids], dtype=np.float32
+        ).reshape(len(self._ids), len(FEATURE_NAMES))
+
+    def add(self, features: Dict[str, Any]) -> None:
+        with self._lock:
+            self._features[features["video_id"]] = features
+            self._rebuild()
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and self._last_scan is not None and now - self._last_scan < self.refresh_interval:
+            return
+        self._last_scan = now
+        paths = glob.glob(os.path.join(AUDIO_CACHE_DIR, "*.features.json"))
+        present = {os.path.basename(path)[:-len(".features.json")]: path for path in paths}
+        with self._lock:
+            known = set(self._features)
+        loaded = {}
+        for video_id in present.keys() - known:
+            try:
+                with open(present[video_id], encoding="utf-8") as f:
+                    loaded[video_id] = json.load(f)
+            except Exception as e:
+                print(f"[ANALYZER] Не удалось прочитать {present[video_id]}: {e}")
+        with self._lock:
+            removed = known - present.keys()
+            if not loaded and not removed:
+                return
+            for video_id in removed:
+                self._features.pop(video_id, None)
+            self._features.update(loaded)
+            self._rebuild()
+        print(f"[ANALYZER] Индекс: {len(self._ids)} треков (+{len(loaded)}, -{len(removed)})")
+
+    def get(self, video_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._features.get(video_id)
+
+    def size(self) -> int:
+        return len(self._ids)
+
+    def nearest(self, target: Dict[str, float], n: int = 10, exclude: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """Треки, ближайшие к целевым значениям признаков (неуказанные признаки не учитываются)"""
+        weights = np.array([1.0 if name in target else 0.0 for name in FEATURE_NAMES], dtype=np.float32)
+        point = np.array([target.get(name, 0.0) for name in FEATURE_NAMES], dtype=np.float32)
+        with self._lock:
+            ids, vectors = self._ids, self._vectors
+        if not ids or not weights.any():
+            return []
+        distances = np.sqrt((((vectors - point) ** 2) * weights).sum(axis=1) / weights.sum())
+        excluded = set(exclude)
+        count = min(n + len(excluded), len(ids))
+        top = np.argpartition(distances, count - 1)[:count]
+        results = []
+        for i in top[np.argsort(distances[top])]:
+            if ids[i] in excluded:
+                continue
+            features = self._features.get(ids[i], {})
+            results.append({
+                "video_id": ids[i],
+                "distance": round(float(distances[i]), 4),
+                "tempo": features.get("tempo"),
+                "key": features.get("key"),
+                "mode": features.get("mode"),
+            })
+        return results[:n]
+
+    def similar(self, video_id: str, n: int = 10) -> List[Dict[str, Any]]:
+        """Треки, похожие по звучанию на video_id"""
+        features = self.get(video_id)
+        if features is None:
+            return []
+        return self.nearest(dict(zip(FEATURE_NAMES, features["vector"])), n, exclude=[video_id])
+
+    def schedule(self, source: str, video_id: str):
+        """Ставит анализ в общий пул; результат сразу попадает в индекс этого воркера"""
+        future = transcoder.run(f"features:{video_id}", analyze_track, source, video_id)
+        future.add_done_callback(lambda f: f.exception() is None and self.add(f.result()))
+        return future
+
+    def analyze(self, source: str, video_id: str, wait: float) -> Optional[Dict[str, Any]]:
+        """Признаки трека; если их ещё нет — анализирует и ждёт до wait секунд"""
+        features = self.get(video_id)
+        if features is not None:
+            return features
+        if os.path.exists(features_path(video_id)):
+            self.refresh(force=True)
+            return self.get(video_id)
+        if not transcoder.available():
+            return None
+        try:
+            return self.schedule(source, video_id).result(timeout=wait)
+        except FutureTimeoutError:
+            return None
+        except Exception as e:
+            print(f"[ANALYZER] {video_id}: {e}")
+            return None
+
+
+# Общий индекс на процесс
+audio_index = AudioFeatureIndex()
@@ -0,0 +1,147 @@
+import json
+import os
+import subprocess
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from ..config import PREVIEW_SECONDS, PREVIEW_BITRATE, WAVEFORM_PEAKS, TRANSCODE_TIMEOUT
+from .transcoder import AUDIO_CACHE_DIR, transcoder
+
+# Частота для анализа громкости и пиков: для огибающей больше не нужно
+ANALYSIS_SAMPLE_RATE = 8000
+# Окно громкости при поиске фрагмента для превью, секунды
+LOUDNESS_HOP = 0.5
+
+
+def preview_path(video_id: str) -> str:
+    return os.path.join(AUDIO_CACHE_DIR, f"{video_id}.preview.m4a")
+
+
+def peaks_path(video_id: str) -> str:
+    return os.path.join(AUDIO_CACHE_DIR, f"{video_id}.peaks.json")
+
+
+def decode_pcm(path: str, sample_rate: int = 22050) -> np.ndarray:
+    """Декодирует файл через ffmpeg в моно float32 с заданной частотой"""
+    command = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-i", path, "-vn", "-ac", "1", "-ar", str(sample_rate), "-f", "f32le", "-",
+    ]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg: {e.stderr.decode(errors='ignore').strip()[-500:]}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def compute_peaks(samples: np.ndarray, bins: int) -> List[float]:
+    """Максимум модуля амплитуды в каждом из bins равных отрезков, нормированный в 0..1"""
+    if samples.size == 0:
+        return []
+    bins = min(bins, samples.size)
+    # Дополняем нулями до кратной длины, чтобы разрезать одним reshape
+    width = -(-samples.size // bins)
+    padded = np.zeros(width * bins, dtype=np.float32)
+    padded[:samples.size] = np.abs(samples)
+    peaks = padded.reshape(bins, width).max(axis=1)
+    top = peaks.max()
+    if top > 0:
+        peaks = peaks / top
+    return np.round(peaks.astype(np.float64), 3).tolist()
+
+
+def downsample_peaks(peaks: List[float], bins: int) -> List[float]:
+    """Уменьшает разрешение готового массива пиков (максимум по группам)"""
+    if bins >= len(peaks):
+        return peaks
+    return compute_peaks(np.asarray(peaks, dtype=np.float32), bins)
+
+
+def find_preview_start(samples: np.ndarray, sample_rate: int, clip_seconds: float) -> float:
+    """
+    Начало самого громкого участка длиной clip_seconds — обычно это припев.
+    Вступление (первые 10% трека) пропускаем: оно редко бывает показательным.
+    """
+    hop = int(sample_rate * LOUDNESS_HOP)
+    frames = samples.size // hop
+    window = int(clip_seconds / LOUDNESS_HOP)
+    if frames <= window:
+        return 0.0
+    rms = np.sqrt((samples[:frames * hop].reshape(frames, hop) ** 2).mean(axis=1))
+    # Средняя громкость каждого окна из window кадров через кумулятивную сумму
+    cumulative = np.concatenate(([0.0], np.cumsum(rms)))
+    loudness = cumulative[window:] - cumulative[:-window]
+    first = min(int(frames * 0.1), loudness.size - 1)
+    return float((first + int(np.argmax(loudness[first:]))) * LOUDNESS_HOP)
+
+
+def _cut_preview(source: str, target: str, start: float, duration: float) -> None:
+    tmp_path = f"{target}.part-{os.getpid()}"
+    fade = min(1.0, duration / 4)
+    command = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-ss", f"{start:.2f}", "-t", f"{duration:.2f}", "-i", source, "-vn", "-map_metadata", "-1",
+        "-af", f"afade=t=in:d={fade},afade=t=out:st={duration - fade:.2f}:d={fade}",
+        "-c:a", "aac", "-b:a", PREVIEW_BITRATE, "-movflags", "+faststart", "-f", "mp4", tmp_path,
+    ]
+    try:
+        subprocess.run(command, check=True, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+        os.replace(tmp_path, target)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg: {e.stderr.decode(errors='ignore').strip()[-500:]}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def process_track(source: str, video_id: str) -> Dict[str, Any]:
+    """
+    Выполняется в пуле процессов: считает пики, выбирает фрагмент, режет превью.
+    Метаданные пишутся последними — их наличие означает, что всё готово.
+    """
+    samples = decode_pcm(source, ANALYSIS_SAMPLE_RATE)
+    duration = samples.size / ANALYSIS_SAMPLE_RATE
+    clip = min(PREVIEW_SECONDS, duration)
+    start = find_preview_start(samples, ANALYSIS_SAMPLE_RATE, clip)
+    _cut_preview(source, preview_path(video_id), start, clip)
+    meta = {
+        "video_id": video_id,
+        "duration": round(duration, 2),
+        "preview_start": start,
+        "preview_duration": round(clip, 2),
+        "peaks": compute_peaks(samples, WAVEFORM_PEAKS),
+    }
+    target = peaks_path(video_id)
+    with open(f"{target}.part-{os.getpid()}", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(f"{target}.part-{os.getpid()}", target)
+    return meta
+
+
+def load_meta(video_id: str) -> Optional[Dict[str, Any]]:
+    path = peaks_path(video_id)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def schedule(source: str, video_id: str):
+    """Ставит обработку трека в общий пул (одна задача на video_id в процессе)"""
+    return transcoder.run(f"preview:{video_id}", process_track, source, video_id)
+
+
+def ensure_processed(source: str, video_id: str, wait: float) -> Optional[Dict[str, Any]]:
+    """Готовые метаданные превью; если их нет — обрабатывает трек и ждёт до wait секунд"""
+    meta = load_meta(video_id)
+    if meta is not None or not transcoder.available():
+        return meta
+    try:
+        return schedule(source, video_id).result(timeout=wait)
+    except FutureTimeoutError:
+        return None
+    except Exception as e:
+        print(f"[PREVIEW] {video_id}: {e}")
+        return None
@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from ..config import (
+    RIFFUSION_API_URL,
+    BEAT_POLL_INITIAL_DELAY,
+    BEAT_POLL_MAX_DELAY,
+    BEAT_JOB_TIMEOUT,
+    BEAT_WEBHOOK_BASE_URL,
+    BEAT_WEBHOOK_SECRET,
+    BEAT_PROMPT_CACHE,
+    BEAT_POLL_LEASE,
+)
+from ..database import SessionLocal
+from ..models.user import BeatJob
+from .http_client import UpstreamClient
+from .metrics import cache_hit, cache_miss
+from .shared_cache import shared_cache
+from .blob_store import blob_store
+
+AUDIO_CACHE_DIR = "audio_cache"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class RiffusionError(Exception):
+    """Ошибка обращения к Riffusion API"""
+
+
+def _api_key() -> str:
+    api_key = os.getenv("RIFFUSION_API_KEY")
+    if not api_key:
+        raise RiffusionError("RIFFUSION_API_KEY не задан в переменных окружения")
+    return api_key
+
+
+def _headers() -> Dict[str, str]:
+    return {
+        "accept": "application/json",
+        "x-api-key": _api_key(),
+        "Content-Type": "application/json"
+    }
+
+
+def _remote_audio_url(result: Dict[str, Any]) -> Optional[str]:
+    data = result.get("data") or {}
+    items = data.get("data") if isinstance(data, dict) else None
+    if items:
+        return items[0].get("stream_audio_url")
+    return None
+
+
+def prompt_key(prompt: str) -> str:
+    """Ключ кеша промптов: регистр, пробелы и пунктуация по краям не важны"""
+    normalized = re.sub(r"\s+", " ", prompt.strip().lower()).strip(" .,!?;:")
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def audio_filename(request_id: str) -> str:
+    """Имя, под которым результат скачивается перед переносом в хранилище"""
+    return f"riffusion_{re.sub(r'[^A-Za-z0-9_-]', '_', request_id)}.mp3"
+
+
+def _audio_exists(audio_url: str) -> bool:
+    """Файл результата на месте: /blobs/<sha256> или (у старых задач) /audio_cache/<имя>"""
+    if audio_url.startswith("/blobs/"):
+        return blob_store.exists(audio_url.rsplit("/", 1)[-1])
+    return os.path.exists(os.path.join(AUDIO_CACHE_DIR, os.path.basename(audio_url)))
+
+
+def webhook_url() -> Optional[str]:
+    """Адрес для Riffusion с секретом в query — наружу, кроме самого Riffusion, не отдаётся"""
+    if not BEAT_WEBHOOK_BASE_URL or not BEAT_WEBHOOK_SECRET:
+        return None
+    return f"{BEAT_WEBHOOK_BASE_URL.rstrip('/')}/chat/generate-beat/webhook?token={BEAT_WEBHOOK_SECRET}"
+
+
+class BeatJobManager:
+    """
+    Задачи генерации битов в Riffusion, сохранённые в таблице beat_jobs.
+
+    submit() ставит задачу, дальше её до конца доводит сервер: фоновый опрос
+    с экспоненциальной задержкой или webhook от Riffusion. Эндпоинт статуса
+    читает только локальную таблицу и никогда не ходит в Riffusion.
+    """
+
+    def __init__(self, tick: float = 1.0):
+        self.tick = tick
+        self.http: Optional[UpstreamClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    # --- обращения к Riffusion (через общий UpstreamClient) ---
+
+    async def _post(self, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        resp = await self.http.post(RIFFUSION_API_URL, headers=_headers(), json=payload, timeout=timeout)
+        if resp.status_code != 200:
+            raise RiffusionError(f"Riffusion API error: {resp.text}")
+        return resp.json()
+
+    async def _download_to_file(self, remote_url: str, path: str) -> None:
+        """
+        Скачивает аудио потоково, чанками во временный файл, затем атомарно
+        переименовывает — наполовину записанный файл никогда не виден по итоговому имени.
+        """
+        tmp_path = f"{path}.part-{uuid.uuid4().hex}"
+        try:
+            async with self.http.stream("GET", remote_url, timeout=120) as resp:
+                if resp.status_code != 200:
+                    raise RiffusionError("Не удалось скачать аудио")
+                with open(tmp_path, "wb") as f:
+                    async for chunk in resp.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def _download(self, request_id: str, remote_url: str) -> str:
+        """
+        Скачивает результат и кладёт в хранилище под именем riffusion:<request_id>;
+        повторный вызов отдаёт уже сохранённый файл. Возвращает /blobs/<sha256>
+        """
+        alias = f"riffusion:{request_id}"
+        # Опрос и webhook (в том числе в разных воркерах) могут прийти одновременно — качаем один раз
+        async with shared_cache.alock(f"beat_download:{request_id}", ttl=300, timeout=180):
+            blob = await asyncio.to_thread(blob_store.resolve, alias)
+            if blob is None:
+                path = os.path.join(AUDIO_CACHE_DIR, audio_filename(request_id))
+                await self._download_to_file(remote_url, path)
+                blob = await asyncio.to_thread(blob_store.put_file, path, "mp3", "riffusion", alias)
+        return blob_store.url(blob.sha256)
+
+    # --- жизненный цикл задачи ---
+
+    def find_cached(self, db: Session, key: str) -> Optional[BeatJob]:
+        """Готовый (с файлом на диске) или ещё идущий бит по тому же промпту"""
+        jobs = (
+            db.query(BeatJob)
+            .filter(BeatJob.prompt_key == key, BeatJob.status.in_(["complete", "pending"]))
+            .order_by(BeatJob.created_at.desc())
+            .limit(5)
+            .all()
+        )
+        for job in jobs:
+            if job.status == "pending":
+                return job
+            if job.audio_url and _audio_exists(job.audio_url):
+                return job
+        return None
+
+    @staticmethod
+    def find_job(db: Session, request_id: str) -> Optional[BeatJob]:
+        return db.query(BeatJob).filter(BeatJob.request_id == request_id).first()
+
+    @staticmethod
+    def _save(db: Session, job: BeatJob) -> None:
+        """
+        Сохраняет задачу и сразу перечитывает её: после commit атрибуты истекают,
+        и первое обращение к ним иначе ушло бы в БД прямо с event loop.
+        Синхронный запрос — из async-кода вызывать через asyncio.to_thread
+        """
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+
+    async def submit(self, db: Session, prompt: str, user_id: Optional[int] = None, fresh: bool = False) -> BeatJob:
+        """
+        Отправляет промпт в Riffusion и сохраняет задачу. Если такой же промпт
+        уже сгенерирован или генерируется — возвращает существующую задачу.
+        """
+        key = prompt_key(prompt)
+        if BEAT_PROMPT_CACHE and not fresh:
+            cached = await asyncio.to_thread(self.find_cached, db, key)
+            if cached:
+                cache_hit("beat_prompt")
+                print(f"[BEAT] Промпт из кеша: {cached.request_id} ({cached.status})")
+                return cached
+            cache_miss("beat_prompt")
+
+        payload: Dict[str, Any] = {"prompt": prompt}
+        callback_url = webhook_url()
+        if callback_url:
+            payload["callback_url"] = callback_url
+        result = await self._post(payload, timeout=120)
+        print("Riffusion API response:", result)
+
+        request_id = result.get("request_id") or f"local-{uuid.uuid4().hex}"
+        job = BeatJob(
+            request_id=request_id,
+            user_id=user_id,
+            prompt=prompt,
+            prompt_key=key,
+            status="pending",
+            next_poll_at=datetime.utcnow() + timedelta(seconds=BEAT_POLL_INITIAL_DELAY)
+        )
+        await asyncio.to_thread(self._save, db, job)
+        await self.apply_result(db, job, result)
+        self._wakeup.set()
+        return job
+
+    async def apply_result(self, db: Session, job: BeatJob, result: Dict[str, Any]) -> BeatJob:
+        """Применяет ответ Riffusion (опрос или webhook) к задаче"""
+        if job.status != "pending":
+            return job
+        status = result.get("status")
+        if status == "complete":
+            remote_url = _remote_audio_url(result)
+            if not remote_url:
+                job.status = "failed"
+                job.error = "Riffusion API не вернул ссылку на аудио"
+            else:
+                job.remote_audio_url = remote_url
+                try:
+                    job.audio_url = await self._download(job.request_id, remote_url)
+                    job.status = "complete"
+                except Exception as e:
+                    print(f"Ошибка скачивания аудио: {e}")
+                    self._schedule_retry(job, str(e))
+        elif status == "failed":
+            details = result.get("details") or {}
+            job.status = "failed"
+            job.error = f"Ошибка генерации: {details.get('detail', 'Неизвестная ошибка')}"
+        elif status != "pending":
+            job.status = "failed"
+            job.error = f"Неизвестный статус от Riffusion API: {status}"
+        await asyncio.to_thread(self._save, db, job)
+        return job
+
+    def _schedule_retry(self, job: BeatJob, error: Optional[str] = None) -> None:
+        job.attempts = (job.attempts or 0) + 1
+        delay = min(BEAT_POLL_INITIAL_DELAY * (2 ** job.attempts), BEAT_POLL_MAX_DELAY)
+        job.next_poll_at = datetime.utcnow() + timedelta(seconds=delay)
+        if error:
+            job.error = error
+        if job.created_at and datetime.utcnow() - job.created_at > timedelta(seconds=BEAT_JOB_TIMEOUT):
+            job.status = "failed"
+            job.error = "Генерация не завершилась вовремя"
+
+    async def poll_job(self, db: Session, job: BeatJob) -> None:
+        try:
+            result = await self._post({"request_id": job.request_id}, timeout=30)
+        except Exception as e:
+            print(f"[BEAT] Ошибка опроса {job.request_id}: {e}")
+            self._schedule_retry(job, str(e))
+            await asyncio.to_thread(self._save, db, job)
+            return
+        if result.get("status") == "pending":
+            self._schedule_retry(job)
+            await asyncio.to_thread(self._save, db, job)
+            return
+        await self.apply_result(db, job, result)
+
+    @staticmethod
+    def _claim(db: Session, job: BeatJob) -> bool:
+        """
+        Забирает задачу на опрос условным UPDATE: сдвигает next_poll_at на время
+        аренды, только если его ещё никто не сдвинул. Фоновый цикл идёт в каждом
+        воркере, и без этого одну задачу опрашивали бы все воркеры сразу.
+        Синхронный запрос — из async-кода вызывать через asyncio.to_thread
+        """
+        claimed = (
+            db.query(BeatJob)
+            .filter(BeatJob.id == job.id, BeatJob.status == "pending", BeatJob.next_poll_at == job.next_poll_at)
+            .update({BeatJob.next_poll_at: datetime.utcnow() + timedelta(seconds=BEAT_POLL_LEASE)},
+                    synchronize_session=False)
+        )
+        db.commit()
+        if claimed != 1:
+            return False
+        db.refresh(job)
+        return True
+
+    @staticmethod
+    def _due(db: Session) -> List[BeatJob]:
+        return (
+            db.query(BeatJob)
+            .filter(BeatJob.status == "pending", BeatJob.next_poll_at <= datetime.utcnow())
+            .order_by(BeatJob.next_poll_at)
+            .limit(20)
+            .all()
+        )
+
+    async def poll_due(self) -> int:
+        """
+        Опрашивает задачи, у которых подошло время; возвращает их число.
+        Запросы к БД — в пуле потоков, на event loop остаются только вызовы Riffusion
+        """
+        db = SessionLocal()
+        try:
+            due = await asyncio.to_thread(self._due, db)
+            polled = 0
+            for job in due:
+                if not await asyncio.to_thread(self._claim, db, job):
+                    continue
+                await self.poll_job(db, job)
+                polled += 1
+            return polled
+        finally:
+            await asyncio.to_thread(db.close)
+
+    # --- фоновый цикл ---
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.poll_due()
+            except Exception as e:
+                print(f"[BEAT] Ошибка фонового опроса: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self, http: UpstreamClient) -> None:
+        self.http = http
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def job_status(job: BeatJob) -> Dict[str, Any]:
+    """Статус задачи в формате, который ожидает фронтенд"""
+    return {
+        "request_id": job.request_id,
+        "status": job.status,
+        "local_audio_url": job.audio_url,
+        "audio_url": job.audio_url,
+        "error": job.error,
+        "prompt": job.prompt,
+    }
+
+
+# Общий менеджер на процесс
+beat_jobs = BeatJobManager()
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from ..config import BLOB_DIR
+from ..database import SessionLocal
+from ..models.user import Blob, BlobAlias, ChatMessage
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+CONTENT_TYPES = {
+    "m4a": "audio/mp4",
+    "webm": "audio/webm",
+    "opus": "audio/ogg",
+    "mp3": "audio/mpeg",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "webp": "image/webp",
+    "mp4": "video/mp4",
+    "mov": "video/quicktime",
+    "avi": "video/x-msvideo",
+}
+
+
+def content_type_for(ext: Optional[str]) -> str:
+    return CONTENT_TYPES.get((ext or "").lower(), "application/octet-stream")
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Content-addressed хранилище: файл лежит под своим sha256
+    (audio_cache/blobs/ab/cd/abcd...), метаданные и имена (alias) — в БД.
+    Одинаковое содержимое хранится один раз, файл по хешу никогда не меняется,
+    поэтому его можно отдавать с Cache-Control: immutable.
+    """
+
+    def __init__(self, root: str = BLOB_DIR):
+        self.root = root
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    @staticmethod
+    def url(sha256: str) -> str:
+        return f"/blobs/{sha256}"
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    def _register(self, sha256: str, size: int, ext: Optional[str], kind: str, alias: Optional[str]) -> Blob:
+        db = SessionLocal()
+        try:
+            blob = db.get(Blob, sha256)
+            if blob is None:
+                blob = Blob(sha256=sha256, size=size, content_type=content_type_for(ext), ext=ext, kind=kind)
+                db.add(blob)
+                try:
+                    db.commit()
+                except IntegrityError:
+                    # Тот же файл одновременно записал другой воркер
+                    db.rollback()
+                    blob = db.get(Blob, sha256)
+            if alias:
+                db.merge(BlobAlias(name=alias, sha256=sha256))
+                try:
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+            # После commit атрибуты просрочены — загружаем, пока сессия открыта
+            db.refresh(blob)
+            db.expunge(blob)
+            return blob
+        finally:
+            db.close()
+
+    def put_file(self, source: str, ext: Optional[str], kind: str, alias: Optional[str] = None) -> Blob:
+        """
+        Переносит готовый файл в хранилище (source удаляется). Если такое
+        содержимое уже есть — оставляет существующий экземпляр.
+        """
+        sha256 = _file_sha256(source)
+        size = os.path.getsize(source)
+        target = self.path(sha256)
+        if os.path.exists(target):
+            os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+        return self._register(sha256, size, ext, kind, alias)
+
+    def put_bytes(self, data: bytes, ext: Optional[str], kind: str, alias: Optional[str] = None) -> Blob:
+        sha256 = hashlib.sha256(data).hexdigest()
+        target = self.path(sha256)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f"{target}.part-{uuid.uuid4().hex}"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, target)
+        return self._register(sha256, len(data), ext, kind, alias)
+
+    def gc_uploads(self, max_age_hours: float, batch: int = 500) -> int:
+        """
+        Удаляет загрузки (kind="upload") старше max_age_hours, на которые не ссылается
+        ни одно сообщение чата (media_url = /blobs/<sha256>) и ни один alias.
+        Возвращает число удалённых файлов.
+        """
+        cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+        removed = 0
+        last = ""
+        db = SessionLocal()
+        try:
+            while True:
+                candidates: List[str] = [
+                    sha256 for (sha256,) in db.query(Blob.sha256)
+                    .outerjoin(BlobAlias, BlobAlias.sha256 == Blob.sha256)
+                    .filter(Blob.kind == "upload", Blob.created_at < cutoff, BlobAlias.name.is_(None), Blob.sha256 > last)
+                    .order_by(Blob.sha256)
+                    .limit(batch)
+                ]
+                if not candidates:
+                    return removed
+                last = candidates[-1]
+                urls = {self.url(sha256): sha256 for sha256 in candidates}
+                referenced = {
+                    urls[url] for (url,) in
+                    db.query(ChatMessage.media_url).filter(ChatMessage.media_url.in_(list(urls))).distinct()
+                }
+                unused = [sha256 for sha256 in candidates if sha256 not in referenced]
+                if unused:
+                    # Запись удаляем раньше файла: пока она есть, /blobs/<sha256> ещё отдаёт файл
+                    db.query(Blob).filter(Blob.sha256.in_(unused), Blob.created_at < cutoff) \
+                        .delete(synchronize_session=False)
+                    db.commit()
+                    for sha256 in unused:
+                        try:
+                            os.remove(self.path(sha256))
+                            removed += 1
+                        except FileNotFoundError:
+                            pass
+        finally:
+            db.close()
+
+    def get(self, sha256: str) -> Optional[Blob]:
+        db = SessionLocal()
+        try:
+            blob = db.get(Blob, sha256)
+            if blob is not None:
+                db.expunge(blob)
+            return blob
+        finally:
+            db.close()
+
+    def resolve(self, alias: str) -> Optional[Blob]:
+        """Blob по имени, если и запись, и файл на месте"""
+        db = SessionLocal()
+        try:
+            blob = (
+                db.query(Blob)
+                .join(BlobAlias, BlobAlias.sha256 == Blob.sha256)
+                .filter(BlobAlias.name == alias)
+                .first()
+            )
+            if blob is not None:
+                db.expunge(blob)
+        finally:
+            db.close()
+        if blob is None or not self.exists(blob.sha256):
+            return None
+        return blob
+
+
+# Общее хранилище на процесс
+blob_store = BlobStore()
@@ -0,0 +1,170 @@
+import asyncio
+import importlib.util
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+from urllib.parse import urlsplit
+
+import httpx
+
+from ..config import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_CONNECTIONS_PER_HOST,
+    HTTP_RETRIES,
+    HTTP_TIMEOUT,
+    RIFFUSION_API_URL,
+    YOUTUBE_API_BASE_URL,
+)
+
+from .metrics import registry, UPSTREAM_DURATION
+from .tracing import span
+
+HTTP_NEW_CONNECTIONS = registry.counter(
+    "vibematch_upstream_new_connections_total", "Новые TCP-соединения общего HTTP-клиента", ["upstream"]
+)
+HTTP_UPSTREAM_REQUESTS = registry.counter(
+    "vibematch_upstream_http_requests_total", "Запросы общего HTTP-клиента", ["upstream"]
+)
+
+# Имена внешних сервисов в метриках
+UPSTREAM_NAMES = {
+    "www.googleapis.com": "youtube_data_api",
+    "youtube.googleapis.com": "youtube_data_api",
+    "riffusionapi.com": "riffusion",
+}
+# Переопределённые адреса (локальные заглушки) получают те же имена
+UPSTREAM_NAMES.setdefault(urlsplit(YOUTUBE_API_BASE_URL).hostname or "", "youtube_data_api")
+UPSTREAM_NAMES.setdefault(urlsplit(RIFFUSION_API_URL).hostname or "", "riffusion")
+
+
+def upstream_name(host: str) -> str:
+    return UPSTREAM_NAMES.get(host, host)
+
+# Ответы, на которые идемпотентный запрос повторяется
+RETRY_STATUSES = {502, 503, 504}
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "connection_reuse_ratio": round(1 - self.new_connections / self.requests, 3) if self.requests else None,
+            "avg_latency_seconds": round(self.latency_sum / self.requests, 4) if self.requests else None,
+            "max_latency_seconds": round(self.latency_max, 4),
+        }
+
+
+class UpstreamClient:
+    """
+    Общий на приложение httpx.AsyncClient для внешних API (YouTube, Riffusion,
+    скачивание аудио): keep-alive, HTTP/2 при наличии h2, лимит соединений
+    на хост, таймауты и повторы. Считает переиспользование соединений и задержки по хостам.
+    """
+
+    def __init__(self):
+        http2 = importlib.util.find_spec("h2") is not None
+        limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=30.0,
+        )
+        # retries транспорта — повтор при ошибке установки соединения
+        transport = httpx.AsyncHTTPTransport(http2=http2, limits=limits, retries=HTTP_RETRIES)
+        self.client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=10.0),
+            follow_redirects=True,
+        )
+        self.http2 = http2
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, HostStats] = {}
+
+    def _host(self, url: str) -> str:
+        return urlsplit(str(url)).hostname or "unknown"
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+        return self._host_limits[host]
+
+    def _trace(self, host: str, host_stats: HostStats):
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            # Новое TCP-соединение; всё остальное — переиспользованное из пула
+            if event_name == "connection.connect_tcp.complete":
+                host_stats.new_connections += 1
+                HTTP_NEW_CONNECTIONS.inc(upstream=upstream_name(host))
+        return trace
+
+    @staticmethod
+    def _observe(host: str, host_stats: HostStats, elapsed: float, ok: bool) -> None:
+        host_stats.requests += 1
+        host_stats.latency_sum += elapsed
+        host_stats.latency_max = max(host_stats.latency_max, elapsed)
+        HTTP_UPSTREAM_REQUESTS.inc(upstream=upstream_name(host))
+        UPSTREAM_DURATION.observe(elapsed, upstream=upstream_name(host), outcome="ok" if ok else "error")
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Запрос с лимитом на хост; GET повторяется на 502/503/504"""
+        host = self._host(url)
+        host_stats = self._stats.setdefault(host, HostStats())
+        extensions = {**kwargs.pop("extensions", {}), "trace": self._trace(host, host_stats)}
+        attempts = 1 + (HTTP_RETRIES if method.upper() == "GET" else 0)
+        async with self._semaphore(host):
+            for attempt in range(attempts):
+                started = time.monotonic()
+                try:
+                    with span(f"http.{upstream_name(host)}", method=method, attempt=attempt) as attrs:
+                        response = await self.client.request(method, url, extensions=extensions, **kwargs)
+                        attrs["status"] = response.status_code
+                except httpx.HTTPError:
+                    host_stats.errors += 1
+                    self._observe(host, host_stats, time.monotonic() - started, ok=False)
+                    raise
+                self._observe(host, host_stats, time.monotonic() - started, ok=response.status_code < 500)
+                if response.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                    return response
+                await asyncio.sleep(0.2 * (2 ** attempt))
+        return response
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Потоковый ответ (для скачивания больших файлов без загрузки в память)"""
+        host = self._host(url)
+        host_stats = self._stats.setdefault(host, HostStats())
+        extensions = {**kwargs.pop("extensions", {}), "trace": self._trace(host, host_stats)}
+        async with self._semaphore(host):
+            started = time.monotonic()
+            ok = False
+            try:
+                async with self.client.stream(method, url, extensions=extensions, **kwargs) as response:
+                    yield response
+                    ok = response.status_code < 500
+            except httpx.HTTPError:
+                host_stats.errors += 1
+                raise
+            finally:
+                self._observe(host, host_stats, time.monotonic() - started, ok=ok)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": self.http2,
+            "hosts": {host: s.as_dict() for host, s in self._stats.items()},
+        }
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
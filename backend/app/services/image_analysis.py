@@ -0,0 +1,147 @@
+import colorsys
+import io
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from ..config import IMAGE_PALETTE_SIZE
+
+# Для статистики хватает уменьшенной копии: 128 px по большей стороне
+ANALYSIS_SIZE = 128
+KMEANS_ITERATIONS = 12
+
+# Грубые названия цветов по тону (градусы HSV)
+HUE_NAMES = [
+    (15, "красный"), (45, "оранжевый"), (70, "жёлтый"), (160, "зелёный"),
+    (200, "бирюзовый"), (255, "синий"), (290, "фиолетовый"), (335, "розовый"), (360, "красный"),
+]
+
+
+def _color_name(rgb: np.ndarray) -> str:
+    h, s, v = colorsys.rgb_to_hsv(*(rgb / 255.0))
+    if v < 0.18:
+        return "чёрный"
+    if s < 0.15:
+        return "белый" if v > 0.85 else "серый"
+    if s < 0.45 and v < 0.6 and 0.03 < h < 0.15:
+        return "коричневый"
+    degrees = h * 360
+    return next(name for limit, name in HUE_NAMES if degrees <= limit)
+
+
+def _kmeans(pixels: np.ndarray, k: int, seed: int = 0) -> tuple:
+    """k-means по пикселям (N×3) с инициализацией k-means++; возвращает центры и доли кластеров"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(np.unique(pixels, axis=0)))
+    centers = [pixels[rng.integers(len(pixels))]]
+    for _ in range(1, k):
+        distances = ((pixels[:, None, :] - np.array(centers)[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        centers.append(pixels[rng.choice(len(pixels), p=distances / distances.sum())])
+    centers = np.array(centers)
+    for _ in range(KMEANS_ITERATIONS):
+        labels = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        # Сумма пикселей по кластерам одним вызовом на канал
+        sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=k) for c in range(3)], axis=1)
+        updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        if np.allclose(updated, centers, atol=0.5):
+            break
+        centers = updated
+    return centers, counts / counts.sum()
+
+
+def _mood_prior(brightness: float, saturation: float, contrast: float, warmth: float) -> Dict[str, Any]:
+    """Грубая оценка настроения по статистике цвета — подсказка для модели и ответ быстрого режима"""
+    if brightness < 0.3:
+        mood, emotions, genre = ("мрачная", ["таинственность", "напряжение"], "dark ambient") if contrast > 0.35 \
+            else ("меланхоличная", ["грусть", "задумчивость"], "indie")
+    elif saturation > 0.5 and brightness > 0.55:
+        mood, emotions, genre = "радостная", ["радость", "воодушевление"], "pop"
+    elif warmth > 0.08:
+        mood, emotions, genre = "тёплая", ["уют", "ностальгия"], "soul"
+    elif saturation < 0.25:
+        mood, emotions, genre = "спокойная", ["умиротворение", "созерцание"], "lo-fi"
+    else:
+        mood, emotions, genre = "мечтательная", ["лёгкость", "мечтательность"], "dream pop"
+    level = saturation * 0.5 + contrast * 0.7 + brightness * 0.3
+    energy = "high" if level > 0.6 else "medium" if level > 0.35 else "low"
+    return {"mood": mood, "emotions": emotions, "music_genre": genre, "energy_level": energy}
+
+
+def analyze_image_locally(content: bytes, palette_size: int = IMAGE_PALETTE_SIZE) -> Optional[Dict[str, Any]]:
+    """
+    Палитра (k-means), яркость, насыщенность, контраст, теплота и априорное
+    настроение — за миллисекунды, без LLM. None, если картинку не удалось открыть.
+    """
+    try:
+        image = Image.open(io.BytesIO(content))
+        image.draft("RGB", (ANALYSIS_SIZE * 2, ANALYSIS_SIZE * 2))
+        image = image.convert("RGB")
+        image.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    except Exception as e:
+        print(f"[IMAGE] Не удалось открыть изображение: {e}")
+        return None
+    pixels = np.asarray(image, dtype=np.float32).reshape(-1, 3)
+
+    luma = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32) / 255
+    high, low = pixels.max(axis=1), pixels.min(axis=1)
+    saturation = np.where(high > 0, (high - low) / np.maximum(high, 1), 0)
+    brightness = float(luma.mean())
+    contrast = float(np.clip(luma.std() * 2, 0, 1))
+    warmth = float((pixels[:, 0] - pixels[:, 2]).mean() / 255)
+
+    centers, shares = _kmeans(pixels, palette_size)
+    order = np.argsort(shares)[::-1]
+    palette: List[Dict[str, Any]] = []
+    for i in order:
+        rgb = np.clip(np.round(centers[i]), 0, 255)
+        palette.append({
+            "hex": "#{:02x}{:02x}{:02x}".format(*rgb.astype(int)),
+            "share": round(float(shares[i]), 3),
+            "name": _color_name(rgb),
+        })
+    names = list(dict.fromkeys(color["name"] for color in palette if color["share"] >= 0.05))
+    tone = "тёплые" if warmth > 0.05 else "холодные" if warmth < -0.05 else "нейтральные"
+    light = "светлые" if brightness > 0.6 else "тёмные" if brightness < 0.35 else "средней яркости"
+    return {
+        "palette": palette,
+        "brightness": round(brightness, 3),
+        "saturation": round(float(saturation.mean()), 3),
+        "contrast": round(contrast, 3),
+        "warmth": round(warmth, 3),
+        "colors": f"{', '.join(names).capitalize()}; {tone}, {light} тона",
+        "mood_prior": _mood_prior(brightness, float(saturation.mean()), contrast, warmth),
+    }
+
+
+def prompt_hint(stats: Dict[str, Any]) -> str:
+    """Короткая строка со статистикой для промпта Vision вместо просьбы описать цвета"""
+    prior = stats["mood_prior"]
+    return (
+        f"Цвета уже посчитаны: {stats['colors']} (яркость {stats['brightness']}, "
+        f"насыщенность {stats['saturation']}, контраст {stats['contrast']}); "
+        f"по цвету настроение скорее {prior['mood']}. Не описывай цвета, смотри на сюжет."
+    )
+
+
+def downscale_jpeg(content: bytes, max_side: int, quality: int = 85) -> bytes:
+    """Уменьшенная JPEG-копия для Vision; если картинка и так маленькая — исходные байты"""
+    image = Image.open(io.BytesIO(content))
+    if max(image.size) <= max_side and image.format == "JPEG":
+        return content
+    image.draft("RGB", (max_side, max_side))
+    image = image.convert("RGB")
+    image.thumbnail((max_side, max_side))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def prepare_for_batch(content: bytes, max_side: int) -> Dict[str, Any]:
+    """Локальный анализ и уменьшенная копия одной картинки пакета (выполняется в потоке)"""
+    local = analyze_image_locally(content)
+    if local is None:
+        return {"local": None, "jpeg": None}
+    return {"local": local, "jpeg": downscale_jpeg(content, max_side)}
+
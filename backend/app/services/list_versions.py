@@ -0,0 +1,48 @@
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from ..models.user import UserListVersion
+
+HISTORY = "history"
+SAVED_SONGS = "saved_songs"
+
+# Ответ зависит от данных пользователя: кешировать только в браузере и всегда перепроверять
+LIST_CACHE_CONTROL = "private, no-cache"
+
+
+def bump(db: Session, user_id: int, list_name: str) -> None:
+    """
+    Увеличивает версию списка в текущей транзакции — вызывать перед commit
+    любой записи, которая добавляет или удаляет элементы списка.
+    """
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = dialect_insert(UserListVersion).values(user_id=user_id, list_name=list_name, version=1)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[UserListVersion.user_id, UserListVersion.list_name],
+        set_={"version": UserListVersion.version + 1},
+    ))
+
+
+def current(db: Session, user_id: int, list_name: str) -> int:
+    version = (
+        db.query(UserListVersion.version)
+        .filter(UserListVersion.user_id == user_id, UserListVersion.list_name == list_name)
+        .scalar()
+    )
+    return version or 0
+
+
+def etag(user_id: int, list_name: str, version: int) -> str:
+    return f'W/"{list_name}-{user_id}-{version}"'
+
+
+def not_modified(request: Request, tag: str) -> bool:
+    """If-None-Match совпадает с тегом (сравнение слабое, как требует RFC 9110)"""
+    header: Optional[str] = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+    return "*" in candidates or tag.removeprefix("W/") in candidates
@@ -0,0 +1,120 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+# JSON Schema ответа с рекомендациями для structured outputs (response_format=json_schema).
+# recommended_tracks идёт первым, чтобы при стриминге треки приходили раньше пояснения.
+RECOMMENDATIONS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "recommended_tracks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "artist": {"type": "string"},
+                    "reason": {"type": "string"},
+                },
+                "required": ["name", "artist", "reason"],
+                "additionalProperties": False,
+            },
+        },
+        "explanation": {"type": "string"},
+        "alternative_genres": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["recommended_tracks", "explanation", "alternative_genres"],
+    "additionalProperties": False,
+}
+
+RECOMMENDATIONS_RESPONSE_FORMAT: Dict[str, Any] = {
+    "type": "json_schema",
+    "json_schema": {"name": "music_recommendations", "strict": True, "schema": RECOMMENDATIONS_SCHEMA},
+}
+
+_MARKDOWN_JSON = re.compile(r'```json\s*(\{[\s\S]*?\})\s*```')
+_ANY_JSON = re.compile(r'\{[\s\S]*\}')
+
+
+def extract_json_object(content: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Достаёт JSON-объект из ответа модели: сначала как есть, затем из
+    markdown-блока ```json, затем первый {...} в тексте. None — если не вышло.
+    """
+    if not content:
+        return None
+    try:
+        result = json.loads(content)
+        return result if isinstance(result, dict) else None
+    except json.JSONDecodeError:
+        pass
+    for pattern in (_MARKDOWN_JSON, _ANY_JSON):
+        match = pattern.search(content)
+        if not match:
+            continue
+        try:
+            result = json.loads(match.group(1) if pattern.groups else match.group(0))
+        except json.JSONDecodeError:
+            continue
+        if isinstance(result, dict):
+            return result
+    return None
+
+
+class TrackStreamParser:
+    """
+    Инкрементальный разбор стримящегося JSON: как только очередной объект
+    в массиве recommended_tracks закрывается, feed() возвращает его.
+    """
+
+    _ARRAY_START = re.compile(r'"recommended_tracks"\s*:\s*\[')
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._state = "seek"  # seek -> array -> done
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start: Optional[int] = None
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        self.buffer += text
+        tracks: List[Dict[str, Any]] = []
+        if self._state == "seek":
+            match = self._ARRAY_START.search(self.buffer)
+            if not match:
+                return tracks
+            self._pos = match.end()
+            self._state = "array"
+
+        buffer = self.buffer
+        while self._state == "array" and self._pos < len(buffer):
+            ch = buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._object_start = self._pos
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._object_start is not None:
+                    try:
+                        track = json.loads(buffer[self._object_start:self._pos + 1])
+                        if isinstance(track, dict):
+                            tracks.append(track)
+                    except json.JSONDecodeError:
+                        pass
+                    self._object_start = None
+            elif ch == "]" and self._depth == 0:
+                self._state = "done"
+            self._pos += 1
+        return tracks
@@ -0,0 +1,237 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_QUEUE,
+    LLM_TOKENS_PER_MINUTE,
+    LLM_USER_MAX_WAIT,
+    LLM_USER_TOKENS_PER_MINUTE,
+)
+
+from .metrics import registry
+
+LLM_QUEUE_WAIT = registry.histogram(
+    "vibematch_llm_queue_wait_seconds", "Ожидание слота в планировщике LLM", ["priority"]
+)
+LLM_QUEUE_REJECTED = registry.counter(
+    "vibematch_llm_queue_rejected_total", "Запросы к LLM, отклонённые планировщиком", ["priority"]
+)
+LLM_SCHEDULER_ACTIVE = registry.gauge("vibematch_llm_active_requests", "Запросы к LLM в работе")
+LLM_SCHEDULER_QUEUED = registry.gauge("vibematch_llm_queued_requests", "Запросы к LLM в очереди")
+
+# Классы приоритета: меньше — важнее
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+
+class QueueFullError(Exception):
+    """Очередь к LLM переполнена или пользователь исчерпал свой лимит"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Классическое ведро токенов: capacity токенов, пополняется rate токенов в секунду"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Сколько секунд ждать, пока в ведре наберётся amount токенов"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class LLMScheduler:
+    """
+    Центральный планировщик исходящих запросов к LLM.
+
+    - глобальный лимит одновременных запросов и токенов в минуту;
+    - ведро токенов на пользователя, чтобы один пользователь не выбирал общий лимит;
+    - очередь с приоритетами: интерактивные запросы обгоняют фоновые;
+    - при переполнении очереди сразу отвечает QueueFullError (→ 429).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        user_tokens_per_minute: float = LLM_USER_TOKENS_PER_MINUTE,
+        max_queue: int = LLM_MAX_QUEUE,
+        user_max_wait: float = LLM_USER_MAX_WAIT,
+    ):
+        self.max_concurrency = max_concurrency
+        self.user_tokens_per_minute = user_tokens_per_minute
+        self.max_queue = max_queue
+        self.user_max_wait = user_max_wait
+
+        self._global_bucket = TokenBucket(tokens_per_minute)
+        self._user_buckets: Dict[str, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future, float]] = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        # Метрики ожидания в очереди по классам приоритета
+        self._wait_count: Dict[str, int] = {}
+        self._wait_sum: Dict[str, float] = {}
+        self._wait_max: Dict[str, float] = {}
+        self._rejected: Dict[str, int] = {}
+
+    def _user_bucket(self, user_key: str) -> TokenBucket:
+        bucket = self._user_buckets.get(user_key)
+        if bucket is None:
+            if len(self._user_buckets) >= 10000:
+                # Полные вёдра ничем не отличаются от новых — их можно забыть
+                for key in [k for k, b in self._user_buckets.items() if b.time_until(b.capacity) == 0]:
+                    del self._user_buckets[key]
+            bucket = self._user_buckets[user_key] = TokenBucket(self.user_tokens_per_minute)
+        return bucket
+
+    def _reject(self, priority_name: str, message: str, retry_after: float) -> None:
+        self._rejected[priority_name] = self._rejected.get(priority_name, 0) + 1
+        LLM_QUEUE_REJECTED.inc(priority=priority_name)
+        raise QueueFullError(message, retry_after=retry_after)
+
+    def _dispatch(self) -> None:
+        """Выдаёт слоты ожидающим в порядке приоритета, пока позволяют лимиты"""
+        self._wakeup = None
+        while self._waiters and self._active < self.max_concurrency:
+            _, _, future, tokens = self._waiters[0]
+            if future.done():
+                # Ожидание отменено клиентом
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._global_bucket.time_until(tokens)
+            if delay > 0:
+                self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self._global_bucket.take(tokens)
+            self._active += 1
+            future.set_result(None)
+
+    def _prune(self) -> None:
+        """Отменённые ожидания лежат в куче, пока до них не дойдёт _dispatch — убираем их сразу"""
+        if any(future.done() for _, _, future, _ in self._waiters):
+            self._waiters = [waiter for waiter in self._waiters if not waiter[2].done()]
+            heapq.heapify(self._waiters)
+
+    def _release(self) -> None:
+        self._active -= 1
+        if self._wakeup is None:
+            self._dispatch()
+
+    def _record_wait(self, priority_name: str, waited: float) -> None:
+        self._wait_count[priority_name] = self._wait_count.get(priority_name, 0) + 1
+        self._wait_sum[priority_name] = self._wait_sum.get(priority_name, 0.0) + waited
+        self._wait_max[priority_name] = max(self._wait_max.get(priority_name, 0.0), waited)
+        LLM_QUEUE_WAIT.observe(waited, priority=priority_name)
+
+    def _collect_metrics(self) -> None:
+        LLM_SCHEDULER_ACTIVE.set(self._active)
+        LLM_SCHEDULER_QUEUED.set(sum(1 for _, _, future, _ in self._waiters if not future.done()))
+
+    @asynccontextmanager
+    async def slot(self, user_key: Optional[str], priority: int = PRIORITY_INTERACTIVE, tokens: float = 1000):
+        """
+        Занимает слот на один запрос к LLM с оценкой расхода tokens.
+
+            async with llm_scheduler.slot(user_key, PRIORITY_INTERACTIVE, tokens=1500):
+                ...
+        """
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+        started = time.monotonic()
+
+        self._prune()
+        if len(self._waiters) >= self.max_queue:
+            self._reject(priority_name, "Сервис перегружен, очередь запросов к ИИ заполнена.", 1.0)
+
+        # Честность: пользователь ждёт своё ведро, но не дольше user_max_wait
+        bucket = self._user_bucket(user_key or "anonymous")
+        user_delay = bucket.time_until(tokens)
+        if user_delay > self.user_max_wait:
+            self._reject(priority_name, "Слишком много запросов к ИИ. Попробуйте чуть позже.", user_delay)
+        bucket.take(tokens)
+        if user_delay > 0:
+            await asyncio.sleep(user_delay)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future, tokens))
+        if self._wakeup is None:
+            self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот мог быть выдан одновременно с отменой — возвращаем его
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        self._record_wait(priority_name, time.monotonic() - started)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "queued": sum(1 for _, _, future, _ in self._waiters if not future.done()),
+            "max_concurrency": self.max_concurrency,
+            "global_tokens_available": round(self._global_bucket.tokens, 1),
+            "queue_wait": {
+                name: {
+                    "count": count,
+                    "avg_seconds": round(self._wait_sum[name] / count, 4),
+                    "max_seconds": round(self._wait_max[name], 4),
+                }
+                for name, count in self._wait_count.items()
+            },
+            "rejected": dict(self._rejected),
+        }
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    """Грубая оценка расхода: ~4 символа текста на токен, ~1000 токенов на картинку (85 при detail=low), плюс ответ"""
+    total = max_tokens
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += len(content) // 4
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += len(part.get("text", "")) // 4
+                elif part.get("type") == "image_url":
+                    # detail=low — фиксированные ~85 токенов на картинку
+                    total += 85 if part.get("image_url", {}).get("detail") == "low" else 1000
+    return total
+
+
+# Общий планировщик на процесс
+llm_scheduler = LLMScheduler()
+registry.add_collector(llm_scheduler._collect_metrics)
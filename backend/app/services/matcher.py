@@ -0,0 +1,217 @@
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy.orm import Session
+
+from ..config import MATCHER_REFRESH_SECONDS, MATCHER_FULL_REBUILD_SECONDS, MATCHER_MIN_COOCCURRENCE
+from ..models.user import SavedSong
+
+
+class ItemItemMatcher:
+    """
+    Локальный item-item рекомендатель по таблице saved_songs:
+    "пользователи, сохранившие X, также сохранили Y".
+
+    Строит разреженную матрицу пользователь×трек, считает косинусную
+    близость треков (X^T X, нормированная) и обновляется периодически.
+    Новые строки SavedSong дочитываются инкрементально (по id), полная
+    перечитка таблицы делается реже — чтобы учесть удалённые песни.
+    """
+
+    def __init__(
+        self,
+        refresh_interval: float = MATCHER_REFRESH_SECONDS,
+        full_rebuild_interval: float = MATCHER_FULL_REBUILD_SECONDS,
+        min_cooccurrence: int = MATCHER_MIN_COOCCURRENCE,
+    ):
+        self.refresh_interval = refresh_interval
+        self.full_rebuild_interval = full_rebuild_interval
+        self.min_cooccurrence = min_cooccurrence
+
+        self._lock = threading.Lock()
+        # Сырые пары (user_id, video_id) — копятся между перестроениями
+        self._user_ids: List[int] = []
+        self._video_ids: List[str] = []
+        self._meta: Dict[str, Dict[str, Optional[str]]] = {}
+        self._last_row_id = 0
+        self._last_refresh: Optional[float] = None
+        self._last_full_rebuild: Optional[float] = None
+
+        # Результат перестроения
+        self._item_index: Dict[str, int] = {}
+        self._items: np.ndarray = np.array([], dtype=object)
+        self._user_index: Dict[int, int] = {}
+        self._user_items: sparse.csr_matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._similarity: sparse.csr_matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+
+    # --- построение ---
+
+    def build(self, rows: Iterable[Tuple[int, str, Optional[str], Optional[str]]]) -> None:
+        """
+        Полностью перестраивает модель из строк (user_id, video_id, title, artist).
+        """
+        user_ids: List[int] = []
+        video_ids: List[str] = []
+        meta: Dict[str, Dict[str, Optional[str]]] = {}
+        for user_id, video_id, title, artist in rows:
+            user_ids.append(user_id)
+            video_ids.append(video_id)
+            meta[video_id] = {"title": title, "artist": artist}
+        with self._lock:
+            self._user_ids = user_ids
+            self._video_ids = video_ids
+            self._meta = meta
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        """Пересчитывает матрицы из накопленных пар. Вызывается под self._lock."""
+        if not self._video_ids:
+            self._item_index = {}
+            self._items = np.array([], dtype=object)
+            self._user_index = {}
+            self._user_items = sparse.csr_matrix((0, 0), dtype=np.float32)
+            self._similarity = sparse.csr_matrix((0, 0), dtype=np.float32)
+            return
+
+        items, item_codes = np.unique(np.asarray(self._video_ids, dtype=object), return_inverse=True)
+        users, user_codes = np.unique(np.asarray(self._user_ids, dtype=np.int64), return_inverse=True)
+
+        # Повторные сохранения одного трека не должны увеличивать вес
+        X = sparse.csr_matrix(
+            (np.ones(len(item_codes), dtype=np.float32), (user_codes, item_codes)),
+            shape=(len(users), len(items)),
+        )
+        X.sum_duplicates()
+        X.data[:] = 1.0
+
+        co = (X.T @ X).tocsr()
+        co.setdiag(0)
+        if self.min_cooccurrence > 1:
+            co.data[co.data < self.min_cooccurrence] = 0
+        co.eliminate_zeros()
+
+        norms = np.sqrt(np.asarray(X.sum(axis=0)).ravel()).astype(np.float32)
+        inv = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        sim = sparse.diags(inv) @ co @ sparse.diags(inv)
+
+        self._items = items
+        self._item_index = {video_id: i for i, video_id in enumerate(items)}
+        self._user_index = {int(u): i for i, u in enumerate(users)}
+        self._user_items = X
+        self._similarity = sim.tocsr().astype(np.float32)
+
+    def refresh(self, db: Session, force: bool = False) -> bool:
+        """
+        Подтягивает изменения из БД, если прошёл refresh_interval.
+        Возвращает True, если модель была перестроена.
+
+        Синхронный запрос к БД и перестроение матриц — из async-кода
+        вызывать через asyncio.to_thread.
+        """
+        now = time.monotonic()
+        # Проверка и отметка под блокировкой: одновременные запросы не перечитывают таблицу каждый
+        with self._lock:
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+                return False
+            self._last_refresh = now
+            full = (
+                force
+                or self._last_full_rebuild is None
+                or now - self._last_full_rebuild >= self.full_rebuild_interval
+            )
+            last_row_id = self._last_row_id
+
+        query = db.query(SavedSong.id, SavedSong.user_id, SavedSong.youtube_video_id, SavedSong.title, SavedSong.artist)
+        if not full:
+            query = query.filter(SavedSong.id > last_row_id)
+        rows = query.order_by(SavedSong.id).all()
+
+        with self._lock:
+            if full:
+                self._user_ids, self._video_ids, self._meta = [], [], {}
+                self._last_full_rebuild = now
+            elif not rows:
+                return False
+            for row_id, user_id, video_id, title, artist in rows:
+                self._user_ids.append(user_id)
+                self._video_ids.append(video_id)
+                self._meta[video_id] = {"title": title, "artist": artist}
+                self._last_row_id = max(self._last_row_id, row_id)
+            self._rebuild()
+        print(f"[MATCHER] Модель обновлена ({'полная' if full else 'инкрементальная'}): "
+              f"{len(self._items)} треков, {len(self._user_index)} пользователей")
+        return True
+
+    # --- запросы ---
+
+    def _format(self, codes: np.ndarray, scores: np.ndarray) -> List[Dict[str, Any]]:
+        result = []
+        for code, score in zip(codes, scores):
+            video_id = self._items[code]
+            meta = self._meta.get(video_id, {})
+            result.append({
+                "youtube_video_id": video_id,
+                "title": meta.get("title"),
+                "artist": meta.get("artist"),
+                "score": round(float(score), 4),
+            })
+        return result
+
+    @staticmethod
+    def _top(scores: np.ndarray, n: int) -> np.ndarray:
+        if n <= 0:
+            return np.array([], dtype=np.int64)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > n:
+            candidates = candidates[np.argpartition(-scores[candidates], n - 1)[:n]]
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    def similar(self, video_id: str, n: int = 10) -> List[Dict[str, Any]]:
+        """Треки, которые чаще всего сохраняют вместе с video_id."""
+        with self._lock:
+            code = self._item_index.get(video_id)
+            if code is None:
+                return []
+            row = self._similarity.getrow(code).toarray().ravel()
+            top = self._top(row, n)
+            return self._format(top, row[top])
+
+    def recommend_for_user(self, user_id: int, n: int = 10, seed_video_ids: Sequence[str] = ()) -> List[Dict[str, Any]]:
+        """
+        Персональные рекомендации: сумма близостей ко всем сохранённым трекам
+        пользователя (или к seed_video_ids), без уже сохранённых.
+        """
+        with self._lock:
+            if self._similarity.shape[0] == 0:
+                return []
+            profile = np.zeros(len(self._items), dtype=np.float32)
+            user_code = self._user_index.get(user_id)
+            if user_code is not None:
+                profile += self._user_items.getrow(user_code).toarray().ravel()
+            for video_id in seed_video_ids:
+                code = self._item_index.get(video_id)
+                if code is not None:
+                    profile[code] = 1.0
+            if not profile.any():
+                return []
+            # Матрица близости симметрична, поэтому S·p
+            scores = self._similarity.dot(profile)
+            scores[profile > 0] = 0
+            top = self._top(scores, n)
+            return self._format(top, scores[top])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "users": len(self._user_index),
+                "rows": len(self._video_ids),
+                "similarity_nnz": int(self._similarity.nnz),
+            }
+
+
+# Общий экземпляр на процесс
+matcher = ItemItemMatcher()
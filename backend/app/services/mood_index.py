@@ -0,0 +1,204 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..config import MOOD_INDEX_PATH
+from ..models.user import SavedSong
+
+# Тег для треков без настроения (сохранённые песни) — используется как последний резерв
+POPULAR_TAG = "__popular__"
+
+
+def _normalize(tag: str) -> str:
+    return re.sub(r"\s+", " ", str(tag).strip().lower())
+
+
+def mood_tags(mood_analysis: Dict[str, Any]) -> List[str]:
+    """
+    Достаёт теги из анализа настроения: mood, emotions, music_genre/music_style.
+    """
+    tags = []
+    for key in ("mood", "music_genre", "music_style"):
+        value = mood_analysis.get(key)
+        if isinstance(value, str) and value.strip():
+            tags.append(_normalize(value))
+    emotions = mood_analysis.get("emotions") or []
+    if isinstance(emotions, str):
+        emotions = [emotions]
+    tags.extend(_normalize(e) for e in emotions if isinstance(e, str) and e.strip())
+    return list(dict.fromkeys(tags))
+
+
+def _track_key(name: str, artist: Optional[str]) -> str:
+    return f"{_normalize(artist or '')}|{_normalize(name)}"
+
+
+class MoodIndex:
+    """
+    Локальный индекс тег настроения → ранжированные треки.
+
+    Наполняется успешными ответами LLM (record) и сохранёнными песнями
+    (refresh_saved_songs), хранится в JSON-файле. Используется как мгновенный
+    ответ, когда модель не уложилась в бюджет задержки.
+    """
+
+    def __init__(self, path: str = MOOD_INDEX_PATH, save_interval: float = 30.0, refresh_interval: float = 600.0):
+        self.path = path
+        self.save_interval = save_interval
+        self.refresh_interval = refresh_interval
+        self._last_refresh: Optional[float] = None
+        self._lock = threading.Lock()
+        # tag -> {track_key: score}
+        self._tags: Dict[str, Dict[str, float]] = {}
+        # track_key -> {"name", "artist", "reason"}
+        self._tracks: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._tags = data.get("tags", {})
+            self._tracks = data.get("tracks", {})
+            print(f"[MOOD_INDEX] Загружено {len(self._tracks)} треков, {len(self._tags)} тегов")
+        except Exception as e:
+            print(f"[MOOD_INDEX] Не удалось загрузить индекс: {e}")
+
+    def save(self, force: bool = False) -> None:
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._last_save < self.save_interval):
+                return
+            # Сериализуем под блокировкой: record() из других потоков меняет вложенные словари
+            payload = json.dumps({"tags": self._tags, "tracks": self._tracks}, ensure_ascii=False)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Уникальный временный файл — параллельные save() не мешают друг другу
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".mood_index-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _add(self, tags: Iterable[str], name: str, artist: Optional[str], reason: Optional[str], weight: float) -> None:
+        key = _track_key(name, artist)
+        track = self._tracks.setdefault(key, {"name": name, "artist": artist, "reason": reason})
+        if reason and not track.get("reason"):
+            track["reason"] = reason
+        for tag in tags:
+            bucket = self._tags.setdefault(tag, {})
+            bucket[key] = bucket.get(key, 0.0) + weight
+        self._dirty = True
+
+    def record(self, mood_analysis: Dict[str, Any], recommendations: Dict[str, Any]) -> None:
+        """
+        Запоминает успешный ответ LLM: каждый трек получает вес по всем тегам настроения,
+        треки выше в списке — чуть больше. Может записать файл индекса — из async-кода
+        вызывать через asyncio.to_thread.
+        """
+        tags = mood_tags(mood_analysis)
+        tracks = recommendations.get("recommended_tracks") or []
+        if not tags or not tracks:
+            return
+        with self._lock:
+            for position, track in enumerate(tracks):
+                if not isinstance(track, dict) or not track.get("name"):
+                    continue
+                weight = 1.0 / (1 + 0.2 * position)
+                self._add(tags, track["name"], track.get("artist"), track.get("reason"), weight)
+            for genre in recommendations.get("alternative_genres") or []:
+                if isinstance(genre, str):
+                    self._tags.setdefault(_normalize(genre), {})
+        try:
+            self.save()
+        except Exception as e:
+            # Ошибка записи файла не должна превращать валидный ответ LLM в fallback
+            with self._lock:
+                self._dirty = True
+            print(f"[MOOD_INDEX] Не удалось сохранить индекс: {e}")
+
+    def refresh_saved_songs(self, db: Session, limit: int = 500, force: bool = False) -> None:
+        """
+        Добавляет самые сохраняемые песни под тег POPULAR_TAG, а их популярность
+        учитывается в ранжировании уже проиндексированных треков.
+        Синхронный запрос к БД — из async-кода вызывать через asyncio.to_thread.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+                return
+            self._last_refresh = now
+        rows = (
+            db.query(SavedSong.title, SavedSong.artist, func.count(SavedSong.id).label("saves"))
+            .group_by(SavedSong.title, SavedSong.artist)
+            .order_by(func.count(SavedSong.id).desc())
+            .limit(limit)
+            .all()
+        )
+        with self._lock:
+            self._tags[POPULAR_TAG] = {}
+            for title, artist, saves in rows:
+                self._add([POPULAR_TAG], title, artist, "Популярно у пользователей VibeMatch", float(saves))
+        self.save()
+
+    def query(self, mood_analysis: Dict[str, Any], n: int = 5) -> List[Dict[str, Any]]:
+        """
+        Возвращает до n треков, ранжированных по сумме весов совпавших тегов
+        (плюс небольшой бонус за популярность).
+        """
+        tags = mood_tags(mood_analysis)
+        with self._lock:
+            scores: Dict[str, float] = {}
+            for tag in tags:
+                for key, weight in self._tags.get(tag, {}).items():
+                    scores[key] = scores.get(key, 0.0) + weight
+            popular = self._tags.get(POPULAR_TAG, {})
+            if scores:
+                for key in scores:
+                    scores[key] += 0.1 * popular.get(key, 0.0)
+            else:
+                scores = dict(popular)
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n]
+            return [
+                {
+                    "name": self._tracks[key]["name"],
+                    "artist": self._tracks[key].get("artist"),
+                    "reason": self._tracks[key].get("reason") or "Подобрано по похожему настроению",
+                }
+                for key, _ in ranked
+                if key in self._tracks
+            ]
+
+    def recommendations(self, mood_analysis: Dict[str, Any], n: int = 5) -> Optional[Dict[str, Any]]:
+        """Ответ в формате get_music_recommendations или None, если индекс пуст для этих тегов."""
+        tracks = self.query(mood_analysis, n)
+        if not tracks:
+            return None
+        return {
+            "explanation": "Быстрая подборка из локального индекса настроений",
+            "recommended_tracks": tracks,
+            "alternative_genres": [],
+            "source": "mood_index",
+        }
+
+
+# Общий экземпляр на процесс
+mood_index = MoodIndex()
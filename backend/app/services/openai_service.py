@@ -1,7 +1,14 @@
+import asyncio
 import base64
+import hashlib
 import io
+import json
 import mimetypes
-from typing import Optional, Dict, Any
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, AsyncIterator, Callable, Iterator, List, Tuple
+import httpx
 import openai
 from fastapi import UploadFile
 from ..config import (
@@ -9,34 +16,402 @@ from ..config import (
     AZURE_OPENAI_ENDPOINT, 
     AZURE_OPENAI_API_VERSION, 
     AZURE_OPENAI_DEPLOYMENT_NAME,
-    OPENAI_API_KEY
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_TEXT_MODEL,
+    LLM_STRUCTURED_OUTPUT,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_COOLDOWN,
+    LLM_LATENCY_PRIOR,
+    LLM_MAX_CONNECTIONS,
+    MEDIA_ANALYSIS_CACHE_TTL,
+    IMAGE_BATCH_CHUNK,
+    IMAGE_BATCH_CONCURRENCY,
+    IMAGE_BATCH_MAX_SIDE,
+    IMAGE_BATCH_DETAIL
 )
+from .mood_index import mood_index
+from .llm_scheduler import llm_scheduler, estimate_tokens, QueueFullError, PRIORITY_INTERACTIVE
+from .llm_parsing import extract_json_object, TrackStreamParser, RECOMMENDATIONS_RESPONSE_FORMAT
+from ..schemas import MusicRecommendations, RecommendedTrack
+from .metrics import registry, UPSTREAM_DURATION
+from .tracing import span
+from .metrics import cache_hit, cache_miss
+from .shared_cache import shared_cache
+from .image_analysis import analyze_image_locally, prompt_hint, prepare_for_batch
+from .blob_store import blob_store
+
+BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+LLM_BREAKER_STATE = registry.gauge(
+    "vibematch_llm_breaker_state", "Состояние предохранителя (0 closed, 1 half_open, 2 open)", ["provider", "model"]
+)
+LLM_LATENCY_EWMA = registry.gauge(
+    "vibematch_llm_latency_ewma_seconds", "Скользящая оценка задержки провайдера", ["provider", "model"]
+)
+LLM_PROVIDER_ERRORS = registry.counter(
+    "vibematch_llm_provider_errors_total", "Ошибки LLM-провайдеров", ["provider", "model"]
+)
+
+class CircuitBreaker:
+    """
+    Предохранитель для пары провайдер+модель.
+
+    closed — запросы идут; после failure_threshold ошибок подряд — open,
+    провайдер пропускается cooldown секунд; затем half_open — пропускается
+    один пробный запрос, успех закрывает предохранитель, ошибка снова открывает.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def available(self) -> bool:
+        """Пропустил бы запрос сейчас — без захвата пробного слота"""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self._trial_in_flight
+
+    def allow(self) -> bool:
+        """Пропускает запрос; в half_open занимает единственный пробный слот"""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self) -> None:
+        """Пробный запрос завершился без результата (например, отменён) — слот снова свободен"""
+        if self.state == "half_open":
+            self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class LLMProvider:
+    """
+    Долгоживущий клиент одного провайдера (Azure OpenAI или OpenAI) с пулом
+    соединений, предохранителями по моделям и скользящей оценкой задержки.
+    """
+
+    def __init__(self, name: str, client: Any, models: Dict[str, str]):
+        self.name = name
+        self.client = client
+        # kind ("text" / "vision") -> имя модели или deployment
+        self.models = models
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latency_ewma: Dict[str, float] = {}
+        self.requests: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker()
+        return self.breakers[model]
+
+    def record(self, model: str, latency: float, ok: bool) -> None:
+        self.requests[model] = self.requests.get(model, 0) + 1
+        UPSTREAM_DURATION.observe(latency, upstream=self.name, outcome="ok" if ok else "error")
+        if ok:
+            self.breaker(model).record_success()
+            previous = self.latency_ewma.get(model)
+            self.latency_ewma[model] = latency if previous is None else 0.8 * previous + 0.2 * latency
+        else:
+            self.errors[model] = self.errors.get(model, 0) + 1
+            LLM_PROVIDER_ERRORS.inc(provider=self.name, model=model)
+            self.breaker(model).record_failure()
+
+
+def _http_client() -> Any:
+    """HTTP-клиент с пулом keep-alive соединений для SDK OpenAI"""
+    return openai.DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
+
+
+async def _iterate_in_thread(make_iterator: Callable[[], Iterator[Any]]) -> AsyncIterator[Any]:
+    """
+    Прогоняет синхронный итератор (стрим SDK) в отдельном потоке и отдаёт
+    элементы в event loop по мере поступления. Ошибка итератора пробрасывается.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+    stop = threading.Event()
+
+    def worker():
+        try:
+            iterator = make_iterator()
+            try:
+                for item in iterator:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            finally:
+                close = getattr(iterator, "close", None)
+                if close:
+                    close()
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+    loop.run_in_executor(None, worker)
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _delta_text(chunk: Any) -> Optional[str]:
+    """Текст из чанка стрима (у Azure первый чанк бывает без choices)"""
+    if chunk.choices and chunk.choices[0].delta:
+        return chunk.choices[0].delta.content
+    return None
+
 
 class OpenAIService:
     def __init__(self):
+        self.providers: List[LLMProvider] = []
         # Проверяем, настроен ли Azure OpenAI
         if AZURE_OPENAI_API_KEY and AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_DEPLOYMENT_NAME:
-            # Используем Azure OpenAI
-            self.client = openai.AzureOpenAI(
+            azure_client = openai.AzureOpenAI(
                 api_key=AZURE_OPENAI_API_KEY,
                 api_version=AZURE_OPENAI_API_VERSION,
-                azure_endpoint=AZURE_OPENAI_ENDPOINT
+                azure_endpoint=AZURE_OPENAI_ENDPOINT,
+                http_client=_http_client(),
+                max_retries=0
             )
-            self.deployment_name = AZURE_OPENAI_DEPLOYMENT_NAME
-            self.use_azure = True
+            self.providers.append(LLMProvider("azure", azure_client, {
+                "text": AZURE_OPENAI_DEPLOYMENT_NAME,
+                "vision": "gpt-4o"  # Используем gpt-4o для Vision
+            }))
             print("🔵 Используется Azure OpenAI")
-        elif OPENAI_API_KEY:
-            # Используем обычный OpenAI
-            self.client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            self.deployment_name = None
-            self.use_azure = False
+        if OPENAI_API_KEY:
+            openai_client = openai.OpenAI(
+                api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=_http_client(), max_retries=0
+            )
+            self.providers.append(LLMProvider("openai", openai_client, {
+                "text": OPENAI_TEXT_MODEL,
+                "vision": "gpt-4o"
+            }))
             print("🟢 Используется OpenAI API")
-        else:
+        if not self.providers:
             raise ValueError("Не настроен ни Azure OpenAI, ни OpenAI API")
+
+        registry.add_collector(self._collect_metrics)
+
+        # Основной провайдер — для кода, который обращается к клиенту напрямую
+        primary = self.providers[0]
+        self.client = primary.client
+        self.use_azure = primary.name == "azure"
+        self.deployment_name = primary.models["text"] if self.use_azure else None
+
+    def _candidates(self, kind: str) -> List[Tuple[LLMProvider, str]]:
+        """
+        Провайдеры, способные выполнить запрос kind, по возрастанию задержки;
+        порядок конфигурации — при равенстве. Предохранители только проверяются:
+        пробный слот занимает _attempt для провайдера, к которому реально идём.
+        """
+        available = []
+        for priority, provider in enumerate(self.providers):
+            model = provider.models.get(kind)
+            if model and provider.breaker(model).available():
+                available.append((provider.latency_ewma.get(model, LLM_LATENCY_PRIOR), priority, provider, model))
+        available.sort(key=lambda item: (item[0], item[1]))
+        return [(provider, model) for _, _, provider, model in available]
+
+    @staticmethod
+    @contextmanager
+    def _attempt(provider: LLMProvider, model: str):
+        """
+        Занимает предохранитель на время одной попытки; даёт False, если его уже
+        занял другой запрос. Пробный слот освобождается и при отмене запроса
+        (CancelledError не ловится except Exception), иначе предохранитель навсегда
+        остался бы в half_open с занятым слотом.
+        """
+        breaker = provider.breaker(model)
+        if not breaker.allow():
+            yield False
+            return
+        trial = breaker.state == "half_open"
+        try:
+            yield True
+        finally:
+            if trial:
+                breaker.release_trial()
+
+    async def complete(
+        self,
+        kind: str,
+        messages: List[Dict[str, Any]],
+        user_key: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        **kwargs
+    ) -> Any:
+        """
+        Выполняет chat completion через первый здоровый провайдер, при ошибке
+        переходит к следующему. Запрос проходит через общий llm_scheduler
+        (лимиты на пользователя и приоритеты); синхронный SDK вызывается в отдельном потоке.
+        """
+        tokens = estimate_tokens(messages, kwargs.get("max_tokens", 500))
+        with span("llm.complete", kind=kind, estimated_tokens=tokens) as attrs:
+            queued = time.perf_counter()
+            async with llm_scheduler.slot(user_key, priority, tokens):
+                attrs["queue_ms"] = round((time.perf_counter() - queued) * 1000, 2)
+                return await self._complete_with_failover(kind, messages, **kwargs)
+
+    async def _complete_with_failover(self, kind: str, messages: List[Dict[str, Any]], **kwargs) -> Any:
+        candidates = self._candidates(kind)
+        if not candidates:
+            raise RuntimeError("Все LLM-провайдеры временно недоступны (circuit breaker)")
+        last_error: Optional[Exception] = None
+        for provider, model in candidates:
+            with self._attempt(provider, model) as allowed:
+                if not allowed:
+                    continue
+                started = time.monotonic()
+                try:
+                    with span("llm.request", provider=provider.name, model=model) as attrs:
+                        response = await asyncio.to_thread(
+                            self._create, provider, model, messages, kwargs
+                        )
+                        usage = getattr(response, "usage", None)
+                        if usage is not None:
+                            attrs["total_tokens"] = getattr(usage, "total_tokens", None)
+                except Exception as e:
+                    provider.record(model, time.monotonic() - started, ok=False)
+                    print(f"[LLM] {provider.name}/{model} ошибка: {e}")
+                    last_error = e
+                    continue
+                provider.record(model, time.monotonic() - started, ok=True)
+                return response
+        raise last_error or RuntimeError("Все LLM-провайдеры временно недоступны (circuit breaker)")
+
+    @staticmethod
+    def _create(provider: LLMProvider, model: str, messages: List[Dict[str, Any]], kwargs: Dict[str, Any]) -> Any:
+        """
+        Вызов SDK. Если модель/деплоймент не поддерживает structured outputs,
+        повторяем тот же запрос без response_format — это не сбой провайдера.
+        """
+        try:
+            return provider.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        except openai.BadRequestError as e:
+            if "response_format" not in kwargs or "response_format" not in str(e):
+                raise
+            print(f"[LLM] {provider.name}/{model} не поддерживает response_format, повторяем без него")
+            kwargs = {k: v for k, v in kwargs.items() if k != "response_format"}
+            return provider.client.chat.completions.create(model=model, messages=messages, **kwargs)
+
+    async def complete_stream(
+        self,
+        kind: str,
+        messages: List[Dict[str, Any]],
+        user_key: Optional[str] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        Стриминговый вариант complete(): отдаёт текстовые дельты по мере генерации.
+        Переключение на другого провайдера возможно только до первого чанка.
+        """
+        tokens = estimate_tokens(messages, kwargs.get("max_tokens", 500))
+        async with llm_scheduler.slot(user_key, priority, tokens):
+            candidates = self._candidates(kind)
+            if not candidates:
+                raise RuntimeError("Все LLM-провайдеры временно недоступны (circuit breaker)")
+            last_error: Optional[Exception] = None
+            for provider, model in candidates:
+                with self._attempt(provider, model) as allowed:
+                    if not allowed:
+                        continue
+                    started = time.monotonic()
+                    chunks = _iterate_in_thread(
+                        lambda provider=provider, model=model: self._create(
+                            provider, model, messages, {**kwargs, "stream": True}
+                        )
+                    )
+                    try:
+                        first = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        provider.record(model, time.monotonic() - started, ok=True)
+                        return
+                    except Exception as e:
+                        provider.record(model, time.monotonic() - started, ok=False)
+                        print(f"[LLM] {provider.name}/{model} ошибка стрима: {e}")
+                        last_error = e
+                        continue
+                    # Задержка провайдера для стрима — время до первого чанка
+                    provider.record(model, time.monotonic() - started, ok=True)
+                try:
+                    text = _delta_text(first)
+                    if text:
+                        yield text
+                    async for chunk in chunks:
+                        text = _delta_text(chunk)
+                        if text:
+                            yield text
+                finally:
+                    await chunks.aclose()
+                return
+            raise last_error or RuntimeError("Все LLM-провайдеры временно недоступны (circuit breaker)")
+
+    def _collect_metrics(self) -> None:
+        for provider in self.providers:
+            for model in set(provider.models.values()):
+                LLM_BREAKER_STATE.set(BREAKER_STATE_VALUES[provider.breaker(model).state], provider=provider.name, model=model)
+                if model in provider.latency_ewma:
+                    LLM_LATENCY_EWMA.set(provider.latency_ewma[model], provider=provider.name, model=model)
+
+    def provider_stats(self) -> List[Dict[str, Any]]:
+        """Состояние провайдеров и предохранителей для мониторинга"""
+        stats = []
+        for provider in self.providers:
+            for kind, model in provider.models.items():
+                breaker = provider.breaker(model)
+                ewma = provider.latency_ewma.get(model)
+                stats.append({
+                    "provider": provider.name,
+                    "kind": kind,
+                    "model": model,
+                    "breaker_state": breaker.state,
+                    "consecutive_failures": breaker.failures,
+                    "latency_ewma_seconds": round(ewma, 3) if ewma is not None else None,
+                    "requests_total": provider.requests.get(model, 0),
+                    "errors_total": provider.errors.get(model, 0),
+                })
+        return stats
     
-    async def analyze_media_mood(self, file: UploadFile) -> Dict[str, Any]:
+    async def analyze_media_mood(self, file: UploadFile, user_key: Optional[str] = None, fast: bool = False) -> Dict[str, Any]:
         """
-        Анализирует медиафайл и определяет настроение/вайб
+        Анализирует медиафайл и определяет настроение/вайб.
+        fast=True — для картинок только локальный анализ цвета, без LLM
         """
         try:
             # Читаем файл
@@ -44,14 +419,34 @@ class OpenAIService:
             
             # Определяем тип файла
             file_type = self._get_file_type(file.filename)
+            # Загрузка сохраняется один раз на содержимое, ссылка — в ответе (media_url)
+            blob = await asyncio.to_thread(blob_store.put_bytes, file_content, self._file_ext(file.filename), "upload")
+            stored = {"media_url": blob_store.url(blob.sha256), "sha256": blob.sha256}
             
             if file_type == "image":
-                return await self._analyze_image(file_content, file.filename)
+                # Палитра и статистика цвета считаются локально за миллисекунды
+                with span("image.local_analysis"):
+                    local = await asyncio.to_thread(analyze_image_locally, file_content)
+                if fast and local:
+                    return {**self._local_image_result(local), **stored}
+                # Один и тот же снимок (повторная загрузка, другой воркер) не анализируем дважды
+                cache_key = f"media_mood:{hashlib.sha256(file_content).hexdigest()}"
+                cached = shared_cache.get(cache_key)
+                if cached is not None:
+                    cache_hit("media_analysis")
+                    return {**cached, **stored}
+                cache_miss("media_analysis")
+                result = await self._analyze_image(file_content, file.filename, user_key, local)
+                if result.get("success"):
+                    shared_cache.set(cache_key, result, ttl=MEDIA_ANALYSIS_CACHE_TTL)
+                return {**result, **stored}
             elif file_type == "video":
-                return await self._analyze_video(file_content, file.filename)
+                return {**await self._analyze_video(file_content, file.filename), **stored}
             else:
                 raise ValueError("Неподдерживаемый тип файла")
                 
+        except QueueFullError:
+            raise
         except Exception as e:
             return {
                 "error": f"Ошибка анализа файла: {str(e)}",
@@ -59,21 +454,49 @@ class OpenAIService:
                 "description": "Не удалось проанализировать файл"
             }
     
-    async def _analyze_image(self, file_content: bytes, filename: str) -> Dict[str, Any]:
+    @staticmethod
+    def _local_image_result(local: Dict[str, Any]) -> Dict[str, Any]:
+        """Ответ быстрого режима: настроение по статистике цвета, без обращения к модели"""
+        prior = local["mood_prior"]
+        description = f"{prior['mood'].capitalize()} атмосфера: {local['colors'].lower()}"
+        return {
+            "success": True,
+            **prior,
+            "colors": local["colors"],
+            "description": description,
+            "caption": description,
+            "image_stats": local,
+            "source": "local",
+        }
+
+    async def _analyze_image(
+        self, file_content: bytes, filename: str, user_key: Optional[str] = None, local: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         """
         Анализирует изображение с помощью GPT-4 Vision
         """
         # Кодируем изображение в base64
         base64_image = base64.b64encode(file_content).decode('utf-8')
-        
-        prompt = """
+
+        if local:
+            # Цвета уже посчитаны локально — модель смотрит только на сюжет, ответ короче
+            prompt = f"""
+        Определи по изображению настроение, эмоции, подходящий музыкальный жанр, краткое описание вайба
+        и caption для поста в соцсетях (1-2 предложения, без хэштегов).
+        {prompt_hint(local)}
+
+        Ответь в формате JSON:
+        {{"mood": "...", "emotions": ["..."], "music_genre": "...", "description": "...", "caption": "..."}}
+        """
+        else:
+            prompt = """
         Проанализируй это изображение и определи:
         1. Общее настроение и атмосферу (например: радостная, меланхоличная, энергичная, спокойная)
         2. Цветовую палитру и её влияние на настроение
         3. Эмоции, которые передаёт изображение
         4. Музыкальный жанр или стиль, который подошёл бы к этому настроению
         5. Придумай короткое красивое описание (caption) для поста в соцсетях, отражающее вайб изображения (1-2 предложения, без хэштегов)
-        
+
         Ответь в формате JSON:
         {
             "mood": "основное настроение",
@@ -84,96 +507,41 @@ class OpenAIService:
             "caption": "краткое красивое описание для поста"
         }
         """
-        
-        # Для Azure OpenAI используем модель с поддержкой Vision
-        if self.use_azure:
-            # Пробуем использовать gpt-4o для Vision (если доступен в Azure)
-            try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o",  # Используем gpt-4o для Vision
-                    messages=[
+
+        # Azure (gpt-4o) или OpenAI — решает роутер провайдеров
+        response = await self.complete(
+            "vision",
+            [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
                         {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64_image}"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    max_tokens=500
-                )
-            except Exception as e:
-                # Если gpt-4o недоступен, используем обычный OpenAI
-                print(f"Azure OpenAI Vision недоступен: {e}")
-                if OPENAI_API_KEY:
-                    client = openai.OpenAI(api_key=OPENAI_API_KEY)
-                    response = client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=[
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "text", "text": prompt},
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {
-                                            "url": f"data:image/jpeg;base64,{base64_image}"
-                                        }
-                                    }
-                                ]
-                            }
-                        ],
-                        max_tokens=500
-                    )
-                else:
-                    raise e
-        else:
-            # Обычный OpenAI
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{base64_image}"
                             }
-                        ]
-                    }
-                ],
-                max_tokens=500
-            )
+                        }
+                    ]
+                }
+            ],
+            user_key=user_key,
+            max_tokens=500
+        )
         
         # Парсим ответ
         content = response.choices[0].message.content
-        try:
-            import json
-            result = json.loads(content)
-        except Exception:
-            # Если ответ не JSON, пробуем найти JSON внутри строки
-            import re, json
-            match = re.search(r'\{[\s\S]*\}', content)
-            if match:
-                try:
-                    result = json.loads(match.group(0))
-                except Exception:
-                    result = {}
-            else:
-                result = {}
+        result = extract_json_object(content) or {}
         
+        return self._image_result(result, content, local)
+
+    @staticmethod
+    def _image_result(result: Dict[str, Any], content: Optional[str], local: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Ответ модели по одной картинке -> поля ответа API"""
         # Формируем финальный ответ с отдельными полями
         mood = result.get("mood", "neutral")
         emotions = result.get("emotions", [])
-        colors = result.get("colors", "")
+        colors = result.get("colors") or (local["colors"] if local else "")
         music_genre = result.get("music_genre", result.get("music_style", "pop"))
         description = result.get("description", "")
         caption = result.get("caption")
@@ -189,9 +557,167 @@ class OpenAIService:
             "music_genre": music_genre,
             "description": description,
             "caption": caption,
-            "analysis": content
+            "analysis": content,
+            "image_stats": local
         }
     
+    async def analyze_image_batch(
+        self, images: List[Tuple[str, bytes]], user_key: Optional[str] = None, fast: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Анализ нескольких картинок (filename, bytes) для одного поста: уменьшение
+        и локальный анализ параллельно в потоках, затем по IMAGE_BATCH_CHUNK картинок
+        в одном запросе к Vision, не больше IMAGE_BATCH_CONCURRENCY запросов сразу.
+        Возвращает анализ каждой картинки и общее настроение набора.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+        keys = [f"media_mood:{hashlib.sha256(content).hexdigest()}" for _, content in images]
+        with span("image.batch_prepare", images=len(images)):
+            prepared = await asyncio.gather(*(
+                asyncio.to_thread(prepare_for_batch, content, IMAGE_BATCH_MAX_SIDE) for _, content in images
+            ))
+            blobs = await asyncio.gather(*(
+                asyncio.to_thread(blob_store.put_bytes, content, self._file_ext(filename), "upload")
+                for filename, content in images
+            ))
+
+        pending: List[int] = []
+        for i, (filename, _) in enumerate(images):
+            if prepared[i]["local"] is None:
+                results[i] = {"error": "Не удалось открыть изображение", "filename": filename}
+            elif fast:
+                results[i] = self._local_image_result(prepared[i]["local"])
+            else:
+                cached = shared_cache.get(keys[i])
+                if cached is not None:
+                    cache_hit("media_analysis")
+                    results[i] = cached
+                else:
+                    cache_miss("media_analysis")
+                    pending.append(i)
+
+        chunks = [pending[i:i + IMAGE_BATCH_CHUNK] for i in range(0, len(pending), IMAGE_BATCH_CHUNK)]
+        semaphore = asyncio.Semaphore(IMAGE_BATCH_CONCURRENCY)
+        combined_by_model: Optional[Dict[str, Any]] = None
+
+        async def run_chunk(indices: List[int]) -> Optional[Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    analyses, combined = await self._analyze_image_chunk(
+                        [prepared[i] for i in indices], user_key
+                    )
+                except QueueFullError:
+                    raise
+                except Exception as e:
+                    # Модель недоступна — картинки этого запроса получают локальную оценку
+                    print(f"[IMAGE_BATCH] Ошибка Vision, отдаём локальный анализ: {e}")
+                    for i in indices:
+                        results[i] = {**self._local_image_result(prepared[i]["local"]), "source": "local_fallback"}
+                    return None
+            for i, analysis in zip(indices, analyses):
+                if analysis is None:
+                    # Модель пропустила картинку или ответила не JSON — локальная оценка,
+                    # без кеша, чтобы заглушка не отвечала потом и одиночному /analyze-media
+                    results[i] = {**self._local_image_result(prepared[i]["local"]), "source": "local_fallback"}
+                    continue
+                results[i] = analysis
+                shared_cache.set(keys[i], analysis, ttl=MEDIA_ANALYSIS_CACHE_TTL)
+            return combined
+
+        tasks = [asyncio.create_task(run_chunk(chunk)) for chunk in chunks]
+        try:
+            combined_results = await asyncio.gather(*tasks)
+        except BaseException:
+            # QueueFullError (или отмена запроса) — клиент уже получит ошибку,
+            # остальные части не должны дальше тратить бюджет LLM
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        # Общее описание от модели годится, только если она видела весь набор разом
+        if len(chunks) == 1 and len(pending) == len(images):
+            combined_by_model = combined_results[0]
+        for i, (filename, _) in enumerate(images):
+            results[i] = {**results[i], "filename": filename, "media_url": blob_store.url(blobs[i].sha256)}
+        return {
+            "images": results,
+            "combined": combined_by_model or self._combine_moods([r for r in results if r.get("success")]),
+            "llm_requests": len(chunks),
+        }
+
+    async def _analyze_image_chunk(
+        self, items: List[Dict[str, Any]], user_key: Optional[str]
+    ) -> Tuple[List[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+        """
+        Один запрос к Vision с несколькими картинками: (анализ каждой, общее настроение).
+        None вместо анализа — модель не вернула для картинки настроение
+        """
+        hints = "\n".join(f"{n}. {prompt_hint(item['local'])}" for n, item in enumerate(items, 1))
+        prompt = f"""
+        Это {len(items)} фотографий для одного поста, пронумерованы по порядку с 1.
+        Для каждой определи настроение, эмоции, подходящий музыкальный жанр, краткое описание вайба
+        и caption (1-2 предложения, без хэштегов); затем общее настроение всего набора.
+        Подсказки по каждой фотографии:
+        {hints}
+
+        Ответь в формате JSON:
+        {{"images": [{{"index": 1, "mood": "...", "emotions": ["..."], "music_genre": "...", "description": "...", "caption": "..."}}],
+         "combined": {{"mood": "...", "emotions": ["..."], "music_genre": "...", "description": "...", "caption": "..."}}}}
+        """
+        content_parts: List[Dict[str, Any]] = [{"type": "text", "text": prompt}]
+        for item in items:
+            content_parts.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{base64.b64encode(item['jpeg']).decode('utf-8')}",
+                    "detail": IMAGE_BATCH_DETAIL,
+                },
+            })
+        response = await self.complete(
+            "vision",
+            [{"role": "user", "content": content_parts}],
+            user_key=user_key,
+            max_tokens=200 + 180 * len(items)
+        )
+        content = response.choices[0].message.content
+        parsed = extract_json_object(content) or {}
+        by_index = {
+            entry.get("index"): entry for entry in parsed.get("images") or [] if isinstance(entry, dict)
+        }
+        analyses = []
+        for n, item in enumerate(items, 1):
+            # Если модель не пронумеровала ответы, берём их по порядку
+            entry = by_index.get(n) or ((parsed.get("images") or [])[n - 1:n] or [{}])[0]
+            if not isinstance(entry, dict) or not entry.get("mood"):
+                analyses.append(None)
+                continue
+            analyses.append(self._image_result(entry, json.dumps(entry, ensure_ascii=False), item["local"]))
+        combined = parsed.get("combined")
+        return analyses, combined if isinstance(combined, dict) and combined.get("mood") else None
+
+    @staticmethod
+    def _combine_moods(analyses: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Общее настроение набора без модели: самые частые настроение, жанр и эмоции"""
+        if not analyses:
+            return None
+
+        def most_common(values: List[str]) -> Optional[str]:
+            values = [v for v in values if isinstance(v, str) and v]
+            return max(set(values), key=lambda v: (values.count(v), -values.index(v))) if values else None
+
+        emotions: Dict[str, int] = {}
+        for analysis in analyses:
+            for emotion in analysis.get("emotions") or []:
+                if isinstance(emotion, str):
+                    emotions[emotion] = emotions.get(emotion, 0) + 1
+        mood = most_common([a.get("mood") for a in analyses])
+        return {
+            "mood": mood,
+            "emotions": sorted(emotions, key=lambda e: -emotions[e])[:5],
+            "music_genre": most_common([a.get("music_genre") or a.get("music_style") for a in analyses]),
+            "description": f"Набор из {len(analyses)} фото, преобладающее настроение — {mood}",
+        }
+
     async def _analyze_video(self, file_content: bytes, filename: str) -> Dict[str, Any]:
         """
         Анализирует видео (пока используем первый кадр)
@@ -227,6 +753,12 @@ class OpenAIService:
             "note": "Полный анализ видео будет доступен в следующих версиях"
         }
     
+    @staticmethod
+    def _file_ext(filename: Optional[str]) -> Optional[str]:
+        if not filename or "." not in filename:
+            return None
+        return filename.rsplit(".", 1)[-1].lower()
+
     def _get_file_type(self, filename: str) -> str:
         """
         Определяет тип файла по расширению
@@ -243,14 +775,20 @@ class OpenAIService:
         else:
             return "unknown"
     
-    async def get_music_recommendations(self, mood_analysis: Dict[str, Any], user_preferences: Dict[str, Any], n_tracks: int = 5) -> Dict[str, Any]:
-        """
-        Генерирует рекомендации музыки на основе анализа настроения и предпочтений пользователя (с учётом его лайкнутых треков)
-        """
+    def _recommendations_request(
+        self,
+        mood_analysis: Dict[str, Any],
+        user_preferences: Dict[str, Any],
+        n_tracks: int
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Сообщения и параметры запроса рекомендаций (общие для обычного и стримингового режима)"""
+        similar_tracks = user_preferences.get('similar_tracks')
+        similar_line = f"Похожие пользователи также сохраняли: {similar_tracks}" if similar_tracks else ""
         prompt = f"""
         На основе настроения "{mood_analysis.get('mood', 'neutral')}" и эмоций {mood_analysis.get('emotions', [])} предложи {n_tracks} музыкальных треков.
         
         Предпочтения пользователя: {user_preferences.get('top_artists', [])}
+        {similar_line}
         
         Ответь в формате JSON:
         {{
@@ -261,79 +799,116 @@ class OpenAIService:
             "alternative_genres": ["жанр1", "жанр2"]
         }}
         """
-        
-        # Выбираем модель и клиент в зависимости от провайдера
-        if self.use_azure:
-            # Для Azure OpenAI используем deployment_name (gpt-4o)
-            model = self.deployment_name
-            client = self.client
-            print(f"[RECOMMEND] Используем Azure OpenAI с моделью: {model}")
-        else:
-            # Для обычного OpenAI используем gpt-4
-            model = "gpt-4"
-            client = self.client
-            print(f"[RECOMMEND] Используем OpenAI API с моделью: {model}")
-        
+        kwargs: Dict[str, Any] = {"max_tokens": 800, "timeout": 30}
+        if LLM_STRUCTURED_OUTPUT:
+            kwargs["response_format"] = RECOMMENDATIONS_RESPONSE_FORMAT
+        return [{"role": "user", "content": prompt}], kwargs
+
+    @staticmethod
+    def _parse_recommendations(content: Optional[str]) -> Dict[str, Any]:
+        """Разбирает и валидирует ответ по схеме MusicRecommendations"""
+        with span("llm.parse", chars=len(content or "")):
+            data = extract_json_object(content)
+            if data is not None:
+                try:
+                    return MusicRecommendations.parse_obj(data).dict()
+                except Exception as e:
+                    print(f"[RECOMMEND] Ответ не соответствует схеме: {e}")
+            else:
+                print(f"[RECOMMEND] JSON не найден в ответе: {content}")
+        return {
+            "explanation": content or "",
+            "recommended_tracks": [],
+            "alternative_genres": []
+        }
+
+    async def stream_music_recommendations(
+        self,
+        mood_analysis: Dict[str, Any],
+        user_preferences: Dict[str, Any],
+        n_tracks: int = 5,
+        user_key: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Стриминговые рекомендации: отдаёт ("track", трек) по мере того, как модель
+        дописывает очередной объект, и в конце ("done", {explanation, alternative_genres}).
+        При ошибке до первого трека — треки из локального индекса настроений.
+        """
+        messages, kwargs = self._recommendations_request(mood_analysis, user_preferences, n_tracks)
+        parser = TrackStreamParser()
+        sent = 0
         try:
-            print(f"[RECOMMEND] Отправляем запрос к модели {model}...")
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=800,
-                timeout=30  # Увеличиваем timeout
-            )
-            content = response.choices[0].message.content
-            print(f"[RECOMMEND] Получен ответ от {model}: {content}")
-            try:
-                import json
-                # Сначала пробуем парсить как обычный JSON
-                result = json.loads(content)
-            except json.JSONDecodeError:
-                # Если не получилось, ищем JSON в markdown блоке
-                import re
-                json_match = re.search(r'```json\s*(\{[\s\S]*?\})\s*```', content)
-                if json_match:
+            async for delta in self.complete_stream("text", messages, user_key=user_key, **kwargs):
+                for track in parser.feed(delta):
                     try:
-                        result = json.loads(json_match.group(1))
-                    except json.JSONDecodeError:
-                        print(f"[RECOMMEND] Ошибка парсинга JSON из markdown: {json_match.group(1)}")
-                        result = {
-                            "explanation": content,
-                            "recommended_tracks": [],
-                            "alternative_genres": []
-                        }
-                else:
-                    # Если markdown блок не найден, ищем любой JSON в тексте
-                    json_match = re.search(r'\{[\s\S]*\}', content)
-                    if json_match:
-                        try:
-                            result = json.loads(json_match.group(0))
-                        except json.JSONDecodeError:
-                            print(f"[RECOMMEND] Ошибка парсинга найденного JSON: {json_match.group(0)}")
-                            result = {
-                                "explanation": content,
-                                "recommended_tracks": [],
-                                "alternative_genres": []
-                            }
-                    else:
-                        print(f"[RECOMMEND] JSON не найден в ответе: {content}")
-                        result = {
-                            "explanation": content,
-                            "recommended_tracks": [],
-                            "alternative_genres": []
-                        }
-            
+                        track = RecommendedTrack.parse_obj(track).dict()
+                    except Exception:
+                        continue
+                    sent += 1
+                    yield "track", track
+        except QueueFullError:
+            raise
+        except Exception as e:
+            print(f"[RECOMMEND] Ошибка стрима рекомендаций: {e}")
+            if sent:
+                yield "done", {"explanation": "", "alternative_genres": [], "partial": True}
+                return
+            indexed = mood_index.recommendations(mood_analysis, n_tracks)
+            if not indexed:
+                raise
+            for track in indexed["recommended_tracks"]:
+                yield "track", track
+            yield "done", {"explanation": indexed["explanation"], "alternative_genres": [], "source": "mood_index"}
+            return
+
+        result = self._parse_recommendations(parser.buffer)
+        if result.get("recommended_tracks"):
+            await asyncio.to_thread(mood_index.record, mood_analysis, result)
+        # Треки, которые не удалось выделить инкрементально, досылаем в конце
+        for track in result["recommended_tracks"][sent:]:
+            yield "track", track
+        yield "done", {"explanation": result["explanation"], "alternative_genres": result["alternative_genres"]}
+
+    async def get_music_recommendations(
+        self,
+        mood_analysis: Dict[str, Any],
+        user_preferences: Dict[str, Any],
+        n_tracks: int = 5,
+        user_key: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Генерирует рекомендации музыки на основе анализа настроения и предпочтений пользователя (с учётом его лайкнутых треков)
+        """
+        with span("llm.prompt_build"):
+            messages, kwargs = self._recommendations_request(mood_analysis, user_preferences, n_tracks)
+        try:
+            print("[RECOMMEND] Отправляем запрос к LLM...")
+            response = await self.complete("text", messages, user_key=user_key, **kwargs)
+            content = response.choices[0].message.content
+            print(f"[RECOMMEND] Получен ответ от {response.model}: {content}")
+            result = self._parse_recommendations(content)
+            if result.get("recommended_tracks"):
+                await asyncio.to_thread(mood_index.record, mood_analysis, result)
             return {
                 "success": True,
                 "recommendations": result
             }
+        except QueueFullError:
+            raise
         except Exception as e:
             print(f"[RECOMMEND] Ошибка при получении рекомендаций: {e}")
+            # Сначала пробуем локальный индекс настроений
+            indexed = mood_index.recommendations(mood_analysis, n_tracks)
+            if indexed:
+                return {
+                    "success": True,
+                    "fallback": True,
+                    "recommendations": indexed
+                }
             # Возвращаем базовые рекомендации в случае ошибки
             return {
                 "success": True,
+                "fallback": True,
                 "recommendations": {
                     "explanation": f"Не удалось получить персонализированные рекомендации: {str(e)}",
                     "recommended_tracks": [
@@ -0,0 +1,136 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+
+from ..config import PROFILER_INTERVAL, PROFILER_MAX_PROFILES
+
+# Листовые функции, в которых поток просто ждёт — такие сэмплы не несут информации
+IDLE_FUNCTIONS = {"select", "poll", "epoll", "wait", "_wait_for_tstate_lock", "acquire", "get", "accept"}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    """Сэмплы одного профилируемого запроса в виде свёрнутых стеков"""
+
+    def __init__(self, request_id: str, name: str, reason: str):
+        self.request_id = request_id
+        self.name = name
+        self.reason = reason
+        self.started = time.time()
+        self.duration = 0.0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+
+    def collapsed(self) -> str:
+        """Формат collapsed stacks: "поток;f1;f2;f3 N" — для flamegraph.pl, speedscope, inferno"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "reason": self.reason,
+            "started": self.started,
+            "duration_seconds": round(self.duration, 3),
+            "samples": self.samples,
+        }
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профилировщик на sys._current_frames(): пока идёт хотя бы один
+    профилируемый запрос, отдельный поток раз в interval секунд снимает стеки
+    всех потоков (event loop и пул потоков). Стеки процесса общие, поэтому
+    при параллельных запросах в профиль попадают и чужие кадры — для точной
+    картины профилируйте запрос на ненагруженном инстансе.
+
+    Запрос профилируется, если его явно попросил админ (X-Profile: 1) или он
+    попал в долю трафика sample_rate, пока включено сэмплирование.
+    """
+
+    def __init__(self, interval: float = PROFILER_INTERVAL, max_profiles: int = PROFILER_MAX_PROFILES):
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self.sample_rate = 0.0
+        self.enabled_until = 0.0
+        self.profiles: "OrderedDict[str, ProfileSession]" = OrderedDict()
+        self._active: List[ProfileSession] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, sample_rate: float, duration: float) -> None:
+        """Профилировать долю sample_rate запросов в течение duration секунд"""
+        self.sample_rate = max(0.0, min(sample_rate, 1.0))
+        self.enabled_until = time.monotonic() + duration if self.sample_rate > 0 else 0.0
+
+    def should_sample(self) -> bool:
+        if self.sample_rate <= 0 or time.monotonic() > self.enabled_until:
+            return False
+        return random.random() < self.sample_rate
+
+    def start(self, request_id: str, name: str, reason: str) -> ProfileSession:
+        session = ProfileSession(request_id, name, reason)
+        with self._lock:
+            self._active.append(session)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        return session
+
+    def stop(self, session: ProfileSession) -> None:
+        session.duration = time.time() - session.started
+        with self._lock:
+            if session in self._active:
+                self._active.remove(session)
+            self.profiles[session.request_id] = session
+            while len(self.profiles) > self.max_profiles:
+                self.profiles.popitem(last=False)
+
+    def get(self, request_id: str) -> Optional[ProfileSession]:
+        return self.profiles.get(request_id)
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                sessions = list(self._active)
+                if not sessions:
+                    self._thread = None
+                    return
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, str(thread_id)))
+                stacks.append(";".join(reversed(labels)))
+            for session in sessions:
+                session.samples += 1
+                session.stacks.update(stacks)
+            time.sleep(self.interval)
+
+    def status(self) -> Dict[str, Any]:
+        remaining = self.enabled_until - time.monotonic()
+        return {
+            "sample_rate": self.sample_rate if remaining > 0 else 0.0,
+            "remaining_seconds": round(max(remaining, 0.0), 1),
+            "interval_seconds": self.interval,
+            "active": len(self._active),
+            "profiles": [s.summary() for s in reversed(self.profiles.values())],
+        }
+
+
+# Общий профилировщик на процесс
+profiler = SamplingProfiler()
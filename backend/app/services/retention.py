@@ -0,0 +1,257 @@
+import asyncio
+import re
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from ..config import (
+    CHAT_RETENTION_DAYS,
+    CHAT_PURGE_BATCH,
+    CHAT_PURGE_PAUSE,
+    CHAT_PURGE_INTERVAL,
+    CHAT_PARTITIONING,
+    CHAT_PARTITIONS_AHEAD,
+    UPLOAD_BLOB_RETENTION_HOURS,
+)
+from ..database import SessionLocal
+from ..models.user import ChatMessage, ChatHistoryDeletion, User
+from . import list_versions
+from .blob_store import blob_store
+from .shared_cache import shared_cache, LockTimeout
+
+PARTITION_NAME = re.compile(r"^chat_messages_p(\d{4})(\d{2})$")
+
+# Та же схема, что у модели ChatMessage, но первичный ключ включает ключ
+# разделения — этого требует PostgreSQL для секционированных таблиц
+PARTITIONED_TABLE_DDL = """
+CREATE TABLE chat_messages (
+    id BIGSERIAL,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    role VARCHAR NOT NULL,
+    content TEXT,
+    media_url VARCHAR,
+    "timestamp" TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    PRIMARY KEY (id, "timestamp")
+) PARTITION BY RANGE ("timestamp")
+"""
+
+
+def _month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def hidden_up_to(db: Session, user_id: int) -> int:
+    """Сообщения пользователя с id не больше этого уже удалены с его точки зрения"""
+    deletion = db.get(ChatHistoryDeletion, user_id)
+    return deletion.up_to_id if deletion else 0
+
+
+def request_history_deletion(db: Session, user_id: int) -> int:
+    """
+    Скрывает всю текущую историю пользователя и ставит её удаление в очередь.
+    Возвращает границу (максимальный id), коммит — на вызывающем.
+    """
+    up_to_id = db.query(ChatMessage.id).filter(ChatMessage.user_id == user_id) \
+        .order_by(ChatMessage.id.desc()).limit(1).scalar() or 0
+    deletion = db.get(ChatHistoryDeletion, user_id)
+    if deletion is None:
+        db.add(ChatHistoryDeletion(user_id=user_id, up_to_id=up_to_id))
+    elif up_to_id > deletion.up_to_id:
+        deletion.up_to_id = up_to_id
+        deletion.requested_at = datetime.utcnow()
+    list_versions.bump(db, user_id, list_versions.HISTORY)
+    return up_to_id
+
+
+class ChatPurger:
+    """
+    Фоновая очистка chat_messages: запрошенные пользователями удаления и
+    сообщения старше срока хранения. Удаляет порциями по CHAT_PURGE_BATCH строк,
+    каждая — в своей короткой транзакции, чтобы не держать таблицу заблокированной.
+    Заодно удаляет загрузки для анализа, на которые больше не ссылается ни одно сообщение.
+    """
+
+    def __init__(self, batch: int = CHAT_PURGE_BATCH, pause: float = CHAT_PURGE_PAUSE,
+                 interval: float = CHAT_PURGE_INTERVAL, retention_days: int = CHAT_RETENTION_DAYS):
+        self.batch = batch
+        self.pause = pause
+        self.interval = interval
+        self.retention_days = retention_days
+        self.partitioned = False
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    # --- схема ---
+
+    def setup_partitioning(self, engine: Engine) -> None:
+        """
+        До create_all: на PostgreSQL с CHAT_PARTITIONING создаёт chat_messages
+        секционированной по месяцам. Существующая таблица не переделывается.
+        """
+        if engine.dialect.name != "postgresql" or not CHAT_PARTITIONING:
+            return
+        with engine.begin() as conn:
+            exists = conn.execute(text("SELECT to_regclass('chat_messages')")).scalar()
+            if exists is None:
+                User.__table__.create(bind=conn, checkfirst=True)
+                conn.execute(text(PARTITIONED_TABLE_DDL))
+                conn.execute(text("CREATE TABLE chat_messages_default PARTITION OF chat_messages DEFAULT"))
+                print("[PURGE] chat_messages создана с помесячными разделами")
+            self.partitioned = conn.execute(text(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'chat_messages'::regclass"
+            )).scalar() is not None
+        if not self.partitioned:
+            print("[PURGE] chat_messages уже существует без разделов — CHAT_PARTITIONING не применён")
+
+    def setup(self, engine: Engine) -> None:
+        """После create_all: индексы для существующих таблиц и разделы на ближайшие месяцы"""
+        for index in ChatMessage.__table__.indexes:
+            index.create(bind=engine, checkfirst=True)
+        if self.partitioned:
+            self.ensure_partitions(engine)
+
+    def ensure_partitions(self, engine: Engine) -> None:
+        month = _month_start(datetime.utcnow())
+        with engine.begin() as conn:
+            for _ in range(CHAT_PARTITIONS_AHEAD + 1):
+                upper = _next_month(month)
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS chat_messages_p{month:%Y%m} PARTITION OF chat_messages "
+                    f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+                ))
+                month = upper
+
+    # --- удаление ---
+
+    def _delete_chunk(self, db: Session, condition: str, params: dict) -> int:
+        """Одна порция: выбираем id, удаляем их и поднимаем версии затронутых историй"""
+        rows = db.execute(
+            text(f"SELECT id, user_id FROM chat_messages WHERE {condition} ORDER BY id LIMIT :batch"),
+            {**params, "batch": self.batch},
+        ).all()
+        if not rows:
+            return 0
+        db.query(ChatMessage).filter(ChatMessage.id.in_([row.id for row in rows])) \
+            .delete(synchronize_session=False)
+        for user_id in {row.user_id for row in rows}:
+            list_versions.bump(db, user_id, list_versions.HISTORY)
+        db.commit()
+        return len(rows)
+
+    def _drain(self, db: Session, condition: str, params: dict) -> int:
+        deleted = 0
+        while True:
+            count = self._delete_chunk(db, condition, params)
+            deleted += count
+            if count < self.batch:
+                return deleted
+            # Пауза между порциями — окно для вставок и чтений других запросов
+            time.sleep(self.pause)
+
+    def purge_requested(self, db: Session) -> int:
+        deleted = 0
+        for deletion in db.query(ChatHistoryDeletion).all():
+            user_id, up_to_id = deletion.user_id, deletion.up_to_id
+            deleted += self._drain(db, "user_id = :user_id AND id <= :up_to_id",
+                                   {"user_id": user_id, "up_to_id": up_to_id})
+            # Запись снимаем, только если за время удаления границу не сдвинули
+            db.query(ChatHistoryDeletion).filter(
+                ChatHistoryDeletion.user_id == user_id, ChatHistoryDeletion.up_to_id == up_to_id
+            ).delete(synchronize_session=False)
+            db.commit()
+        return deleted
+
+    def _drop_expired_partitions(self, db: Session, cutoff: datetime) -> List[str]:
+        """Разделы, целиком лежащие до cutoff, удаляются без построчного DELETE"""
+        names = db.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'chat_messages'::regclass"
+        )).scalars().all()
+        dropped = []
+        for name in names:
+            match = PARTITION_NAME.match(name)
+            if not match or _next_month(datetime(int(match.group(1)), int(match.group(2)), 1)) > cutoff:
+                continue
+            users: Set[int] = set(db.execute(text(f"SELECT DISTINCT user_id FROM {name}")).scalars())
+            db.execute(text(f"ALTER TABLE chat_messages DETACH PARTITION {name}"))
+            db.execute(text(f"DROP TABLE {name}"))
+            for user_id in users:
+                list_versions.bump(db, user_id, list_versions.HISTORY)
+            db.commit()
+            dropped.append(name)
+        return dropped
+
+    def purge_expired(self, db: Session) -> int:
+        if self.retention_days <= 0:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(days=self.retention_days)
+        if self.partitioned:
+            for name in self._drop_expired_partitions(db, cutoff):
+                print(f"[PURGE] Удалён раздел {name}")
+        return self._drain(db, '"timestamp" < :cutoff', {"cutoff": cutoff})
+
+    def purge_once(self) -> dict:
+        """Один проход очистки; между воркерами выполняется только в одном"""
+        try:
+            with shared_cache.lock("chat_purge", ttl=max(self.interval, 60), timeout=0):
+                db = SessionLocal()
+                try:
+                    if self.partitioned:
+                        self.ensure_partitions(db.get_bind())
+                    result = {"requested": self.purge_requested(db), "expired": self.purge_expired(db)}
+                finally:
+                    db.close()
+                # Сообщения уже удалены — их вложения тоже больше не нужны
+                result["uploads"] = blob_store.gc_uploads(UPLOAD_BLOB_RETENTION_HOURS, self.batch)
+        except LockTimeout:
+            return {"requested": 0, "expired": 0, "uploads": 0, "skipped": True}
+        if result["requested"] or result["expired"]:
+            print(f"[PURGE] Удалено сообщений: по запросу {result['requested']}, по сроку {result['expired']}")
+        if result["uploads"]:
+            print(f"[PURGE] Удалено неиспользуемых загрузок: {result['uploads']}")
+        return result
+
+    # --- фоновый цикл ---
+
+    def wake(self) -> None:
+        """Новое удаление по запросу — не ждать следующего интервала"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.purge_once)
+            except Exception as e:
+                print(f"[PURGE] Ошибка фоновой очистки: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Общий очиститель на процесс
+chat_purger = ChatPurger()
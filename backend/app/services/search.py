@@ -0,0 +1,169 @@
+import re
+from typing import Any, Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from ..config import SEARCH_PG_CONFIG
+
+# Полнотекстовые индексы создаются при старте и поддерживаются самой БД:
+# в SQLite — FTS5 с external content и триггерами, в PostgreSQL — генерируемые
+# tsvector-колонки с GIN-индексами. Без FTS (старый SQLite) — поиск через LIKE.
+
+SQLITE_TOKENIZER = "unicode61 remove_diacritics 2"
+
+SQLITE_SETUP = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+        content, content='chat_messages', content_rowid='id', tokenize='{SQLITE_TOKENIZER}')""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content); END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF content ON chat_messages BEGIN
+        INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content); END""",
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS saved_songs_fts USING fts5(
+        title, artist, content='saved_songs', content_rowid='id', tokenize='{SQLITE_TOKENIZER}')""",
+    """CREATE TRIGGER IF NOT EXISTS saved_songs_fts_ai AFTER INSERT ON saved_songs BEGIN
+        INSERT INTO saved_songs_fts(rowid, title, artist) VALUES (new.id, new.title, new.artist); END""",
+    """CREATE TRIGGER IF NOT EXISTS saved_songs_fts_ad AFTER DELETE ON saved_songs BEGIN
+        INSERT INTO saved_songs_fts(saved_songs_fts, rowid, title, artist) VALUES ('delete', old.id, old.title, old.artist); END""",
+    """CREATE TRIGGER IF NOT EXISTS saved_songs_fts_au AFTER UPDATE OF title, artist ON saved_songs BEGIN
+        INSERT INTO saved_songs_fts(saved_songs_fts, rowid, title, artist) VALUES ('delete', old.id, old.title, old.artist);
+        INSERT INTO saved_songs_fts(rowid, title, artist) VALUES (new.id, new.title, new.artist); END""",
+]
+
+POSTGRES_SETUP = [
+    f"""ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('{SEARCH_PG_CONFIG}', coalesce(content, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_chat_messages_search_tsv ON chat_messages USING GIN (search_tsv)",
+    f"""ALTER TABLE saved_songs ADD COLUMN IF NOT EXISTS search_tsv tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{SEARCH_PG_CONFIG}', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_PG_CONFIG}', coalesce(artist, '')), 'B')) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_saved_songs_search_tsv ON saved_songs USING GIN (search_tsv)",
+]
+
+
+class SearchIndex:
+    """Поиск по своим сообщениям чата и сохранённым песням с ранжированием и пагинацией"""
+
+    def __init__(self):
+        # "fts5", "postgres" или "like" — определяется в setup()
+        self.mode = "like"
+
+    def setup(self, engine: Engine) -> None:
+        dialect = engine.dialect.name
+        try:
+            with engine.begin() as conn:
+                if dialect == "sqlite":
+                    existing = {
+                        row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))
+                    }
+                    for statement in SQLITE_SETUP:
+                        conn.execute(text(statement))
+                    # Индекс создан только что — заполняем его уже существующими строками
+                    for table in ("chat_messages_fts", "saved_songs_fts"):
+                        if table not in existing:
+                            conn.execute(text(f"INSERT INTO {table}({table}) VALUES ('rebuild')"))
+                    self.mode = "fts5"
+                elif dialect == "postgresql":
+                    for statement in POSTGRES_SETUP:
+                        conn.execute(text(statement))
+                    self.mode = "postgres"
+        except Exception as e:
+            print(f"[SEARCH] Полнотекстовый индекс недоступен, поиск через LIKE: {e}")
+            self.mode = "like"
+        print(f"[SEARCH] Режим поиска: {self.mode}")
+
+    @staticmethod
+    def terms(query: str) -> List[str]:
+        """Слова запроса без служебных символов FTS (кавычки, звёздочки, операторы)"""
+        return re.findall(r"\w+", query.lower())[:10]
+
+    def search_messages(
+        self, db: Session, user_id: int, query: str, limit: int, offset: int, after_id: int = 0
+    ) -> Dict[str, Any]:
+        """after_id — сообщения с id не больше него скрыты (история удаляется в фоне)"""
+        terms = self.terms(query)
+        if not terms:
+            return {"total": 0, "items": []}
+        params: Dict[str, Any] = {"user_id": user_id, "after_id": after_id, "limit": limit, "offset": offset}
+        if self.mode == "fts5":
+            # Каждое слово — префикс: "грустн" найдёт "грустная", "грустные"
+            params["match"] = " ".join(f'"{term}"*' for term in terms)
+            source = """FROM chat_messages_fts JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+                WHERE chat_messages_fts MATCH :match AND m.user_id = :user_id AND m.id > :after_id"""
+            columns = "m.id, m.role, m.content, m.timestamp, " \
+                      "snippet(chat_messages_fts, 0, '<b>', '</b>', '…', 12) AS snippet, bm25(chat_messages_fts) AS score"
+            order = "score"
+        elif self.mode == "postgres":
+            params.update(config=SEARCH_PG_CONFIG, tsquery=" & ".join(f"{term}:*" for term in terms))
+            source = """FROM chat_messages m
+                WHERE m.search_tsv @@ to_tsquery(CAST(:config AS regconfig), :tsquery) AND m.user_id = :user_id AND m.id > :after_id"""
+            columns = """m.id, m.role, m.content, m.timestamp,
+                ts_headline(CAST(:config AS regconfig), m.content, to_tsquery(CAST(:config AS regconfig), :tsquery),
+                    'StartSel=<b>, StopSel=</b>, MaxWords=24, MinWords=8') AS snippet,
+                ts_rank_cd(m.search_tsv, to_tsquery(CAST(:config AS regconfig), :tsquery)) AS score"""
+            order = "score DESC"
+        else:
+            source, columns, order = self._like(params, terms, ["m.content"], "chat_messages m")
+            source += " AND m.id > :after_id"
+            columns = "m.id, m.role, m.content, m.timestamp, NULL AS snippet, 0 AS score"
+        return self._page(db, source, columns, order, params, lambda row: {
+            "id": row.id, "role": row.role, "content": row.content,
+            "timestamp": str(row.timestamp) if row.timestamp else None,
+            "snippet": row.snippet or row.content,
+        })
+
+    def search_songs(self, db: Session, user_id: int, query: str, limit: int, offset: int) -> Dict[str, Any]:
+        terms = self.terms(query)
+        if not terms:
+            return {"total": 0, "items": []}
+        params: Dict[str, Any] = {"user_id": user_id, "limit": limit, "offset": offset}
+        if self.mode == "fts5":
+            params["match"] = " ".join(f'"{term}"*' for term in terms)
+            source = """FROM saved_songs_fts JOIN saved_songs s ON s.id = saved_songs_fts.rowid
+                WHERE saved_songs_fts MATCH :match AND s.user_id = :user_id"""
+            # Совпадение в названии весит вдвое больше, чем в исполнителе
+            columns = "s.id, s.youtube_video_id, s.title, s.artist, s.date_saved, bm25(saved_songs_fts, 2.0, 1.0) AS score"
+            order = "score"
+        elif self.mode == "postgres":
+            params.update(config=SEARCH_PG_CONFIG, tsquery=" & ".join(f"{term}:*" for term in terms))
+            source = """FROM saved_songs s
+                WHERE s.search_tsv @@ to_tsquery(CAST(:config AS regconfig), :tsquery) AND s.user_id = :user_id"""
+            columns = """s.id, s.youtube_video_id, s.title, s.artist, s.date_saved,
+                ts_rank_cd(s.search_tsv, to_tsquery(CAST(:config AS regconfig), :tsquery)) AS score"""
+            order = "score DESC"
+        else:
+            source, columns, order = self._like(params, terms, ["s.title", "s.artist"], "saved_songs s")
+            columns = "s.id, s.youtube_video_id, s.title, s.artist, s.date_saved, 0 AS score"
+        return self._page(db, source, columns, order, params, lambda row: {
+            "id": row.id, "youtube_video_id": row.youtube_video_id, "title": row.title, "artist": row.artist,
+            "date_saved": str(row.date_saved) if row.date_saved else None,
+        })
+
+    @staticmethod
+    def _like(params: Dict[str, Any], terms: List[str], fields: List[str], table: str):
+        alias = table.split()[-1]
+        conditions = []
+        for i, term in enumerate(terms):
+            # lower() в SQLite понимает только ASCII — отдельно ищем слово с заглавной буквы
+            params[f"term{i}"] = f"%{term}%"
+            params[f"title{i}"] = f"%{term.capitalize()}%"
+            conditions.append("(" + " OR ".join(
+                f"lower({field}) LIKE :term{i} OR {field} LIKE :title{i}" for field in fields
+            ) + ")")
+        source = f"FROM {table} WHERE {alias}.user_id = :user_id AND " + " AND ".join(conditions)
+        return source, None, f"{alias}.id DESC"
+
+    @staticmethod
+    def _page(db: Session, source: str, columns: str, order: str, params: Dict[str, Any], convert) -> Dict[str, Any]:
+        total = db.execute(text(f"SELECT count(*) {source}"), params).scalar()
+        rows = db.execute(text(f"SELECT {columns} {source} ORDER BY {order} LIMIT :limit OFFSET :offset"), params)
+        return {"total": total, "items": [convert(row) for row in rows]}
+
+
+# Общий индекс на процесс
+search_index = SearchIndex()
@@ -0,0 +1,407 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from ..config import CACHE_BACKEND, CACHE_SQLITE_PATH, CACHE_REDIS_URL
+
+
+class LockTimeout(Exception):
+    """Не удалось получить блокировку за отведённое время"""
+
+
+class CacheBackend:
+    """
+    Общий для воркеров кеш и блокировки. Значения — любые JSON-сериализуемые объекты.
+
+    Наследники реализуют примитивы _get/_set/_incr/delete и _try_acquire/_release;
+    lock() и alock() строятся поверх них одинаково для всех бэкендов.
+    """
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[Any]:
+        # Недоступный кеш — это промах, а не ошибка запроса
+        try:
+            raw = self._get(key)
+        except Exception as e:
+            print(f"[CACHE] {self.name}: ошибка чтения {key}: {e}")
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            self._set(key, json.dumps(value, ensure_ascii=False), ttl)
+        except Exception as e:
+            print(f"[CACHE] {self.name}: ошибка записи {key}: {e}")
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> None:
+        """
+        Атомарно прибавляет amount к целому значению (нет ключа — считаем от 0)
+        без блокировок; ttl задаётся только при создании ключа.
+        """
+        try:
+            self._incr(key, amount, ttl)
+        except Exception as e:
+            print(f"[CACHE] {self.name}: ошибка увеличения {key}: {e}")
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """То же, что get(), но запрос к бэкенду (SQLite, Redis) не блокирует event loop"""
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    async def adelete(self, key: str) -> None:
+        await asyncio.to_thread(self.delete, key)
+
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def _set(self, key: str, raw: str, ttl: Optional[float]) -> None:
+        raise NotImplementedError
+
+    def _incr(self, key: str, amount: int, ttl: Optional[float]) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def _try_acquire(self, name: str, owner: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    def _release(self, name: str, owner: str) -> None:
+        raise NotImplementedError
+
+    def _safe_acquire(self, name: str, owner: str, ttl: float) -> Optional[bool]:
+        """True/False — взяли блокировку или нет; None — бэкенд недоступен"""
+        try:
+            return self._try_acquire(name, owner, ttl)
+        except Exception as e:
+            print(f"[CACHE] {self.name}: блокировка {name} недоступна, продолжаем без неё: {e}")
+            return None
+
+    def _safe_release(self, name: str, owner: str) -> None:
+        try:
+            self._release(name, owner)
+        except Exception as e:
+            # Блокировка освободится сама по истечении ttl
+            print(f"[CACHE] {self.name}: не удалось снять блокировку {name}: {e}")
+
+    @contextmanager
+    def lock(self, name: str, ttl: float = 300, timeout: float = 300, poll: float = 0.1):
+        """
+        Блокировка между воркерами. ttl — страховка на случай падения владельца:
+        по истечении блокировку может забрать другой процесс. Если бэкенд
+        недоступен, код выполняется без блокировки — как и кеш, она лишь оптимизация.
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while True:
+            acquired = self._safe_acquire(name, owner, ttl)
+            if acquired is not False:
+                break
+            if time.monotonic() > deadline:
+                raise LockTimeout(f"Блокировка {name} занята дольше {timeout} c")
+            time.sleep(poll)
+        try:
+            yield
+        finally:
+            if acquired:
+                self._safe_release(name, owner)
+
+    @asynccontextmanager
+    async def alock(self, name: str, ttl: float = 300, timeout: float = 300, poll: float = 0.1):
+        """То же, что lock(), но ожидание не блокирует event loop"""
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while True:
+            acquired = self._safe_acquire(name, owner, ttl)
+            if acquired is not False:
+                break
+            if time.monotonic() > deadline:
+                raise LockTimeout(f"Блокировка {name} занята дольше {timeout} c")
+            await asyncio.sleep(poll)
+        try:
+            yield
+        finally:
+            if acquired:
+                self._safe_release(name, owner)
+
+
+class MemoryBackend(CacheBackend):
+    """Кеш в памяти процесса — для одного воркера и тестов"""
+
+    name = "memory"
+
+    def __init__(self, max_items: int = 10000):
+        self.max_items = max_items
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._locks: Dict[str, Tuple[str, float]] = {}
+        self._mutex = threading.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._mutex:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            raw, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            return raw
+
+    def _set(self, key: str, raw: str, ttl: Optional[float]) -> None:
+        with self._mutex:
+            if len(self._data) >= self.max_items and key not in self._data:
+                # Вытесняем самую старую запись (dict хранит порядок вставки)
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (raw, time.monotonic() + ttl if ttl else None)
+
+    def _incr(self, key: str, amount: int, ttl: Optional[float]) -> None:
+        with self._mutex:
+            item = self._data.get(key)
+            if item is None or (item[1] is not None and item[1] < time.monotonic()):
+                if len(self._data) >= self.max_items and key not in self._data:
+                    self._data.pop(next(iter(self._data)))
+                self._data[key] = (json.dumps(amount), time.monotonic() + ttl if ttl else None)
+            else:
+                self._data[key] = (json.dumps(json.loads(item[0]) + amount), item[1])
+
+    def delete(self, key: str) -> None:
+        with self._mutex:
+            self._data.pop(key, None)
+
+    def _try_acquire(self, name: str, owner: str, ttl: float) -> bool:
+        with self._mutex:
+            current = self._locks.get(name)
+            if current is not None and current[1] > time.monotonic():
+                return False
+            self._locks[name] = (owner, time.monotonic() + ttl)
+            return True
+
+    def _release(self, name: str, owner: str) -> None:
+        with self._mutex:
+            if self._locks.get(name, (None,))[0] == owner:
+                del self._locks[name]
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Кеш в общем SQLite-файле: видят все воркеры на одной машине.
+    WAL-режим — чтения не ждут записи; соединение своё в каждом потоке.
+    """
+
+    name = "sqlite"
+
+    # Истёкшие записи удаляются при чтении своего ключа, остальные — раз в столько записей
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH):
+        self.path = path
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._connect().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] < time.time():
+            self.delete(key)
+            return None
+        return row[0]
+
+    def _set(self, key: str, raw: str, ttl: Optional[float]) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, raw, time.time() + ttl if ttl else None),
+        )
+        # Счётчик на процесс без блокировки: пропущенный инкремент лишь сдвинет очистку
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def _incr(self, key: str, amount: int, ttl: Optional[float]) -> None:
+        now = time.time()
+        # Истёкшая запись считается отсутствующей: счёт начинается заново
+        self._connect().execute(
+            "INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN cache.expires < ? THEN excluded.value ELSE CAST(cache.value AS INTEGER) + excluded.value END, "
+            "expires = CASE WHEN cache.expires < ? THEN excluded.expires ELSE cache.expires END",
+            (key, amount, now + ttl if ttl else None, now, now),
+        )
+
+    def delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _try_acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO locks (name, owner, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+            "WHERE locks.expires < ?",
+            (name, owner, now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+    def _release(self, name: str, owner: str) -> None:
+        self._connect().execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+    def purge_expired(self) -> int:
+        cursor = self._connect().execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+        return cursor.rowcount
+
+
+# Снятие блокировки только владельцем (атомарно на стороне сервера)
+_REDIS_RELEASE = "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) else return 0 end"
+# INCRBY со сроком жизни, который ставится только новому ключу
+_REDIS_INCR = (
+    "local value = redis.call('INCRBY', KEYS[1], ARGV[1]) "
+    "if value == tonumber(ARGV[1]) and tonumber(ARGV[2]) > 0 then redis.call('PEXPIRE', KEYS[1], ARGV[2]) end "
+    "return value"
+)
+
+
+class RedisBackend(CacheBackend):
+    """
+    Кеш в Redis (или совместимом сервере: Valkey, KeyDB, Dragonfly) — общий для
+    воркеров на разных машинах. Минимальный клиент протокола RESP без внешних зависимостей.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = CACHE_REDIS_URL, prefix: str = "vibematch:", timeout: float = 2.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    # --- протокол RESP ---
+
+    def _connection(self) -> Tuple[socket.socket, Any]:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile("rb"))
+            self._local.conn = conn
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", str(self.db))
+        return conn
+
+    def _read(self, reader) -> Any:
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis закрыл соединение")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RuntimeError(f"Redis: {payload.decode()}")
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            return None if length == -1 else [self._read(reader) for _ in range(length)]
+        raise RuntimeError(f"Неизвестный ответ Redis: {line!r}")
+
+    def _command(self, *args: str, idempotent: bool = True) -> Any:
+        """
+        idempotent=False — для команд, повтор которых меняет результат (SET NX, INCRBY):
+        если запрос уже ушёл, а ответ потерян, повторять его нельзя
+        """
+        parts: List[bytes] = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        for attempt in range(2):
+            sock, reader = self._connection()
+            sent = False
+            try:
+                sock.sendall(b"".join(parts))
+                sent = True
+                return self._read(reader)
+            except (ConnectionError, OSError):
+                # Соединение оборвалось (перезапуск Redis, idle timeout) — переподключаемся один раз
+                self._local.conn = None
+                sock.close()
+                if attempt == 1 or (sent and not idempotent):
+                    raise
+
+    # --- кеш и блокировки ---
+
+    def _get(self, key: str) -> Optional[str]:
+        return self._command("GET", self.prefix + key)
+
+    def _set(self, key: str, raw: str, ttl: Optional[float]) -> None:
+        if ttl:
+            self._command("SET", self.prefix + key, raw, "PX", str(int(ttl * 1000)))
+        else:
+            self._command("SET", self.prefix + key, raw)
+
+    def _incr(self, key: str, amount: int, ttl: Optional[float]) -> None:
+        self._command(
+            "EVAL", _REDIS_INCR, "1", self.prefix + key, str(amount), str(int(ttl * 1000) if ttl else 0),
+            idempotent=False,
+        )
+
+    def delete(self, key: str) -> None:
+        self._command("DEL", self.prefix + key)
+
+    def _try_acquire(self, name: str, owner: str, ttl: float) -> bool:
+        return self._command(
+            "SET", f"{self.prefix}lock:{name}", owner, "NX", "PX", str(int(ttl * 1000)), idempotent=False
+        ) == "OK"
+
+    def _release(self, name: str, owner: str) -> None:
+        self._command("EVAL", _REDIS_RELEASE, "1", f"{self.prefix}lock:{name}", owner)
+
+
+def create_backend(kind: str = CACHE_BACKEND) -> CacheBackend:
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "redis":
+        return RedisBackend()
+    raise ValueError(f"Неизвестный CACHE_BACKEND: {kind} (memory, sqlite или redis)")
+
+
+# Общий кеш на процесс; бэкенд выбирается переменной CACHE_BACKEND
+shared_cache = create_backend()
@@ -0,0 +1,122 @@
+import json
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from ..config import TRACE_LOG, TRACE_SLOW_SECONDS
+
+
+class Trace:
+    """Все спаны одного HTTP-запроса; пишется в лог одной JSON-строкой"""
+
+    def __init__(self, request_id: str, name: str):
+        self.request_id = request_id
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._ids = 0
+
+    def next_id(self) -> int:
+        self._ids += 1
+        return self._ids
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": self.spans,
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar("current_span", default=None)
+
+
+_REQUEST_ID = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Request ID клиента (X-Request-ID), если он безопасен для логов, иначе новый"""
+    if incoming and _REQUEST_ID.fullmatch(incoming):
+        return incoming
+    return uuid.uuid4().hex[:16]
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+@contextmanager
+def start_trace(name: str, request_id: Optional[str] = None):
+    """Корневой контекст запроса: все span() внутри попадают в этот Trace"""
+    trace = Trace(new_request_id(request_id), name)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+def _record(trace: Trace, span_id: int, parent: Optional[int], name: str,
+            started: float, duration: float, attrs: Dict[str, Any]) -> None:
+    entry = {
+        "id": span_id,
+        "parent": parent,
+        "name": name,
+        "start_ms": round((started - trace.started) * 1000, 2),
+        "duration_ms": round(duration * 1000, 2),
+    }
+    if attrs:
+        entry["attrs"] = attrs
+    # Список общий для потоков (to_thread / threadpool копируют контекст) — append атомарен
+    trace.spans.append(entry)
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """
+    Вложенный спан вокруг участка кода. Вне запроса ничего не делает.
+
+        with span("llm.request", provider="openai", model=model) as attrs:
+            ...
+            attrs["tokens"] = usage.total_tokens
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    span_id = trace.next_id()
+    parent = _current_span.get()
+    token = _current_span.set(span_id)
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        _record(trace, span_id, parent, name, started, time.perf_counter() - started, attrs)
+
+
+def record_span(name: str, started: float, duration: float, **attrs: Any) -> None:
+    """Готовый спан (например, SQL-запрос из событий SQLAlchemy); started — time.perf_counter()"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    _record(trace, trace.next_id(), _current_span.get(), name, started, duration, attrs)
+
+
+def log_trace(trace: Trace, status_code: int) -> None:
+    """Структурированный лог запроса: все запросы при TRACE_LOG=all, иначе только медленные"""
+    data = trace.as_dict()
+    data["status"] = status_code
+    if TRACE_LOG == "all" or (TRACE_LOG == "slow" and data["duration_ms"] >= TRACE_SLOW_SECONDS * 1000):
+        print(f"[TRACE] {json.dumps(data, ensure_ascii=False)}")
@@ -0,0 +1,279 @@
+import html
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..config import (
+    TRACK_INDEX_PATH,
+    TRACK_INDEX_QUERY_SIMILARITY,
+    TRACK_INDEX_MIN_SCORE,
+    TRACK_INDEX_MAX_QUERIES,
+    TRACK_INDEX_MAX_TRACKS,
+    TRACK_INDEX_RELAXED_SIMILARITY,
+    TRACK_INDEX_RELAXED_SCORE,
+)
+from ..models.user import SavedSong
+
+# Слова, которые YouTube добавляет к названиям и которые ничего не говорят о треке
+NOISE_TOKENS = {
+    "official", "video", "audio", "music", "lyrics", "lyric", "hd", "hq", "4k", "mv",
+    "clip", "клип", "ft", "feat", "prod", "remastered", "visualizer",
+}
+
+
+def normalize(text: str) -> List[str]:
+    """Слова без регистра, диакритики, HTML-сущностей, пунктуации и шумовых слов"""
+    text = unicodedata.normalize("NFKD", html.unescape(text or "").lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [token for token in re.findall(r"\w+", text) if token not in NOISE_TOKENS]
+
+
+def _saved_song_track(video_id: str, title: str, artist: Optional[str]) -> Dict[str, Any]:
+    """Сохранённая песня в формате результата поиска (обложка — стандартная превью YouTube)"""
+    return {
+        "video_id": video_id,
+        "title": title,
+        "artist": artist,
+        "channel": artist,
+        "thumbnail": f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg",
+    }
+
+
+def trigrams(tokens: Iterable[str]) -> FrozenSet[str]:
+    """Триграммы слов с отбивкой, как в pg_trgm: «rain» → «  r», « ra», «rai», «ain», «in »"""
+    grams: Set[str] = set()
+    for token in tokens:
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+class _TrigramIndex:
+    """Инвертированный индекс триграмма → ключи документов"""
+
+    def __init__(self):
+        self.postings: Dict[str, Set[str]] = {}
+        self.grams: Dict[str, FrozenSet[str]] = {}
+
+    def add(self, key: str, grams: FrozenSet[str]) -> None:
+        self.remove(key)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(key)
+        self.grams[key] = grams
+
+    def remove(self, key: str) -> None:
+        for gram in self.grams.pop(key, ()):
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+
+    def match(self, grams: FrozenSet[str]) -> List[Tuple[str, float, float]]:
+        """(ключ, доля триграмм запроса в документе, сходство Жаккара), лучшие первыми"""
+        overlap: Counter = Counter()
+        for gram in grams:
+            overlap.update(self.postings.get(gram, ()))
+        matches = []
+        for key, common in overlap.items():
+            containment = common / len(grams)
+            jaccard = common / (len(grams) + len(self.grams[key]) - common)
+            matches.append((key, containment, jaccard))
+        matches.sort(key=lambda match: (match[1], match[2]), reverse=True)
+        return matches
+
+
+class TrackIndex:
+    """
+    Локальный индекс найденных и сохранённых треков (video_id, название, канал/артист).
+
+    Наполняется ответами YouTube search (record) и сохранёнными песнями
+    (refresh_saved_songs), хранится в JSON-файле. Поиск — по триграммам
+    нормализованных слов: запрос, почти совпадающий с уже заданным, или точно
+    узнаваемый трек отвечаются без обращения к API (100 единиц квоты за search.list).
+    """
+
+    def __init__(self, path: str = TRACK_INDEX_PATH, save_interval: float = 30.0, refresh_interval: float = 600.0):
+        self.path = path
+        self.save_interval = save_interval
+        self.refresh_interval = refresh_interval
+        self._last_refresh: Optional[float] = None
+        self._lock = threading.Lock()
+        # video_id -> результат поиска (title, channel, thumbnail, duration_seconds...)
+        self._tracks: Dict[str, Dict[str, Any]] = {}
+        # нормализованный запрос -> video_id в порядке выдачи API
+        self._queries: Dict[str, List[str]] = {}
+        self._track_grams = _TrigramIndex()
+        self._query_grams = _TrigramIndex()
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for track in data.get("tracks", {}).values():
+                self._add_track(track)
+            for query, video_ids in data.get("queries", {}).items():
+                self._add_query(query, video_ids)
+            print(f"[TRACK_INDEX] Загружено {len(self._tracks)} треков, {len(self._queries)} запросов")
+        except Exception as e:
+            print(f"[TRACK_INDEX] Не удалось загрузить индекс: {e}")
+
+    def save(self, force: bool = False) -> None:
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._last_save < self.save_interval):
+                return
+            # Сериализуем под блокировкой: record() из других потоков меняет словари индекса
+            payload = json.dumps({"tracks": self._tracks, "queries": self._queries}, ensure_ascii=False)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Уникальный временный файл — параллельные save() не мешают друг другу
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".track_index-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    # --- наполнение ---
+
+    def _add_track(self, track: Dict[str, Any]) -> None:
+        video_id = track["video_id"]
+        existing = self._tracks.pop(video_id, None)
+        if existing is not None:
+            # Поля, которых нет в новом ответе, оставляем от прошлого
+            track = {**existing, **{key: value for key, value in track.items() if value is not None}}
+        self._tracks[video_id] = track
+        text = " ".join(filter(None, [track.get("title"), track.get("artist"), track.get("channel")]))
+        self._track_grams.add(video_id, trigrams(normalize(text)))
+        # Вытесняются треки, которые дольше всех не встречались в выдаче
+        while len(self._tracks) > TRACK_INDEX_MAX_TRACKS:
+            oldest = next(iter(self._tracks))
+            del self._tracks[oldest]
+            self._track_grams.remove(oldest)
+        self._dirty = True
+
+    def _add_query(self, query: str, video_ids: List[str]) -> None:
+        self._queries.pop(query, None)
+        self._queries[query] = video_ids
+        self._query_grams.add(query, trigrams(query.split()))
+        # Самые старые запросы вытесняются первыми
+        while len(self._queries) > TRACK_INDEX_MAX_QUERIES:
+            oldest = next(iter(self._queries))
+            del self._queries[oldest]
+            self._query_grams.remove(oldest)
+        self._dirty = True
+
+    def record(self, query: str, results: List[Dict[str, Any]]) -> None:
+        """
+        Запоминает ответ YouTube search: сами треки и какой запрос к ним привёл.
+        Может записать файл индекса — из async-кода вызывать через asyncio.to_thread
+        """
+        tokens = normalize(query)
+        with self._lock:
+            for result in results:
+                self._add_track(dict(result))
+            if tokens and results:
+                self._add_query(" ".join(tokens), [result["video_id"] for result in results])
+        self.save()
+
+    def add_saved_song(self, video_id: str, title: str, artist: Optional[str]) -> None:
+        with self._lock:
+            # Найденный через поиск трек уже описан полнее — канал, длительность, просмотры
+            if video_id in self._tracks:
+                return
+            self._add_track(_saved_song_track(video_id, title, artist))
+        self.save()
+
+    def refresh_saved_songs(self, db: Session, limit: int = 5000, force: bool = False) -> None:
+        """Синхронный запрос к БД и запись файла — из async-кода вызывать через asyncio.to_thread"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+                return
+            self._last_refresh = now
+        rows = (
+            db.query(SavedSong.youtube_video_id, SavedSong.title, SavedSong.artist)
+            .distinct()
+            .order_by(SavedSong.youtube_video_id)
+            .limit(limit)
+            .all()
+        )
+        with self._lock:
+            for video_id, title, artist in rows:
+                if video_id not in self._tracks:
+                    self._add_track(_saved_song_track(video_id, title, artist))
+        self.save()
+
+    # --- поиск ---
+
+    @staticmethod
+    def _covers(known: List[str], tokens: List[str]) -> bool:
+        """Каждое слово запроса есть среди слов известного запроса (или начинает одно из них — запрос недопечатан)"""
+        return all(any(word.startswith(token) for word in known) for token in tokens)
+
+    def lookup(self, query: str, n: int = 25, relaxed: bool = False, min_results: int = 1) -> Optional[Dict[str, Any]]:
+        """
+        Ответ без API или None, если уверенности нет:
+        - почти тот же запрос уже задавался (сходство триграмм >= TRACK_INDEX_QUERY_SIMILARITY
+          и в нём есть все слова нового запроса) — отдаём его выдачу;
+        - иначе все слова запроса (не меньше двух) есть в названиях хотя бы min_results
+          известных треков — отдаём такие треки.
+        relaxed — пороги TRACK_INDEX_RELAXED_*, годится и одно слово, и меньше
+        min_results треков (когда API недоступен).
+        """
+        tokens = normalize(query)
+        if not tokens:
+            return None
+        grams = trigrams(tokens)
+        query_similarity = TRACK_INDEX_RELAXED_SIMILARITY if relaxed else TRACK_INDEX_QUERY_SIMILARITY
+        min_score = TRACK_INDEX_RELAXED_SCORE if relaxed else TRACK_INDEX_MIN_SCORE
+        with self._lock:
+            for key, _, similarity in self._query_grams.match(grams)[:1]:
+                # «drake hotline bling remix» похож на «drake hotline bling», но это другой запрос
+                if similarity >= query_similarity and (relaxed or self._covers(key.split(), tokens)):
+                    tracks = [dict(self._tracks[video_id]) for video_id in self._queries[key] if video_id in self._tracks]
+                    if tracks:
+                        return {"results": tracks[:n], "match": "query", "matched_query": key, "score": round(similarity, 3)}
+            # Одно слово («lofi») слишком общее — такой запрос лучше отдать API
+            if len(tokens) < 2 and not relaxed:
+                return None
+            confident = [
+                (video_id, containment) for video_id, containment, _ in self._track_grams.match(grams)
+                if containment >= min_score
+            ]
+            # Один-два узнанных трека — не полная выдача: «drake bling» заслуживает поиска
+            if not confident or (len(confident) < min_results and not relaxed):
+                return None
+            return {
+                "results": [dict(self._tracks[video_id]) for video_id, _ in confident[:n]],
+                "match": "track",
+                "score": round(confident[0][1], 3),
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"tracks": len(self._tracks), "queries": len(self._queries), "trigrams": len(self._track_grams.postings)}
+
+
+# Общий экземпляр на процесс
+track_index = TrackIndex()
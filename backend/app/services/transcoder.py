@@ -0,0 +1,137 @@
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Optional
+
+from ..config import TRANSCODE_WORKERS, TRANSCODE_TIMEOUT
+
+AUDIO_CACHE_DIR = "audio_cache"
+VARIANTS_DIR = os.path.join(AUDIO_CACHE_DIR, "variants")
+
+# Качество -> битрейт; "original" — файл как его скачал yt-dlp
+QUALITY_BITRATES = {"low": "48k", "medium": "96k"}
+QUALITIES = ["original", *QUALITY_BITRATES]
+
+# Opus — для всех браузеров, кроме Safari; AAC в mp4 (faststart) — для Safari/iOS
+CODECS = {
+    "opus": {"ext": "ogg", "mime": "audio/ogg", "format": "ogg", "args": ["-c:a", "libopus", "-vbr", "on"]},
+    "aac": {"ext": "m4a", "mime": "audio/mp4", "format": "mp4", "args": ["-c:a", "aac", "-movflags", "+faststart"]},
+}
+
+
+def variant_path(video_id: str, quality: str, codec: str) -> str:
+    return os.path.join(VARIANTS_DIR, f"{video_id}.{quality}.{CODECS[codec]['ext']}")
+
+
+def codec_for_user_agent(user_agent: Optional[str]) -> str:
+    """Safari (в том числе все браузеры на iOS) не играет Opus в Ogg — отдаём AAC"""
+    ua = user_agent or ""
+    if "iPhone" in ua or "iPad" in ua:
+        return "aac"
+    if "Safari" in ua and "Chrome" not in ua and "Chromium" not in ua and "Android" not in ua:
+        return "aac"
+    return "opus"
+
+
+def _run_ffmpeg(source: str, target: str, codec: str, bitrate: str) -> str:
+    """Выполняется в процессе пула: перекодирует во временный файл и атомарно переименовывает"""
+    spec = CODECS[codec]
+    tmp_path = f"{target}.part-{os.getpid()}"
+    command = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", source, "-vn", "-map_metadata", "-1", "-ac", "2",
+        *spec["args"], "-b:a", bitrate, "-f", spec["format"], tmp_path,
+    ]
+    try:
+        subprocess.run(command, check=True, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+        os.replace(tmp_path, target)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"ffmpeg: {e.stderr.decode(errors='ignore').strip()[-500:]}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target
+
+
+class Transcoder:
+    """
+    Варианты аудио с меньшим битрейтом (Opus и AAC) на пуле процессов ffmpeg.
+    Результаты лежат в audio_cache/variants и переиспользуются; одинаковые
+    задания внутри процесса объединяются в одно. Пул общий для всей обработки
+    аудио (см. run()).
+    """
+
+    def __init__(self, workers: int = TRANSCODE_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available() -> bool:
+        return shutil.which("ffmpeg") is not None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            os.makedirs(VARIANTS_DIR, exist_ok=True)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def run(self, key: str, fn, *args) -> Future:
+        """Задание для пула процессов; пока задание с тем же key не завершилось, возвращается его Future"""
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = self._executor().submit(fn, *args)
+                self._futures[key] = future
+                future.add_done_callback(lambda f, key=key: self._forget(key, f))
+            return future
+
+    def submit(self, source: str, video_id: str, quality: str, codec: str) -> Future:
+        target = variant_path(video_id, quality, codec)
+        return self.run(target, _run_ffmpeg, source, target, codec, QUALITY_BITRATES[quality])
+
+    def _forget(self, key: str, future: Future) -> None:
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+        if future.exception() is not None:
+            print(f"[TRANSCODE] Ошибка {key}: {future.exception()}")
+
+    def get_variant(self, source: str, video_id: str, quality: str, codec: str, wait: float) -> Optional[str]:
+        """
+        Путь к готовому варианту. Если его нет — ставит перекодирование и ждёт
+        до wait секунд; не успело или ffmpeg недоступен — None (отдаём оригинал).
+        """
+        target = variant_path(video_id, quality, codec)
+        if os.path.exists(target):
+            return target
+        if not self.available():
+            return None
+        try:
+            return self.submit(source, video_id, quality, codec).result(timeout=wait)
+        except FutureTimeoutError:
+            return None
+        except Exception as e:
+            print(f"[TRANSCODE] {video_id} {quality}/{codec}: {e}")
+            return None
+
+    def prewarm(self, source: str, video_id: str) -> None:
+        """Заранее готовит все варианты (после скачивания оригинала), не дожидаясь результата"""
+        if not self.available():
+            return
+        for quality in QUALITY_BITRATES:
+            for codec in CODECS:
+                if not os.path.exists(variant_path(video_id, quality, codec)):
+                    self.submit(source, video_id, quality, codec)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Общий пул перекодирования на процесс
+transcoder = Transcoder()
@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from zoneinfo import ZoneInfo
+
+from ..config import (
+    YOUTUBE_DAILY_QUOTA,
+    YOUTUBE_QUOTA_STALE_AT,
+    YOUTUBE_QUOTA_SHRINK_AT,
+    YOUTUBE_QUOTA_LOCAL_AT,
+)
+from .metrics import registry
+from .shared_cache import shared_cache
+
+# Квота YouTube Data API обнуляется в полночь по тихоокеанскому времени
+PACIFIC = ZoneInfo("America/Los_Angeles")
+
+# Стоимость вызовов в единицах квоты (https://developers.google.com/youtube/v3/determine_quota_cost)
+CALL_COSTS = {
+    "search.list": 100,
+    "videos.list": 1,
+}
+
+# Стадии деградации по мере расхода квоты
+NORMAL = 0   # всё как обычно
+STALE = 1    # отдаём устаревшие записи кеша вместо нового запроса
+SHRINK = 2   # плюс уменьшаем страницу поиска
+LOCAL = 3    # к API не обращаемся, отвечает локальный индекс треков
+STAGE_NAMES = {NORMAL: "normal", STALE: "stale", SHRINK: "shrink", LOCAL: "local"}
+
+# Кроме вызовов API — списание остатка, когда YouTube сам ответил quotaExceeded
+QUOTA_CALLS = list(CALL_COSTS) + ["quota_exceeded"]
+
+QUOTA_KEY_PREFIX = "youtube_quota:v2:"
+
+YOUTUBE_QUOTA_REMAINING = registry.gauge(
+    "vibematch_youtube_quota_remaining_units", "Остаток дневной квоты YouTube Data API"
+)
+YOUTUBE_QUOTA_SPENT = registry.gauge(
+    "vibematch_youtube_quota_spent_units", "Потрачено единиц квоты YouTube за текущие сутки (по Тихоокеанскому времени)", ["call"]
+)
+YOUTUBE_QUOTA_STAGE = registry.gauge(
+    "vibematch_youtube_quota_stage", "Стадия деградации поиска: 0 normal, 1 stale, 2 shrink, 3 local"
+)
+YOUTUBE_DEGRADED_TOTAL = registry.counter(
+    "vibematch_youtube_degraded_responses_total", "Ответы поиска без похода в API из-за квоты", ["source"]
+)
+
+
+def quota_day(now: datetime = None) -> str:
+    return (now or datetime.now(PACIFIC)).astimezone(PACIFIC).date().isoformat()
+
+
+def seconds_until_reset(now: datetime = None) -> int:
+    now = (now or datetime.now(PACIFIC)).astimezone(PACIFIC)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=PACIFIC)
+    return max(1, int((midnight - now).total_seconds()))
+
+
+class YouTubeQuota:
+    """
+    Учёт дневной квоты YouTube Data API. Счётчики по типам вызовов лежат в
+    shared_cache под ключом суток (по Тихоокеанскому времени) — общие для всех
+    воркеров и переживают перезапуск; новые сутки начинаются с нуля сами собой.
+    """
+
+    def __init__(self, daily: int = YOUTUBE_DAILY_QUOTA):
+        self.daily = daily
+
+    @staticmethod
+    def _key(day: str, call: str) -> str:
+        return f"{QUOTA_KEY_PREFIX}{day}:{call}"
+
+    def counters(self) -> Dict[str, int]:
+        day = quota_day()
+        counters = {call: shared_cache.get(self._key(day, call)) for call in QUOTA_CALLS}
+        return {call: units for call, units in counters.items() if units}
+
+    def spent(self, counters: Optional[Dict[str, int]] = None) -> int:
+        return sum((self.counters() if counters is None else counters).values())
+
+    def remaining(self, counters: Optional[Dict[str, int]] = None) -> int:
+        return max(0, self.daily - self.spent(counters))
+
+    def stage(self, counters: Optional[Dict[str, int]] = None) -> int:
+        """
+        Стадия по уже прочитанным счётчикам (counters()) или по свежим из shared_cache.
+        Из async-кода счётчики читать через asyncio.to_thread и передавать сюда.
+        """
+        remaining = self.remaining(counters)
+        left = remaining / self.daily if self.daily > 0 else 0.0
+        # Не хватает даже на один search.list — только локальные ответы
+        if left <= YOUTUBE_QUOTA_LOCAL_AT or remaining < CALL_COSTS["search.list"]:
+            return LOCAL
+        if left <= YOUTUBE_QUOTA_SHRINK_AT:
+            return SHRINK
+        if left <= YOUTUBE_QUOTA_STALE_AT:
+            return STALE
+        return NORMAL
+
+    def spend(self, call: str, units: int = None) -> None:
+        """
+        Списывает стоимость вызова; YouTube берёт её и за запросы, завершившиеся ошибкой.
+        Синхронная запись в shared_cache — из async-кода вызывать через asyncio.to_thread
+        """
+        units = CALL_COSTS[call] if units is None else units
+        # Атомарный инкремент без блокировок; вчерашние счётчики не нужны —
+        # ключ живёт чуть дольше суток
+        shared_cache.incr(self._key(quota_day(), call), units, ttl=2 * 24 * 3600)
+
+    def exhaust(self) -> None:
+        """API ответил quotaExceeded — до сброса считаем квоту израсходованной, что бы ни насчитали мы"""
+        remaining = self.remaining()
+        if remaining > 0:
+            self.spend("quota_exceeded", remaining)
+        print(f"[YOUTUBE] Квота исчерпана, сброс через {seconds_until_reset()} c")
+
+    def status(self) -> Dict[str, Any]:
+        counters = self.counters()
+        spent = sum(counters.values())
+        stage = self.stage(counters)
+        return {
+            "day": quota_day(),
+            "daily": self.daily,
+            "spent": spent,
+            "remaining": max(0, self.daily - spent),
+            "by_call": counters,
+            "stage": STAGE_NAMES[stage],
+            "resets_in_seconds": seconds_until_reset(),
+        }
+
+    def _collect_metrics(self) -> None:
+        counters = self.counters()
+        YOUTUBE_QUOTA_REMAINING.set(max(0, self.daily - sum(counters.values())))
+        for call in set(CALL_COSTS) | set(counters):
+            YOUTUBE_QUOTA_SPENT.set(counters.get(call, 0), call=call)
+        YOUTUBE_QUOTA_STAGE.set(self.stage(counters))
+
+
+# Общий учёт на процесс (сами счётчики — в shared_cache)
+youtube_quota = YouTubeQuota()
+registry.add_collector(youtube_quota._collect_metrics)
@@ -0,0 +1,116 @@
+"""
+Микробенчмарки горячих путей backend: проверка JWT, разбор ответов модели,
+base64 картинок, запросы истории и избранного, кеш поиска YouTube.
+
+    pip install -r benchmarks/requirements.txt
+    pytest benchmarks                          # из каталога backend
+    BENCH_ROWS=100000 pytest benchmarks -k json   # быстрее, на меньшей базе
+"""
+
+import asyncio
+import base64
+import json
+import os
+import time
+
+import pytest
+from fastapi.security import HTTPAuthorizationCredentials
+
+from app.api import recommend
+from app.dependencies import auth_service, get_current_user
+from app.models.user import ChatMessage, SavedSong
+from app.services.llm_parsing import extract_json_object
+from app.services.openai_service import OpenAIService
+from app.services.shared_cache import MemoryBackend, SQLiteBackend
+
+RECOMMENDATIONS = {
+    "recommended_tracks": [
+        {"name": f"Track {i}", "artist": f"Artist {i}", "reason": "Мягкий вокал и спокойный ритм под вечернее настроение"}
+        for i in range(10)
+    ],
+    "explanation": "Подборка спокойных треков с акустикой и лёгкой электроникой. " * 4,
+    "alternative_genres": ["indie", "lo-fi", "acoustic"],
+}
+MOOD = {
+    "mood": "спокойная", "emotions": ["умиротворение", "ностальгия"], "music_genre": "indie",
+    "energy_level": "low", "description": "Закат над морем, тёплые цвета",
+}
+
+# Типичные ответы модели: чистый JSON (structured outputs), JSON в markdown и JSON внутри текста
+MODEL_OUTPUTS = {
+    "plain": json.dumps(RECOMMENDATIONS, ensure_ascii=False),
+    "markdown": "Вот ваши рекомендации:\n```json\n" + json.dumps(RECOMMENDATIONS, ensure_ascii=False, indent=2) + "\n```\nПриятного прослушивания!",
+    "prose": "Конечно! " + json.dumps(MOOD, ensure_ascii=False) + " Надеюсь, это поможет.",
+}
+
+
+# --- авторизация ---
+
+def bench_verify_token(benchmark):
+    token = auth_service.create_access_token({"sub": "bench1"})
+    assert benchmark(auth_service.verify_token, token) == "bench1"
+
+
+def bench_get_current_user(benchmark, bench_db, bench_user):
+    credentials = HTTPAuthorizationCredentials(
+        scheme="Bearer", credentials=auth_service.create_access_token({"sub": bench_user.username})
+    )
+    user = benchmark(get_current_user, credentials, bench_db)
+    assert user.id == bench_user.id
+
+
+# --- разбор ответов модели ---
+
+@pytest.mark.parametrize("kind", list(MODEL_OUTPUTS))
+def bench_extract_json_object(benchmark, kind):
+    assert benchmark(extract_json_object, MODEL_OUTPUTS[kind]) is not None
+
+
+@pytest.mark.parametrize("kind", ["plain", "markdown"])
+def bench_parse_recommendations(benchmark, kind):
+    result = benchmark(OpenAIService._parse_recommendations, MODEL_OUTPUTS[kind])
+    assert len(result["recommended_tracks"]) == 10
+
+
+# --- картинки ---
+
+def bench_base64_10mb_image(benchmark):
+    image = os.urandom(10 * 1024 * 1024)
+    encoded = benchmark(lambda: base64.b64encode(image).decode("utf-8"))
+    assert len(encoded) > len(image)
+
+
+# --- база данных ---
+
+def bench_chat_history_query(benchmark, bench_db, bench_user):
+    # Тот же запрос, что в GET /chat/history
+    benchmark(lambda: bench_db.query(ChatMessage).filter(ChatMessage.user_id == bench_user.id).order_by(ChatMessage.timestamp).all())
+
+
+def bench_saved_songs_query(benchmark, bench_db, bench_user):
+    # Тот же запрос, что в GET /media/saved-songs
+    benchmark(lambda: bench_db.query(SavedSong).filter(SavedSong.user_id == bench_user.id).order_by(SavedSong.date_saved.desc()).all())
+
+
+# --- кеш поиска YouTube ---
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def bench_youtube_search_cache_hit(benchmark, backend, tmp_path, monkeypatch):
+    cache = MemoryBackend() if backend == "memory" else SQLiteBackend(str(tmp_path / "cache.db"))
+    monkeypatch.setattr(recommend, "shared_cache", cache)
+    results = [{"video_id": f"vid{i}", "title": f"Track {i}", "channel": "Artist", "thumbnail": ""} for i in range(5)]
+    for i in range(10_000):
+        cache.set(
+            recommend._search_cache_key(f"query {i}", recommend.YOUTUBE_SEARCH_PAGE_SIZE),
+            {"results": results, "fetched_at": time.time()},
+        )
+    loop = asyncio.new_event_loop()
+    try:
+        # local=False — без локального индекса треков, меряем только кеш
+        response = benchmark(lambda: loop.run_until_complete(
+            recommend.youtube_search(q="Query 5000", max_results=5, local=False, http=None, db=None)
+        ))
+    finally:
+        loop.close()
+    assert response["source"] == "cache"
+    assert response["results"] == results
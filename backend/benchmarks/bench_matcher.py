@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк item-item рекомендателя (app/services/matcher.py) на синтетических данных.
+
+Запуск из каталога backend:
+    python benchmarks/bench_matcher.py --rows 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.matcher import ItemItemMatcher  # noqa: E402
+
+
+def synthetic_rows(n_rows: int, n_users: int, n_items: int, seed: int = 42):
+    """Генерирует (user_id, video_id, title, artist) с zipf-популярностью треков"""
+    rng = np.random.default_rng(seed)
+    users = rng.integers(1, n_users + 1, size=n_rows)
+    items = np.minimum(rng.zipf(1.3, size=n_rows), n_items) - 1
+    for user_id, item in zip(users.tolist(), items.tolist()):
+        yield user_id, f"vid{item:07d}", f"Track {item}", f"Artist {item % 997}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--min-cooccurrence", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"🔍 Синтетика: {args.rows} строк, {args.users} пользователей, {args.items} треков")
+    matcher = ItemItemMatcher(min_cooccurrence=args.min_cooccurrence)
+
+    started = time.perf_counter()
+    matcher.build(synthetic_rows(args.rows, args.users, args.items))
+    print(f"✅ Построение модели: {time.perf_counter() - started:.2f} c, {matcher.stats()}")
+
+    rng = np.random.default_rng(7)
+    item_ids = [f"vid{i:07d}" for i in rng.zipf(1.3, size=args.queries) % args.items]
+    user_ids = rng.integers(1, args.users + 1, size=args.queries).tolist()
+
+    for name, call in (
+        ("similar", lambda i: matcher.similar(item_ids[i], 10)),
+        ("recommend_for_user", lambda i: matcher.recommend_for_user(user_ids[i], 10)),
+    ):
+        latencies = []
+        for i in range(args.queries):
+            t0 = time.perf_counter()
+            call(i)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f"📊 {name}: p50={p50:.2f} мс, p95={p95:.2f} мс, p99={p99:.2f} мс")
+
+
+if __name__ == "__main__":
+    main()
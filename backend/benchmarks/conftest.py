@@ -0,0 +1,78 @@
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.models.user import Base, ChatMessage, SavedSong, User  # noqa: E402
+
+# Отдельная база для бенчмарков: заполняется один раз и переиспользуется между прогонами
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "sqlite:///./data/bench.db")
+BENCH_ROWS = int(os.getenv("BENCH_ROWS", "1000000"))
+BENCH_USERS = int(os.getenv("BENCH_USERS", "10000"))
+CHUNK = 50_000
+
+
+def _fill(connection, model, make_row, total: int) -> None:
+    for start in range(0, total, CHUNK):
+        connection.execute(insert(model), [make_row(i) for i in range(start, min(start + CHUNK, total))])
+
+
+@pytest.fixture(scope="session")
+def bench_engine():
+    if BENCH_DATABASE_URL.startswith("sqlite"):
+        os.makedirs("data", exist_ok=True)
+        engine = create_engine(BENCH_DATABASE_URL, connect_args={"check_same_thread": False})
+    else:
+        engine = create_engine(BENCH_DATABASE_URL)
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        users = connection.execute(func.count(User.id).select()).scalar()
+        messages = connection.execute(func.count(ChatMessage.id).select()).scalar()
+        songs = connection.execute(func.count(SavedSong.id).select()).scalar()
+    if users < BENCH_USERS or messages < BENCH_ROWS or songs < BENCH_ROWS:
+        print(f"\n🌱 Заполняем {BENCH_DATABASE_URL}: {BENCH_USERS} пользователей, по {BENCH_ROWS} сообщений и треков")
+        rng = random.Random(42)
+        base_time = datetime(2024, 1, 1)
+        with engine.begin() as connection:
+            for table in (ChatMessage.__table__, SavedSong.__table__, User.__table__):
+                connection.execute(table.delete())
+            _fill(connection, User, lambda i: {
+                "id": i + 1, "email": f"bench{i}@example.com", "username": f"bench{i}", "hashed_password": "x",
+            }, BENCH_USERS)
+            _fill(connection, ChatMessage, lambda i: {
+                "user_id": rng.randint(1, BENCH_USERS),
+                "role": "user" if i % 2 == 0 else "ai",
+                "content": f"Сообщение {i}: посоветуй музыку под настроение",
+                "timestamp": base_time + timedelta(seconds=i),
+            }, BENCH_ROWS)
+            _fill(connection, SavedSong, lambda i: {
+                "user_id": rng.randint(1, BENCH_USERS),
+                "youtube_video_id": f"vid{rng.randint(0, 200_000):08d}",
+                "title": f"Track {i}",
+                "artist": f"Artist {i % 997}",
+                "date_saved": base_time + timedelta(seconds=i),
+            }, BENCH_ROWS)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def bench_db(bench_engine):
+    db = sessionmaker(autocommit=False, autoflush=False, bind=bench_engine)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def bench_user(bench_db):
+    # Пользователь со средним числом сообщений и треков
+    return bench_db.get(User, BENCH_USERS // 2)
@@ -0,0 +1 @@
+"""Нагрузочные тесты VibeMatch с локальными заглушками внешних API"""
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Локальные заглушки внешних API для нагрузочных тестов: OpenAI chat completions,
+YouTube Data API (search) и Riffusion. Всё на одном порту:
+
+    /v1/chat/completions               — OpenAI (обычный ответ и stream)
+    /youtube/v3/search                 — YouTube search
+    /riffusion/api/generate-music      — Riffusion (постановка задачи и опрос)
+    /riffusion/audio/{request_id}.mp3  — готовое «аудио»
+
+Задержка и доля ошибок задаются на каждый сервис отдельно:
+
+    python -m loadtest.fakes --port 9100 --openai-latency 1.5 --openai-errors 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+@dataclass
+class UpstreamProfile:
+    """Задержка ответа (среднее и разброс, секунды) и доля ответов с ошибкой"""
+    latency: float = 0.0
+    jitter: float = 0.25
+    error_rate: float = 0.0
+
+    async def delay(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(max(0.0, random.gauss(self.latency, self.latency * self.jitter)))
+
+    def fail(self) -> bool:
+        return random.random() < self.error_rate
+
+
+ARTISTS = ["The Weeknd", "Dua Lipa", "Post Malone", "Billie Eilish", "Arctic Monkeys", "Daft Punk", "Adele", "Drake"]
+AUDIO_BYTES = os.urandom(256 * 1024)
+
+
+def _tracks(n: int) -> List[Dict[str, str]]:
+    return [
+        {"name": f"Track {random.randint(1, 5000)}", "artist": random.choice(ARTISTS), "reason": "Подходит под настроение"}
+        for _ in range(n)
+    ]
+
+
+def _completion_content(body: Dict[str, Any]) -> str:
+    messages = body.get("messages") or []
+    content = messages[-1].get("content") if messages else ""
+    # Картинка — запрос анализа настроения, текст — рекомендации или чат
+    if isinstance(content, list):
+        return json.dumps({
+            "mood": "радостная", "emotions": ["счастье", "энергия"], "music_genre": "pop",
+            "energy_level": "high", "description": "Яркий солнечный снимок",
+        }, ensure_ascii=False)
+    if body.get("response_format") or "recommended_tracks" in str(content):
+        return json.dumps({
+            "recommended_tracks": _tracks(5),
+            "explanation": "Подборка под настроение",
+            "alternative_genres": ["indie", "electronic"],
+        }, ensure_ascii=False)
+    return "Привет! Это ответ локальной заглушки OpenAI."
+
+
+def create_app(openai: UpstreamProfile, youtube: UpstreamProfile, riffusion: UpstreamProfile,
+               riffusion_generation_seconds: float = 3.0) -> FastAPI:
+    app = FastAPI(title="VibeMatch load-test fakes")
+    jobs: Dict[str, float] = {}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await openai.delay()
+        if openai.fail():
+            return JSONResponse(
+                status_code=random.choice([429, 500, 503]),
+                content={"error": {"message": "Injected failure", "type": "server_error"}},
+            )
+        model = body.get("model", "gpt-4o")
+        content = _completion_content(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        if body.get("stream"):
+            async def events():
+                for i in range(0, len(content), 24):
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": content[i:i + 24]}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(0.01)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 400, "completion_tokens": 200, "total_tokens": 600},
+        }
+
+    @app.get("/youtube/v3/search")
+    async def youtube_search(q: str = "", maxResults: int = 5):
+        await youtube.delay()
+        if youtube.fail():
+            return JSONResponse(status_code=503, content={"error": {"code": 503, "message": "backendError"}})
+        items = []
+        for i in range(maxResults):
+            video_id = uuid.uuid5(uuid.NAMESPACE_URL, f"{q}/{i}").hex[:11]
+            items.append({
+                "id": {"kind": "youtube#video", "videoId": video_id},
+                "snippet": {
+                    "title": f"{q} ({i + 1})",
+                    "channelTitle": random.choice(ARTISTS),
+                    "thumbnails": {"medium": {"url": f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"}},
+                },
+            })
+        return {"kind": "youtube#searchListResponse", "items": items}
+
+    @app.post("/riffusion/api/generate-music")
+    async def riffusion_generate(request: Request):
+        body = await request.json()
+        await riffusion.delay()
+        if riffusion.fail():
+            return JSONResponse(status_code=500, content={"detail": "Injected failure"})
+        request_id = body.get("request_id")
+        if not request_id:
+            request_id = uuid.uuid4().hex
+            jobs[request_id] = time.monotonic()
+            return {"request_id": request_id, "status": "pending"}
+        started = jobs.get(request_id)
+        if started is None:
+            return {"request_id": request_id, "status": "failed", "details": {"detail": "unknown request_id"}}
+        if time.monotonic() - started < riffusion_generation_seconds:
+            return {"request_id": request_id, "status": "pending"}
+        audio_url = f"{request.base_url}riffusion/audio/{request_id}.mp3"
+        return {"request_id": request_id, "status": "complete", "data": {"data": [{"stream_audio_url": audio_url}]}}
+
+    @app.get("/riffusion/audio/{request_id}.mp3")
+    async def riffusion_audio(request_id: str):
+        await riffusion.delay()
+        return Response(content=AUDIO_BYTES, media_type="audio/mpeg")
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    for name, latency in (("openai", 1.0), ("youtube", 0.15), ("riffusion", 0.2)):
+        parser.add_argument(f"--{name}-latency", type=float, default=latency, help=f"средняя задержка {name}, с")
+        parser.add_argument(f"--{name}-errors", type=float, default=0.0, help=f"доля ошибок {name}, 0..1")
+    parser.add_argument("--jitter", type=float, default=0.25, help="разброс задержки относительно среднего")
+    parser.add_argument("--riffusion-generation", type=float, default=3.0, help="время «генерации» бита, с")
+
+
+def app_from_args(args: argparse.Namespace) -> FastAPI:
+    return create_app(
+        UpstreamProfile(args.openai_latency, args.jitter, args.openai_errors),
+        UpstreamProfile(args.youtube_latency, args.jitter, args.youtube_errors),
+        UpstreamProfile(args.riffusion_latency, args.jitter, args.riffusion_errors),
+        riffusion_generation_seconds=args.riffusion_generation,
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(app_from_args(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
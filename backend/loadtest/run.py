@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест VibeMatch без внешних ключей: поднимает заглушки OpenAI /
+YouTube / Riffusion (loadtest/fakes.py), заполняет отдельную базу
+(loadtest/seed.py), запускает backend против заглушек и гоняет сценарии.
+
+Запуск из каталога backend:
+    python -m loadtest.run                                    # все сценарии
+    python -m loadtest.run --scenario recommend --concurrency 50 --openai-latency 3
+    python -m loadtest.run --save data/loadtest-baseline.json
+    python -m loadtest.run --compare data/loadtest-baseline.json   # код 1 при регрессии
+
+Уже запущенный backend: --target http://localhost:8001 (заглушки и база — на вашей стороне).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from loadtest import fakes, seed  # noqa: E402
+from loadtest.scenarios import audio_fanout, login_storm, print_report, recommendation_burst  # noqa: E402
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SCENARIOS = ["login", "recommend", "audio"]
+
+
+def backend_env(args: argparse.Namespace) -> Dict[str, str]:
+    fakes_url = f"http://127.0.0.1:{args.fakes_port}"
+    env = {k: v for k, v in os.environ.items() if not k.startswith("AZURE_OPENAI")}
+    env.update({
+        "DATABASE_URL": args.database_url,
+        "OPENAI_API_KEY": "loadtest",
+        "OPENAI_BASE_URL": f"{fakes_url}/v1",
+        "YOUTUBE_API_KEY": "loadtest",
+        "YOUTUBE_API_BASE_URL": f"{fakes_url}/youtube/v3",
+        "RIFFUSION_API_KEY": "loadtest",
+        "RIFFUSION_API_URL": f"{fakes_url}/riffusion/api/generate-music",
+        "SECRET_KEY": "loadtest-secret",
+        "PYTHONUNBUFFERED": "1",
+    })
+    return env
+
+
+def wait_ready(url: str, timeout: float = 180.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} не ответил за {timeout} c")
+
+
+def start_processes(args: argparse.Namespace) -> List[subprocess.Popen]:
+    env = backend_env(args)
+    log = open(os.path.join(BACKEND_DIR, "data", "loadtest-backend.log"), "w")
+    fake_args = [
+        "--port", str(args.fakes_port), "--jitter", str(args.jitter),
+        "--riffusion-generation", str(args.riffusion_generation),
+    ]
+    for name in ("openai", "youtube", "riffusion"):
+        fake_args += [f"--{name}-latency", str(getattr(args, f"{name}_latency")),
+                      f"--{name}-errors", str(getattr(args, f"{name}_errors"))]
+    processes = [subprocess.Popen([sys.executable, "-m", "loadtest.fakes", *fake_args], cwd=BACKEND_DIR, env=env)]
+    print("🌱 Заполняем базу...")
+    subprocess.run(
+        [sys.executable, "-m", "loadtest.seed", "--users", str(args.users), "--songs-per-user", str(args.songs_per_user),
+         "--items", str(args.items), "--cached-audio", str(args.cached_audio), "--audio-kb", str(args.audio_kb)],
+        cwd=BACKEND_DIR, env=env, check=True,
+    )
+    print(f"🚀 Запускаем backend на порту {args.port} (лог: data/loadtest-backend.log)")
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    ))
+    wait_ready(f"http://127.0.0.1:{args.fakes_port}/docs")
+    wait_ready(f"http://127.0.0.1:{args.port}/health")
+    return processes
+
+
+async def run_scenarios(args: argparse.Namespace, target: str) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    results: Dict[str, Any] = {}
+    async with httpx.AsyncClient(base_url=target, limits=limits, timeout=args.timeout) as client:
+        for name in (SCENARIOS if args.scenario == "all" else [args.scenario]):
+            print(f"\n▶️  Сценарий {name}: {args.requests} запросов, {args.concurrency} одновременно")
+            if name == "login":
+                stats = await login_storm(client, args.users, args.requests, args.concurrency)
+            elif name == "recommend":
+                stats = await recommendation_burst(client, args.users, args.requests, args.concurrency)
+            else:
+                stats = await audio_fanout(client, args.cached_audio, args.requests, args.concurrency)
+            results[name] = stats.report()
+            print_report(name, results[name])
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Регрессии относительно сохранённого прогона: p95 выросла больше чем на max_regression или ошибок стало больше"""
+    problems = []
+    for scenario, report in results.items():
+        for endpoint, current in report["endpoints"].items():
+            previous = baseline.get(scenario, {}).get("endpoints", {}).get(endpoint)
+            if not previous:
+                continue
+            if previous["p95_ms"] > 0 and current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+                problems.append(f"{scenario} {endpoint}: p95 {previous['p95_ms']} → {current['p95_ms']} мс")
+            if current["error_rate"] > previous["error_rate"] + 0.01:
+                problems.append(f"{scenario} {endpoint}: ошибки {previous['error_rate']:.2%} → {current['error_rate']:.2%}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS + ["all"], default="all")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--target", help="адрес уже запущенного backend (иначе поднимается локально)")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--fakes-port", type=int, default=9100)
+    parser.add_argument("--database-url", default="sqlite:///./data/loadtest.db")
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="сравнить с сохранённым JSON; код 1 при регрессии")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="допустимый рост p95, доля")
+    fakes.add_arguments(parser)
+    seed.add_arguments(parser)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.join(BACKEND_DIR, "data"), exist_ok=True)
+    processes: List[subprocess.Popen] = []
+    try:
+        if not args.target:
+            processes = start_processes(args)
+        target = args.target or f"http://127.0.0.1:{args.port}"
+        results = asyncio.run(run_scenarios(args, target))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Результаты сохранены в {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline, args.max_regression)
+        if problems:
+            print("\n❌ Регрессии производительности:")
+            for problem in problems:
+                print(f"   {problem}")
+            sys.exit(1)
+        print("\n✅ Регрессий относительно базового прогона нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Сценарии нагрузки и сбор статистики: пропускная способность и p50/p95/p99 по эндпоинтам.
+"""
+
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from .seed import PASSWORD, cached_video_ids, user_email
+
+MOODS = [
+    {"mood": "радостная", "emotions": ["счастье", "энергия"], "music_genre": "pop", "description": "Позитивное настроение"},
+    {"mood": "спокойная", "emotions": ["умиротворение"], "music_genre": "ambient", "description": "Вечер дома"},
+    {"mood": "грустная", "emotions": ["ностальгия"], "music_genre": "indie", "description": "Дождь за окном"},
+    {"mood": "энергичная", "emotions": ["драйв"], "music_genre": "electronic", "description": "Тренировка"},
+]
+
+
+class LoadStats:
+    """Задержки и ошибки по эндпоинтам за прогон"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    def record(self, endpoint: str, latency: float, status: str, ok: bool) -> None:
+        self.latencies.setdefault(endpoint, []).append(latency)
+        self.statuses.setdefault(endpoint, {})
+        self.statuses[endpoint][status] = self.statuses[endpoint].get(status, 0) + 1
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    async def call(self, endpoint: str, request: Awaitable[httpx.Response]) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.record(endpoint, time.perf_counter() - started, type(e).__name__, ok=False)
+            return None
+        self.record(endpoint, time.perf_counter() - started, str(response.status_code), ok=response.status_code < 400)
+        return response
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        result: Dict[str, Any] = {"elapsed_seconds": round(elapsed, 2), "endpoints": {}}
+        for endpoint, values in sorted(self.latencies.items()):
+            latencies = np.array(values) * 1000
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            result["endpoints"][endpoint] = {
+                "requests": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "error_rate": round(self.errors.get(endpoint, 0) / len(values), 4),
+                "throughput_rps": round(len(values) / elapsed, 2) if elapsed > 0 else None,
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+                "max_ms": round(float(latencies.max()), 1),
+                "statuses": self.statuses.get(endpoint, {}),
+            }
+        return result
+
+
+def print_report(name: str, report: Dict[str, Any]) -> None:
+    print(f"\n📊 {name}: {report['elapsed_seconds']} c")
+    print(f"{'endpoint':<42} {'req':>6} {'err%':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for endpoint, s in report["endpoints"].items():
+        print(
+            f"{endpoint:<42} {s['requests']:>6} {s['error_rate'] * 100:>5.1f}% {s['throughput_rps']:>8} "
+            f"{s['p50_ms']:>8} {s['p95_ms']:>8} {s['p99_ms']:>8} {s['max_ms']:>8}"
+        )
+
+
+async def run_pool(total: int, concurrency: int, job: Callable[[int], Awaitable[None]]) -> None:
+    """Выполняет total заданий, не больше concurrency одновременно"""
+    counter = iter(range(total))
+
+    async def worker():
+        for index in counter:
+            await job(index)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+
+
+async def login(client: httpx.AsyncClient, stats: LoadStats, user_index: int) -> Optional[str]:
+    response = await stats.call(
+        "POST /users/login",
+        client.post("/users/login", json={"email": user_email(user_index), "password": PASSWORD}),
+    )
+    if response is not None and response.status_code == 200:
+        return response.json().get("access_token")
+    return None
+
+
+async def login_storm(client: httpx.AsyncClient, users: int, requests: int, concurrency: int) -> LoadStats:
+    """Много одновременных входов — нагрузка на bcrypt и пул соединений с БД"""
+    stats = LoadStats()
+    await run_pool(requests, concurrency, lambda i: login(client, stats, random.randrange(users)))
+    stats.finished = time.monotonic()
+    return stats
+
+
+async def recommendation_burst(client: httpx.AsyncClient, users: int, requests: int, concurrency: int) -> LoadStats:
+    """
+    Всплеск рекомендаций как во фронтенде: get-recommendations, затем поиск
+    на YouTube по каждому персональному треку. Каждый виртуальный пользователь — свой аккаунт.
+    """
+    setup = LoadStats()
+    tokens: List[str] = []
+
+    async def prepare(i: int):
+        token = await login(client, setup, i)
+        if token:
+            tokens.append(token)
+
+    await run_pool(min(users, concurrency), concurrency, prepare)
+    if not tokens:
+        raise RuntimeError("Не удалось войти ни одним пользователем — база заполнена (loadtest.seed)?")
+
+    stats = LoadStats()
+
+    async def job(i: int):
+        headers = {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+        response = await stats.call(
+            "POST /chat/get-recommendations",
+            client.post("/chat/get-recommendations", json=random.choice(MOODS), headers=headers),
+        )
+        if response is None or response.status_code != 200:
+            return
+        for track in response.json().get("personal", {}).get("recommended_tracks", [])[:3]:
+            query = f"{track.get('artist') or ''} {track.get('name') or ''}".strip()
+            await stats.call(
+                "GET /recommend/youtube-search",
+                client.get("/recommend/youtube-search", params={"q": query, "max_results": 1}),
+            )
+
+    await run_pool(requests, concurrency, job)
+    stats.finished = time.monotonic()
+    return stats
+
+
+async def audio_fanout(client: httpx.AsyncClient, cached_audio: int, requests: int, concurrency: int) -> LoadStats:
+    """Много клиентов одновременно тянут одни и те же популярные аудиофайлы"""
+    stats = LoadStats()
+    video_ids = cached_video_ids(cached_audio)
+    # Популярность по zipf: первые треки запрашиваются чаще всего
+    weights = [1 / (rank + 1) for rank in range(len(video_ids))]
+
+    async def job(i: int):
+        vid = random.choices(video_ids, weights=weights)[0]
+        await stats.call("GET /recommend/youtube-audio", client.get("/recommend/youtube-audio", params={"video_id": vid}))
+
+    await run_pool(requests, concurrency, job)
+    stats.finished = time.monotonic()
+    return stats
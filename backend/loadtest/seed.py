@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Заполняет базу для нагрузочных тестов: пользователи loaduser{N}@example.com
+с общим паролем, их сохранённые треки (zipf-популярность) и уже скачанные
+аудиофайлы для самых популярных треков, чтобы сценарий audio fan-out не ходил в YouTube.
+
+Запуск из каталога backend (база берётся из DATABASE_URL):
+    DATABASE_URL=sqlite:///./data/loadtest.db python -m loadtest.seed --users 200
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+PASSWORD = "loadtest-password"
+AUDIO_CACHE_DIR = "audio_cache"
+
+
+def user_email(index: int) -> str:
+    return f"loaduser{index}@example.com"
+
+
+def video_id(item: int) -> str:
+    # 11 символов, как у настоящих id YouTube
+    return f"lt{item:09d}"
+
+
+def cached_video_ids(count: int):
+    return [video_id(item) for item in range(count)]
+
+
+def seed(n_users: int, songs_per_user: int, n_items: int, cached_audio: int, audio_kb: int, seed_value: int = 42) -> None:
+    from app.database import SessionLocal, engine
+    from app.models.user import Base, SavedSong, User
+    from app.services.auth_service import AuthService
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        existing = db.query(User).filter(User.email.like("loaduser%@example.com")).count()
+        if existing >= n_users:
+            print(f"✅ База уже заполнена: {existing} пользователей")
+        else:
+            # bcrypt медленный — хешируем общий пароль один раз
+            hashed = AuthService().get_password_hash(PASSWORD)
+            db.bulk_insert_mappings(User, [
+                {"email": user_email(i), "username": f"loaduser{i}", "hashed_password": hashed}
+                for i in range(existing, n_users)
+            ])
+            db.commit()
+            user_ids = [u.id for u in db.query(User.id).filter(User.email.like("loaduser%@example.com"))]
+
+            rng = np.random.default_rng(seed_value)
+            rows = []
+            for user_id in user_ids:
+                items = np.unique(np.minimum(rng.zipf(1.3, size=songs_per_user), n_items) - 1)
+                for item in items.tolist():
+                    rows.append({
+                        "user_id": user_id,
+                        "youtube_video_id": video_id(item),
+                        "title": f"Track {item}",
+                        "artist": f"Artist {item % 97}",
+                    })
+            db.bulk_insert_mappings(SavedSong, rows)
+            db.commit()
+            print(f"✅ Пользователей: {len(user_ids)}, сохранённых треков: {len(rows)}")
+    finally:
+        db.close()
+
+    os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+    payload = os.urandom(audio_kb * 1024)
+    for vid in cached_video_ids(cached_audio):
+        path = os.path.join(AUDIO_CACHE_DIR, f"{vid}.m4a")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(payload)
+    print(f"✅ Аудио в кеше: {cached_audio} файлов по {audio_kb} КБ")
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--songs-per-user", type=int, default=30)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--cached-audio", type=int, default=20)
+    parser.add_argument("--audio-kb", type=int, default=512)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+    seed(args.users, args.songs_per_user, args.items, args.cached_audio, args.audio_kb)
+
+
+if __name__ == "__main__":
+    main()